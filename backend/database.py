@@ -1,5 +1,9 @@
 import os
+from sqlalchemy import inspect
 from sqlmodel import SQLModel, create_engine, Session
+from utils.logger import get_logger
+
+log = get_logger("database")
 
 # 1. Configuration
 # Get the DB URL from environment variable (injected by Docker/K8s)
@@ -13,11 +17,56 @@ connect_args = {}
 if database_url.startswith("sqlite"):
     connect_args["check_same_thread"] = False
 
-engine = create_engine(database_url, echo=True, connect_args=connect_args)
+# Echoing every statement is for local debugging only; production uses the
+# sampled and slow-query logs in utils/slow_query_log.py
+sql_echo = os.getenv("SQL_ECHO", "0") == "1"
+engine = create_engine(database_url, echo=sql_echo, connect_args=connect_args)
+
+# Optional range partitioning of AnalyticsLog by "day" or "month" (Postgres only;
+# see utils/log_partitions.py). Anything else, or another database, means off.
+log_partitioning = os.getenv("ANALYTICS_PARTITIONING", "off").lower()
+if log_partitioning not in ("day", "month") or engine.dialect.name != "postgresql":
+    log_partitioning = None
 
 # 3. Initialization
+def add_missing_columns():
+    """
+    create_all skips tables that already exist, so columns added to existing
+    models later are added here. Only nullable columns, or ones with a
+    server default, can be added to a table that already has rows.
+    """
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(dialect=engine.dialect)}"
+            if column.server_default is not None:
+                default = column.server_default.arg
+                ddl += f" DEFAULT {getattr(default, 'text', default)}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            elif not column.nullable:
+                log.error("Cannot add NOT NULL column without a server default", extra={"table": table.name, "column": column.name})
+                continue
+            try:
+                with engine.begin() as conn:
+                    conn.exec_driver_sql(ddl)
+            except Exception as e:
+                # Another worker may have added it first
+                log.warning("Adding column failed", extra={"table": table.name, "column": column.name, "error": str(e)})
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    add_missing_columns()
+    # Likewise, indexes added to existing models later have to be created explicitly
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
 # 4. Dependency Injection
 def get_session():
@@ -1,17 +1,105 @@
 import os
+import hmac
+from functools import partial
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from database import create_db_and_tables
+from database import create_db_and_tables, engine
+from utils.session_reaper import session_reaper
+from utils.notification_retention import notification_retention
+from utils.ingestion import ingestor
+from utils.live_tail import live_tail
+from utils.rollups import rollup_engine
+from utils.user_activity import user_activity
+from utils.archiver import ArchiveManager
+from utils.scheduler import scheduler
+from utils.log_partitions import log_partitions
+from utils.latency import LatencyMiddleware
+from utils.logger import log_pipeline
+from utils.sql_profiler import sql_profiler, SqlProfilerMiddleware
+from utils.slow_query_log import slow_query_log
+from utils.metrics import registry as metrics_registry, instrument_pool, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from utils.context_cache import context_cache
+from utils.company_stats import company_stats
+from utils.cascade_delete import cascade_deleter
+from security import decoded_token_stats
 from routers import auth, events, users, companies, departments, holidays, tags, analytics, superadmin, notifications
 
 # 1. IMPORT YOUR CUSTOM MIDDLEWARE
-from middleware import ContextMiddleware
+from middleware import ContextMiddleware, LogMiddleware, RequestIdMiddleware
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+archive_manager = ArchiveManager()
+
+# Maintenance jobs (cron syntax, UTC); each can be overridden with SCHEDULE_<NAME>
+scheduler.add_job("snapshot", "5 * * * *", analytics.snapshot_engine.take_hourly_snapshot, lease_seconds=3600)
+scheduler.add_job("snapshot_compaction", "20 0 * * *", analytics.snapshot_compactor.compact, lease_seconds=3600)
+scheduler.add_job("archive_logs", "30 3 * * *", partial(archive_manager.archive_logs, ARCHIVE_AFTER_DAYS), lease_seconds=3600)
+scheduler.add_job("rollup_prune", "15 * * * *", rollup_engine.prune)
+scheduler.add_job("session_reaper", "0 * * * *", session_reaper.reap)
+scheduler.add_job("notification_retention", "45 2 * * *", notification_retention.purge)
+if log_partitions.mode:
+    scheduler.add_job("log_partitions", "10 0 * * *", log_partitions.ensure_partitions)
+
+# Prometheus metrics read at scrape time (the hot paths only bump plain counters).
+# Scrapers authenticate with METRICS_TOKEN; without one, only loopback clients get them
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+LOOPBACK_HOSTS = ("127.0.0.1", "::1")
+instrument_pool(engine)
+sql_profiler.instrument(engine)
+slow_query_log.instrument(engine)
+company_stats.instrument()
+
+def _hit_ratio(hits: int, misses: int) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+metrics_registry.callback(
+    "zamannegar_cache_hit_ratio", "Hit ratio since process start", lambda: [
+        (("context_payload",), _hit_ratio(context_cache.hits, context_cache.misses)),
+        (("decoded_token",), _hit_ratio(decoded_token_stats["hits"], decoded_token_stats["misses"]))
+    ], labelnames=("cache",)
+)
+metrics_registry.callback(
+    "zamannegar_cache_requests_total", "Cache lookups by result", lambda: [
+        (("context_payload", "hit"), context_cache.hits), (("context_payload", "miss"), context_cache.misses),
+        (("decoded_token", "hit"), decoded_token_stats["hits"]), (("decoded_token", "miss"), decoded_token_stats["misses"])
+    ], labelnames=("cache", "result"), kind="counter"
+)
+metrics_registry.callback("zamannegar_ingest_queue_depth", "Analytics events waiting to be flushed", lambda: ingestor.stats()["queue_depth"])
+metrics_registry.callback(
+    "zamannegar_ingest_events_total", "Analytics events by outcome", lambda: [
+        (("enqueued",), ingestor.enqueued), (("flushed",), ingestor.flushed), (("dropped",), ingestor.dropped),
+        (("rejected",), ingestor.rejected)
+    ], labelnames=("outcome",), kind="counter"
+)
+metrics_registry.callback("zamannegar_ingest_flush_failures_total", "Failed analytics flushes", lambda: ingestor.flush_failures, kind="counter")
+metrics_registry.callback(
+    "zamannegar_log_records_lost_total", "Log records not written", lambda: [
+        (("queue_full",), log_pipeline.handler.dropped), (("rate_limited",), log_pipeline.rate_limit.suppressed)
+    ], labelnames=("reason",), kind="counter"
+)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    log_pipeline.start()
     create_db_and_tables()
+    log_partitions.setup()
+    ingestor.add_flush_listener(rollup_engine.apply)
+    ingestor.add_flush_listener(user_activity.apply)
+    ingestor.add_commit_listener(live_tail.publish)
+    ingestor.start()
+    # Resumes deletions left unfinished by a previous run
+    cascade_deleter.start()
+    scheduler.start()
     yield
+    await scheduler.stop()
+    await run_in_threadpool(cascade_deleter.stop)
+    # Drain buffered analytics before the worker exits
+    await run_in_threadpool(ingestor.stop)
+    # Last, so shutdown messages are written too
+    log_pipeline.stop()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -22,7 +110,14 @@ origins = [
 ]
 
 
+# Inside ContextMiddleware, so the request's user is known when sampling
+app.add_middleware(LogMiddleware)
 app.add_middleware(ContextMiddleware)
+# Outside ContextMiddleware so its cost counts toward the measured latency
+app.add_middleware(LatencyMiddleware)
+app.add_middleware(SqlProfilerMiddleware)
+# Outermost (bar CORS), so everything logged during a request carries its id
+app.add_middleware(RequestIdMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,7 +125,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-Session-ID", "X-Company-ID"]
+    expose_headers=["X-Session-ID", "X-Company-ID", "Server-Timing", "X-DB-Queries", "X-Request-ID"]
 )
 
 app.include_router(auth.router, prefix="/auth", tags=["Auth"])
@@ -46,4 +141,15 @@ app.include_router(notifications.router, prefix="/notifications", tags=["Notific
 
 @app.get("/")
 def read_root():
-    return {"message": "ZamanNegar API is running"}
\ No newline at end of file
+    return {"message": "ZamanNegar API is running"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics(request: Request):
+    if METRICS_TOKEN:
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+            raise HTTPException(status_code=401, detail="Not authorized")
+    elif not request.client or request.client.host not in LOOPBACK_HOSTS:
+        # Route traffic, pool and ingest internals aren't public
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(metrics_registry.exposition(), media_type=METRICS_CONTENT_TYPE)
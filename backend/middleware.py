@@ -1,13 +1,24 @@
+import json
+import time
+from uuid import uuid4
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from sqlmodel import Session, select
-from database import engine 
-from models import CompanyProfile, User
-import jwt
-import os
+from database import engine
+from models import Company, User
+from security import decode_token, principal_from_claims, active_profiles
+from utils.ingestion import ingestor
+from utils.log_sampling import sampling_policy
+from utils.latency import route_template
+from utils.logger import get_logger, request_id_var
 
-SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_THIS_TO_A_LONG_RANDOM_STRING")
-ALGORITHM = "HS256"
+log = get_logger("middleware")
+
+def _company_open(company_id: int) -> bool:
+    """False for companies that don't exist or are being deleted."""
+    with Session(engine) as session:
+        company = session.get(Company, company_id)
+        return company is not None and company.deleting_at is None
 
 class ContextMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
@@ -19,46 +30,159 @@ class ContextMiddleware(BaseHTTPMiddleware):
 
         # 2. Extract Auth Token
         auth_header = request.headers.get("Authorization")
-        
+
         if auth_header and auth_header.startswith("Bearer "):
             token = auth_header.split(" ")[1]
             try:
-                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+                payload = decode_token(token)
                 username = payload.get("sub")
-                
-                # DB Lookup
-                with Session(engine) as session:
-                     user = session.exec(select(User).where(User.username == username)).first()
-                     if user:
-                         request.state.user = user
-                         
-                         # 3. Handle Context Switching (Company Selection)
-                         company_id_header = request.headers.get("X-Company-ID")
-                         if company_id_header and company_id_header.isdigit():
-                             company_id = int(company_id_header)
-                             
-                             # Check if user belongs to this company OR is Superadmin
-                             if user.is_superadmin:
-                                 request.state.company_id = company_id
-                                 request.state.role = "superadmin"
-                             else:
-                                 # Regular User Verification
-                                 profile = session.exec(
-                                     select(CompanyProfile).where(
-                                         CompanyProfile.user_id == user.id,
-                                         CompanyProfile.company_id == company_id
-                                     )
-                                 ).first()
-                                 
-                                 if profile:
-                                     request.state.company_id = profile.company_id
-                                     request.state.department_id = profile.department_id
-                                     request.state.role = profile.role
-                                 
+                company_id_header = request.headers.get("X-Company-ID")
+
+                # Fast path: trusted context claims, no DB round trip
+                principal = principal_from_claims(payload)
+                if principal:
+                    request.state.user = principal
+                    if company_id_header and company_id_header.isdigit():
+                        company_id = int(company_id_header)
+                        if principal.is_superadmin:
+                            if _company_open(company_id):
+                                request.state.company_id = company_id
+                                request.state.role = "superadmin"
+                        else:
+                            # Claims never include a company being deleted (members' tokens are reissued)
+                            profile = next((p for p in principal.profiles if p.company_id == company_id), None)
+                            if profile:
+                                request.state.company_id = profile.company_id
+                                request.state.department_id = profile.department_id
+                                request.state.role = profile.role
+                else:
+                    # DB Lookup
+                    with Session(engine) as session:
+                         user = session.exec(select(User).where(User.username == username)).first()
+                         if user and not user.deleting_at:
+                             request.state.user = user
+
+                             # 3. Handle Context Switching (Company Selection)
+                             if company_id_header and company_id_header.isdigit():
+                                 company_id = int(company_id_header)
+
+                                 # Check if user belongs to this company OR is Superadmin
+                                 if user.is_superadmin:
+                                     if _company_open(company_id):
+                                         request.state.company_id = company_id
+                                         request.state.role = "superadmin"
+                                 else:
+                                     # Regular User Verification (companies being deleted don't count)
+                                     profiles = active_profiles(session, user.id, company_id)
+                                     profile = profiles[0] if profiles else None
+
+                                     if profile:
+                                         request.state.company_id = profile.company_id
+                                         request.state.department_id = profile.department_id
+                                         request.state.role = profile.role
+
             except Exception as e:
                 # Token invalid or DB error - Continue as anonymous
-                print(f"Middleware Auth Error: {e}")
-                pass 
+                log.warning("Middleware auth error", extra={"error": str(e)})
 
         response = await call_next(request)
-        return response
\ No newline at end of file
+        return response
+
+
+class RequestIdMiddleware:
+    """
+    Pure ASGI: gives every request an id (a sane incoming X-Request-ID is
+    kept) in a ContextVar, so log lines written while handling it carry
+    it, and returns it as X-Request-ID.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        request_id = incoming if 0 < len(incoming) <= 64 and incoming.isprintable() else uuid4().hex
+        token = request_id_var.set(request_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
+
+class LogMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        request_id = request_id_var.get()
+        start_time = time.time()
+        
+        # --- HELPER: Queue for the batched writer ---
+        def save_log_to_db(event_type: str, details: dict, user_id: int = None, sample_weight: int = 1):
+            try:
+                # IMPORTANT: Convert details dict to string immediately
+                details_str = json.dumps(details, default=str)
+                # Path, status and latency also go to their own columns for filtering
+                ingestor.enqueue(
+                    event_type, details_str, user_id,
+                    path=details.get("path"), status=details.get("status"), latency_ms=details.get("latency"),
+                    sample_weight=sample_weight
+                )
+            except Exception as db_err:
+                log.error("Queueing request log failed", extra={"error": str(db_err), "event_type": event_type})
+
+        # Process Request
+        try:
+            response = await call_next(request)
+            process_time = (time.time() - start_time) * 1000
+            
+            # --- LOGIC UPDATE: NOISE FILTER ---
+            # Don't log static files, nextjs internals, OR analytics calls
+            # This ensures the log viewer doesn't fill up with "Get Logs" requests
+            is_noise = any(x in request.url.path for x in ["_next", "favicon.ico", "static", "/analytics/"])
+            
+            if request.url.path.startswith("/") and not is_noise:
+                # Sampled under load; errors, slow requests and watched users always get through
+                user = getattr(request.state, "user", None)
+                weight = sampling_policy.weight(
+                    request.method, route_template(request.scope), response.status_code,
+                    process_time, user.id if user else None
+                )
+                if weight:
+                    save_log_to_db(
+                        "API_REQ", 
+                        {
+                            "method": request.method,
+                            "path": request.url.path,
+                            "status": response.status_code,
+                            "latency": round(process_time, 2),
+                            "ip": request.client.host if request.client else "unknown",
+                            "request_id": request_id
+                        },
+                        sample_weight=weight
+                    )
+            
+            return response
+            
+        except Exception as e:
+            process_time = (time.time() - start_time) * 1000
+            
+            # Log Error to DB
+            save_log_to_db(
+                "ERROR", 
+                {
+                    "path": request.url.path,
+                    "error": str(e),
+                    "latency": round(process_time, 2),
+                    "request_id": request_id
+                }
+            )
+            
+            log.exception("Request failed", extra={"error": str(e)})
+            raise e
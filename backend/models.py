@@ -1,9 +1,10 @@
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from sqlmodel import SQLModel, Field, Relationship
-from sqlalchemy import Column, JSON
+from sqlalchemy import Column, JSON, Index, LargeBinary, UniqueConstraint
 from enum import Enum
 import uuid
+from database import log_partitioning
 
 # --- Enums ---
 class Role(str, Enum):
@@ -49,6 +50,8 @@ class User(SQLModel, table=True):
     is_superadmin: bool = Field(default=False)
     is_profile_complete: bool = Field(default=False)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Set when a cascade deletion starts; the user is hidden until the row is gone
+    deleting_at: Optional[datetime] = None
     
     profiles: List["CompanyProfile"] = Relationship(back_populates="user")
     sessions: List["UserSession"] = Relationship(back_populates="user")
@@ -57,16 +60,31 @@ class User(SQLModel, table=True):
     notifications: List["Notification"] = Relationship(back_populates="recipient")
 
 class UserSession(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_usersession_user_id_last_active", "user_id", "last_active"),
+    )
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
     token_hash: str = Field(index=True)
     device_fingerprint: Optional[str] = None
     ip_address: Optional[str] = None
     geo_location: Optional[str] = None
-    last_active: datetime = Field(default_factory=datetime.utcnow)
+    last_active: datetime = Field(default_factory=datetime.utcnow, index=True)
     preferences: Dict[str, Any] = Field(default={}, sa_column=Column(JSON))
     user: User = Relationship(back_populates="sessions")
 
+class MembershipVersion(SQLModel, table=True):
+    # Bumped on any write that changes a user's contexts; embedded in access tokens
+    # No FK: the row must outlive a deleted user so stale tokens are still caught
+    user_id: int = Field(primary_key=True)
+    version: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+class RevokedSession(SQLModel, table=True):
+    # Kept only as long as an access token can live
+    session_id: uuid.UUID = Field(primary_key=True)
+    revoked_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
 class CompanyInvitation(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     target_phone: str = Field(index=True)
@@ -95,6 +113,8 @@ class Company(SQLModel, table=True):
     name: str = Field(index=True)
     settings: str = "{}" 
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Set when a cascade deletion starts; the company is hidden until the row is gone
+    deleting_at: Optional[datetime] = None
     departments: List["Department"] = Relationship(back_populates="company")
     profiles: List["CompanyProfile"] = Relationship(back_populates="company")
     events: List["Event"] = Relationship(back_populates="company")
@@ -185,7 +205,7 @@ class Notification(SQLModel, table=True):
     message: str
     is_read: bool = False
     reference_id: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
     recipient: User = Relationship(back_populates="notifications")
 
 class Holiday(SQLModel, table=True):
@@ -212,8 +232,107 @@ class Tag(SQLModel, table=True):
     status: str = Field(default="pending")
 
 class AnalyticsLog(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
+    # Keyset pagination walks (created_at, id) newest first, optionally within one filter value
+    __table_args__ = (
+        Index("ix_analyticslog_created_at_id", "created_at", "id"),
+        Index("ix_analyticslog_event_type_created_at_id", "event_type", "created_at", "id"),
+        Index("ix_analyticslog_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_analyticslog_path_created_at_id", "path", "created_at", "id"),
+        # Snapshots delete everything up to a watermark id, so SQLite must never
+        # hand those ids out again. Partitioned tables need the partition key in the primary key
+        {"sqlite_autoincrement": True, **({"postgresql_partition_by": "RANGE (created_at)"} if log_partitioning else {})},
+    )
+    id: Optional[int] = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": True})
     event_type: str = Field(index=True)
     details: Optional[str] = None
     user_id: Optional[int] = Field(default=None, foreign_key="user.id")
-    created_at: datetime = Field(default_factory=datetime.utcnow)
\ No newline at end of file
+    created_at: datetime = Field(default_factory=datetime.utcnow, primary_key=bool(log_partitioning))
+    # Promoted from `details` for request events so they can be filtered in SQL
+    path: Optional[str] = None
+    status: Optional[int] = None
+    latency_ms: Optional[float] = None
+    # Sampled request logs stand for this many requests; counts are scaled by it
+    sample_weight: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+
+class AnalyticsRollup(SQLModel, table=True):
+    # Pre-aggregated AnalyticsLog counts per minute ('m'), hour ('h') and day ('d')
+    __table_args__ = (
+        UniqueConstraint("granularity", "bucket_start", "event_type", name="uq_rollup_bucket"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    granularity: str = Field(index=True)
+    bucket_start: datetime = Field(index=True)
+    event_type: str
+    count: int = 0
+    error_count: int = 0
+    latency_count: int = 0
+    latency_sum: float = 0.0
+    latency_hist: List[int] = Field(default=[], sa_column=Column(JSON))
+    # HyperLogLog registers for distinct users (hour/day rows only)
+    users_sketch: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
+
+class UserActivity(SQLModel, table=True):
+    # Per-user AnalyticsLog totals, maintained incrementally on each ingest flush
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    total_actions: int = Field(default=0, index=True)
+    actions_by_type: Dict[str, int] = Field(default={}, sa_column=Column(JSON))
+    first_seen: datetime
+    last_active: datetime = Field(index=True)
+
+class CompanyStats(SQLModel, table=True):
+    # Per-company counts for the superadmin dashboard, refreshed by utils/company_stats.
+    # No foreign key: a stats row must never block deleting its company
+    company_id: int = Field(primary_key=True)
+    user_count: int = Field(default=0, index=True)
+    department_count: int = Field(default=0, index=True)
+    event_total: int = Field(default=0, index=True)
+    approved: int = 0
+    pending: int = Field(default=0, index=True)
+    rejected: int = 0
+    cancelled: int = 0
+    refreshed_at: datetime = Field(default_factory=datetime.utcnow)
+
+# --- 5. Maintenance Jobs ---
+class JobLease(SQLModel, table=True):
+    # One row per scheduled job; whoever holds an unexpired lease runs it
+    name: str = Field(primary_key=True)
+    owner: str
+    acquired_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime
+    # Schedule slot last claimed, so each slot runs on exactly one worker
+    last_slot: Optional[datetime] = None
+
+class DeletionJob(SQLModel, table=True):
+    # A company or user being removed in chunks by utils/cascade_delete.
+    # Progress is committed with every chunk, so a job resumes where it stopped
+    __table_args__ = (
+        Index("ix_deletionjob_target_type_target_id", "target_type", "target_id"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    target_type: str # company | user
+    target_id: int
+    target_name: Optional[str] = None
+    requested_by: Optional[int] = None
+    status: str = Field(default="pending", index=True) # pending | running | success | error
+    step: Optional[str] = None
+    deleted: Dict[str, int] = Field(default={}, sa_column=Column(JSON))
+    owner: Optional[str] = None
+    heartbeat_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+class JobRun(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_jobrun_job_name_started_at", "job_name", "started_at"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job_name: str
+    owner: str
+    trigger: str = Field(default="schedule") # schedule | manual
+    status: str = Field(default="running") # running | success | error
+    started_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    finished_at: Optional[datetime] = None
+    duration_ms: Optional[float] = None
+    result: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON))
+    error: Optional[str] = None
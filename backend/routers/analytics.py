@@ -1,41 +1,166 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select, func, desc, or_
-from typing import Optional, List, Dict, Any
-from datetime import datetime, timedelta
-from database import get_session
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session, select, func, desc, or_, and_
+from typing import Optional, List, Dict, Any, Union, Tuple
+from datetime import datetime, timedelta, timezone
+import json
+import time
+import zlib
+from database import get_session, engine
 from models import AnalyticsLog, User, Event, Department, EventStatus
-from security import get_current_user, get_current_user_optional
-from pydantic import BaseModel
+from security import get_current_user, get_current_user_optional, resolve_user_optional, oauth2_scheme
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from utils.snapshot_engine import SnapshotEngine
+from utils.snapshot_compactor import SnapshotCompactor
+from utils.ingestion import ingestor
+from utils.rollups import rollup_engine, RETENTION as ROLLUP_RETENTION
+from utils.time_buckets import BUCKET_WIDTHS, label_for
+from utils.user_activity import user_activity
+from utils.archiver import ARCHIVE_DIR
+from utils.block_archive import ArchiveIndex
+from utils.latency import latency_registry
+from utils.live_tail import live_tail, LogFilter, serialize, sse, status_range
+from utils.log_sampling import sampling_policy
 
 router = APIRouter()
 snapshot_engine = SnapshotEngine()
+snapshot_compactor = SnapshotCompactor(snapshot_engine.storage_path)
+archive_index = ArchiveIndex([ARCHIVE_DIR, snapshot_engine.storage_path])
 
 # --- DTOs ---
 class LogCreate(BaseModel):
     event_type: str
     details: Optional[str] = None
 
+MAX_BATCH_EVENTS = 500
+MAX_BATCH_BYTES = 2 * 1024 * 1024
+# Client clocks are trusted only within this window; otherwise server time is used
+CLIENT_TS_MAX_AGE = timedelta(hours=24)
+CLIENT_TS_MAX_SKEW = timedelta(minutes=5)
+# Upper bound for `ts`: the end of year 9999, the last instant a datetime can hold
+CLIENT_TS_MAX_MS = 253402300799999
+
+class ClientEvent(BaseModel):
+    event_type: str = Field(max_length=50)
+    details: Optional[Union[str, Dict[str, Any]]] = None
+    ts: Optional[float] = Field(None, allow_inf_nan=False, ge=0, le=CLIENT_TS_MAX_MS) # Client epoch milliseconds
+
+class ClientEventBatch(BaseModel):
+    events: List[ClientEvent] = Field(max_length=MAX_BATCH_EVENTS)
+    # sendBeacon can't set headers, so beacons carry the token in the body
+    token: Optional[str] = None
+
+batch_adapter = TypeAdapter(ClientEventBatch)
+
+def _decode_batch_body(raw: bytes, content_encoding: str) -> ClientEventBatch:
+    # Gzip: either declared, or sniffed from the magic bytes (beacons can't declare it)
+    if "gzip" in content_encoding or raw[:2] == b"\x1f\x8b":
+        inflater = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        raw = inflater.decompress(raw, MAX_BATCH_BYTES)
+        if inflater.unconsumed_tail:
+            raise HTTPException(status_code=413, detail="Batch too large")
+
+    data = json.loads(raw)
+    if isinstance(data, list):
+        data = {"events": data}
+    return batch_adapter.validate_python(data)
+
+def _client_time(ts: Optional[float], now: datetime) -> datetime:
+    if ts is None:
+        return now
+    try:
+        client_dt = datetime.fromtimestamp(ts / 1000, tz=timezone.utc).replace(tzinfo=None)
+    except (ValueError, OverflowError, OSError):
+        return now
+    if now - CLIENT_TS_MAX_AGE <= client_dt <= now + CLIENT_TS_MAX_SKEW:
+        return client_dt
+    return now
+
 # --- BASIC LOGGING & STATS ---
 
 @router.post("/log")
 def log_event(
     log_data: LogCreate,
-    session: Session = Depends(get_session),
     current_user: Optional[User] = Depends(get_current_user_optional) 
 ):
     user_id = current_user.id if current_user else None
     details_str = log_data.details if log_data.details else "{}"
     
-    log = AnalyticsLog(
-        event_type=log_data.event_type,
-        details=details_str,
-        user_id=user_id
-    )
-    session.add(log)
-    session.commit()
+    # Buffered; the ingestor bulk-inserts in the background
+    ingestor.enqueue(log_data.event_type, details_str, user_id)
     return {"status": "logged"}
 
+@router.post("/log/batch")
+async def log_event_batch(request: Request):
+    """
+    Accepts up to MAX_BATCH_EVENTS client events in one request.
+    Body: JSON array or {"events": [...], "token": "..."}; optionally gzipped.
+    Sent as application/json by the app, or text/plain by navigator.sendBeacon.
+    """
+    raw = await request.body()
+    if len(raw) > MAX_BATCH_BYTES:
+        raise HTTPException(status_code=413, detail="Batch too large")
+
+    try:
+        batch = _decode_batch_body(raw, request.headers.get("Content-Encoding", ""))
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False, include_input=False))
+    except (ValueError, zlib.error):
+        raise HTTPException(status_code=400, detail="Malformed batch")
+
+    # Resolve the user once for the whole batch
+    token = batch.token
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        token = auth_header.split(" ")[1]
+
+    def resolve():
+        with Session(engine) as session:
+            return resolve_user_optional(token, session)
+
+    current_user = await run_in_threadpool(resolve) if token else None
+    user_id = current_user.id if current_user else None
+
+    now = datetime.utcnow()
+    rows = [
+        {
+            "event_type": e.event_type,
+            "details": e.details if isinstance(e.details, str) else json.dumps(e.details or {}),
+            "user_id": user_id,
+            "created_at": _client_time(e.ts, now)
+        }
+        for e in batch.events
+    ]
+    accepted = ingestor.enqueue_many(rows)
+    return {"status": "logged", "accepted": accepted, "dropped": len(rows) - accepted}
+
+@router.get("/latency")
+async def get_route_latency(
+    raw: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Server latency per route template: p50/p90/p99, status classes and
+    response size over sliding 1m/5m/1h windows, for this worker.
+    `raw=true` returns the underlying histogram slices instead; payloads from
+    several workers can be combined with utils.latency.summarize().
+    """
+    # async on purpose: the histograms are only touched from the event loop thread
+    if not current_user.is_superadmin:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if raw:
+        return latency_registry.export()
+    return latency_registry.summary()
+
+@router.get("/ingestion")
+def get_ingestion_stats(
+    current_user: User = Depends(get_current_user)
+):
+    if not current_user.is_superadmin:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return {**ingestor.stats(), "live_tail": live_tail.stats(), "sampling": sampling_policy.stats()}
+
 @router.get("/stats")
 def get_analytics_stats(
     days: int = 7,
@@ -46,17 +171,19 @@ def get_analytics_stats(
         raise HTTPException(status_code=403, detail="Not authorized")
 
     cutoff_date = datetime.utcnow() - timedelta(days=days)
+    day_rows = rollup_engine.rows(session, "d", cutoff_date)
 
-    # 1. DAU (Daily Active Users)
-    dau_query = select(
-        func.date(AnalyticsLog.created_at).label("date"),
-        func.count(func.distinct(AnalyticsLog.user_id))
-    ).where(AnalyticsLog.created_at >= cutoff_date).group_by(func.date(AnalyticsLog.created_at)).order_by("date")
-    dau_results = session.exec(dau_query).all()
+    # 1. DAU (Daily Active Users) - merged HyperLogLog sketches per day
+    rows_by_day: Dict[datetime, list] = {}
+    for r in day_rows:
+        rows_by_day.setdefault(r.bucket_start, []).append(r)
+    dau_results = [(day.date(), rollup_engine.distinct_users(rows)) for day, rows in sorted(rows_by_day.items())]
     
     # 2. Top Actions
-    actions_query = select(AnalyticsLog.event_type, func.count(AnalyticsLog.id)).where(AnalyticsLog.created_at >= cutoff_date).group_by(AnalyticsLog.event_type)
-    actions_results = session.exec(actions_query).all()
+    action_counts: Dict[str, int] = {}
+    for r in day_rows:
+        action_counts[r.event_type] = action_counts.get(r.event_type, 0) + r.count
+    actions_results = list(action_counts.items())
 
     # 3. Totals
     total_users = session.exec(select(func.count(User.id))).one()
@@ -79,9 +206,10 @@ def get_system_health(
         raise HTTPException(status_code=403, detail="Not authorized")
         
     cutoff = datetime.utcnow() - timedelta(hours=24)
+    hour_rows = rollup_engine.rows(session, "h", cutoff)
     
-    total_reqs = session.exec(select(func.count(AnalyticsLog.id)).where(AnalyticsLog.created_at >= cutoff)).one()
-    total_errors = session.exec(select(func.count(AnalyticsLog.id)).where(AnalyticsLog.created_at >= cutoff, AnalyticsLog.event_type == "ERROR")).one()
+    total_reqs = sum(r.count for r in hour_rows)
+    total_errors = sum(r.error_count for r in hour_rows)
     
     error_rate = (total_errors / total_reqs * 100) if total_reqs > 0 else 0
     
@@ -91,19 +219,224 @@ def get_system_health(
         "active_alerts": total_errors
     }
 
+def _encode_cursor(log: AnalyticsLog) -> str:
+    return f"{log.created_at.isoformat()}|{log.id}"
+
+def _decode_cursor(cursor: str):
+    try:
+        ts, log_id = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(log_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _naive_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt and dt.tzinfo:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+STATUS_PATTERN = "^([1-5]xx|[1-5][0-9]{2})$"
+
+def _log_conditions(event_type: Optional[List[str]], user_id: Optional[int], path: Optional[str],
+                    status: Optional[str], min_latency: Optional[float]) -> list:
+    """SQL side of the log filters shared by /logs and /logs/stream (see LogFilter)."""
+    conditions = []
+    if event_type:
+        conditions.append(AnalyticsLog.event_type.in_(event_type))
+    if user_id is not None:
+        conditions.append(AnalyticsLog.user_id == user_id)
+    if path:
+        conditions.append(AnalyticsLog.path.startswith(path, autoescape=True))
+    if status:
+        low, high = status_range(status)
+        conditions.append(AnalyticsLog.status.between(low, high))
+    if min_latency is not None:
+        conditions.append(AnalyticsLog.latency_ms >= min_latency)
+    return conditions
+
 @router.get("/logs")
 def get_recent_logs(
-    limit: int = 50,
-    offset: int = 0,
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    since_id: Optional[int] = None,
+    event_type: Optional[List[str]] = Query(None),
+    user_id: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    path: Optional[str] = None,
+    status: Optional[str] = Query(None, pattern=STATUS_PATTERN),
+    min_latency: Optional[float] = Query(None, ge=0),
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
+    """
+    Newest-first log explorer with keyset pagination on (created_at, id).
+    - `cursor`: the `next_cursor` of the previous page.
+    - `since_id`: tail mode; only rows newer than the last id the client has
+      (at most `limit` of the newest, with `truncated` set if more arrived).
+    - Filters: event_type (repeatable), user_id, start/end, path prefix,
+      status (e.g. 404 or 5xx) and min_latency in ms. Path, status and latency
+      are the columns filled in by the request logger.
+    """
     if not current_user.is_superadmin:
         raise HTTPException(status_code=403, detail="Not authorized")
-        
-    query = select(AnalyticsLog).order_by(desc(AnalyticsLog.created_at)).limit(limit).offset(offset)
-    logs = session.exec(query).all()
-    return logs
+    if cursor and since_id is not None:
+        raise HTTPException(status_code=400, detail="Use either cursor or since_id")
+
+    # 1. Filters
+    conditions = _log_conditions(event_type, user_id, path, status, min_latency)
+    if start:
+        conditions.append(AnalyticsLog.created_at >= _naive_utc(start))
+    if end:
+        conditions.append(AnalyticsLog.created_at < _naive_utc(end))
+
+    # 2. Position: strictly after the cursor, or newer than the tail id
+    if cursor:
+        ts, log_id = _decode_cursor(cursor)
+        conditions.append(or_(
+            AnalyticsLog.created_at < ts,
+            and_(AnalyticsLog.created_at == ts, AnalyticsLog.id < log_id)
+        ))
+    if since_id is not None:
+        conditions.append(AnalyticsLog.id > since_id)
+
+    # 3. Tail rows come in arrival (id) order: client events may carry older
+    # timestamps, so the newest created_at isn't necessarily the highest id
+    if since_id is not None:
+        order = (desc(AnalyticsLog.id),)
+    else:
+        order = (desc(AnalyticsLog.created_at), desc(AnalyticsLog.id))
+
+    # One extra row tells whether there is another page
+    logs = session.exec(select(AnalyticsLog).where(*conditions).order_by(*order).limit(limit + 1)).all()
+    more = len(logs) > limit
+    logs = logs[:limit]
+
+    if since_id is not None:
+        return {"items": logs, "next_cursor": None, "last_id": logs[0].id if logs else since_id, "truncated": more}
+
+    # The first page hands out the id to start tailing from
+    last_id = session.exec(select(func.max(AnalyticsLog.id))).one() if not cursor else None
+    return {
+        "items": logs,
+        "next_cursor": _encode_cursor(logs[-1]) if more else None,
+        "last_id": last_id,
+        "truncated": False
+    }
+
+# --- LIVE TAIL (SSE) ---
+
+STREAM_HEARTBEAT_SECONDS = 15
+STREAM_RETRY_MS = 3000
+# Rows a resuming client is sent from the DB when the live buffer doesn't reach back far enough
+STREAM_RESUME_LIMIT = 1000
+
+def _stream_access(token: str) -> Optional[bool]:
+    """None for an invalid token, else whether it belongs to a superadmin."""
+    with Session(engine) as session:
+        user = resolve_user_optional(token, session)
+        return None if user is None else bool(user.is_superadmin)
+
+def _stream_backlog(after_id: int, log_filter: LogFilter, conditions: list) -> Tuple[List[dict], bool]:
+    """Events after `after_id` from the live buffer, else from the DB; True if capped at STREAM_RESUME_LIMIT."""
+    buffered = live_tail.replay(after_id, log_filter)
+    if buffered is not None:
+        return buffered, False
+    with Session(engine) as session:
+        rows = session.exec(
+            select(AnalyticsLog).where(*conditions, AnalyticsLog.id > after_id)
+            .order_by(desc(AnalyticsLog.id)).limit(STREAM_RESUME_LIMIT + 1)
+        ).all()
+    return [serialize(r.model_dump()) for r in reversed(rows[:STREAM_RESUME_LIMIT])], len(rows) > STREAM_RESUME_LIMIT
+
+async def _stream_events(log_filter: LogFilter, conditions: list, resume_id: Optional[int]):
+    # Subscribing here rather than in the endpoint means a stream that never
+    # starts never holds a slot
+    sub = live_tail.subscribe(log_filter)
+    if sub is None:
+        yield sse({"detail": "Too many live streams"}, "error")
+        return
+    try:
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+
+        # 1. Catch up from the client's last id. Subscribed first, so nothing
+        # committed meanwhile is missed; overlap is skipped by id below
+        sent_id = resume_id or 0
+        if resume_id is not None:
+            backlog, truncated = await run_in_threadpool(_stream_backlog, resume_id, log_filter, conditions)
+            if truncated:
+                yield sse({"reason": "resume"}, "gap")
+            if backlog:
+                sent_id = backlog[-1]["id"]
+                yield sse(backlog, "logs", sent_id)
+
+        # 2. Live: batches as they're published, counters once per second,
+        # and a comment line when idle so proxies keep the connection open
+        stats_second = int(time.time()) - 1
+        lost = 0
+        last_write = time.monotonic()
+        while True:
+            events = await sub.next(1 - time.time() % 1)
+            if events:
+                events = [e for e in events if e["id"] > sent_id]
+                if events:
+                    sent_id = events[-1]["id"]
+                    last_write = time.monotonic()
+                    yield sse(events, "logs", sent_id)
+            if sub.lost != lost:
+                yield sse({"reason": "slow_client", "missed": sub.lost - lost}, "gap")
+                lost = sub.lost
+            for counters in live_tail.counters_since(stats_second):
+                stats_second = counters["second"]
+                last_write = time.monotonic()
+                yield sse(counters, "stats")
+            if time.monotonic() - last_write >= STREAM_HEARTBEAT_SECONDS:
+                last_write = time.monotonic()
+                yield ": ping\n\n"
+    finally:
+        live_tail.unsubscribe(sub)
+
+@router.get("/logs/stream")
+async def stream_logs(
+    request: Request,
+    event_type: Optional[List[str]] = Query(None),
+    user_id: Optional[int] = None,
+    path: Optional[str] = None,
+    status: Optional[str] = Query(None, pattern=STATUS_PATTERN),
+    min_latency: Optional[float] = Query(None, ge=0),
+    last_event_id: Optional[int] = Query(None, ge=0),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Server-Sent Events live tail, fed by the ingestor through the in-process
+    pub/sub (so it only carries this worker's events).
+    - `logs` events: a JSON array of new rows matching the /logs filters; the
+      SSE id is the last row's id.
+    - `stats` events: per-second counters of everything published.
+    - `gap` events: rows were skipped (resume past STREAM_RESUME_LIMIT, or
+      the client fell behind); reload /logs to fill in.
+    Resume with the Last-Event-ID header, or `last_event_id` (e.g. the
+    `last_id` of the first /logs page) on the first connect. Auth is checked
+    once on connect, and no DB session is held while streaming.
+    """
+    access = await run_in_threadpool(_stream_access, token)
+    if access is None:
+        raise HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+    if not access:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if live_tail.stats()["subscribers"] >= live_tail.max_subscribers:
+        raise HTTPException(status_code=503, detail="Too many live streams", headers={"Retry-After": "30"})
+
+    header_id = request.headers.get("last-event-id", "")
+    resume_id = int(header_id) if header_id.isdigit() else last_event_id
+
+    log_filter = LogFilter(event_type, user_id, path, status, min_latency)
+    conditions = _log_conditions(event_type, user_id, path, status, min_latency)
+    return StreamingResponse(
+        _stream_events(log_filter, conditions, resume_id),
+        media_type="text/event-stream",
+        # No proxy buffering (nginx), no caching
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # --- ADVANCED INTELLIGENCE ---
 
@@ -131,50 +464,42 @@ def get_fusion_breakdown(
         ]
     return data
 
+# Default bucket width per range
+TIMELINE_RANGES = {"1h": (timedelta(hours=1), "1m"), "24h": (timedelta(hours=24), "1h"),
+                   "7d": (timedelta(days=7), "1h"), "30d": (timedelta(days=30), "1d")}
+TIMELINE_MAX_POINTS = 2000
+
 @router.get("/fusion/timeline")
 def get_fusion_timeline(
-    range: str = "24h",
+    range_key: str = Query("24h", alias="range", pattern="^(1h|24h|7d|30d)$"),
+    bucket: Optional[str] = Query(None, pattern="^(1m|5m|1h|1d)$"),
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    """Returns activity over time for Area Charts"""
+    """
+    Returns activity over time for Area Charts: one point per bucket (gap-filled),
+    bucketed in SQL over the rollups. `bucket` defaults to a width that suits the range.
+    """
     if not current_user.is_superadmin:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    now = datetime.utcnow()
-    if range == "7d":
-        start_date = now - timedelta(days=7)
-    else:
-        start_date = now - timedelta(hours=24)
-
-    logs = session.exec(
-        select(AnalyticsLog.created_at, AnalyticsLog.event_type)
-        .where(AnalyticsLog.created_at >= start_date)
-        .order_by(AnalyticsLog.created_at)
-    ).all()
-
-    buckets = {}
-    for i in range(24):
-        h_key = (now - timedelta(hours=i)).strftime("%H:00")
-        buckets[h_key] = {"total": 0, "error": 0}
-
-    for log in logs:
-        key = log.created_at.strftime("%H:00")
-        if key in buckets:
-            buckets[key]["total"] += 1
-            if log.event_type == "ERROR":
-                buckets[key]["error"] += 1
-    
-    sorted_data = []
-    for i in range(23, -1, -1):
-        h_key = (now - timedelta(hours=i)).strftime("%H:00")
-        sorted_data.append({
-            "date": h_key,
-            "total": buckets[h_key]["total"],
-            "error": buckets[h_key]["error"]
-        })
+    span, default_bucket = TIMELINE_RANGES[range_key]
+    width = BUCKET_WIDTHS[bucket or default_bucket]
+    if span.total_seconds() / width > TIMELINE_MAX_POINTS:
+        raise HTTPException(status_code=400, detail="Too many buckets for this range")
+    if width < 3600 and span > ROLLUP_RETENTION["m"]:
+        raise HTTPException(status_code=400, detail="Minute buckets only cover the last 2 days")
 
-    return sorted_data
+    now = datetime.utcnow()
+    return [
+        {
+            "date": label_for(p["bucket_start"], width, span),
+            "timestamp": p["bucket_start"],
+            "total": p["total"],
+            "error": p["errors"]
+        }
+        for p in rollup_engine.series(session, now - span, now, width)
+    ]
 
 @router.get("/system")
 def get_system_snapshot(
@@ -209,38 +534,19 @@ def get_system_snapshot(
 
 @router.get("/users/profiling")
 def get_user_profiling(
+    sort: str = Query("last_active", pattern="^(last_active|total_actions|first_seen|name)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    search: Optional[str] = None,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
+    """Per-user activity from the incrementally maintained UserActivity table."""
     if not current_user.is_superadmin:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    query = (
-        select(
-            User.display_name,
-            User.username,
-            User.is_superadmin,
-            func.count(AnalyticsLog.id).label("total_actions"),
-            func.max(AnalyticsLog.created_at).label("last_active")
-        )
-        .outerjoin(AnalyticsLog, User.id == AnalyticsLog.user_id)
-        .group_by(User.id)
-        .order_by(desc("last_active"))
-    )
-    
-    results = session.exec(query).all()
-
-    return [
-        {
-            "name": r[0],
-            "username": r[1],
-            "role": "SuperAdmin" if r[2] else "User",
-            "total_actions": r[3],
-            "last_active": r[4], 
-            "status": "Active" if r[4] and r[4] > datetime.utcnow() - timedelta(days=30) else "Inactive"
-        }
-        for r in results
-    ]
+    return user_activity.page(session, sort=sort, order=order, limit=limit, offset=offset, search=search)
 
 @router.post("/archive")
 def run_manual_snapshot(
@@ -262,4 +568,42 @@ def get_snapshot_history(
 ):
     if not current_user.is_superadmin:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return snapshot_engine.get_snapshots()
\ No newline at end of file
+    return snapshot_engine.get_snapshots()
+
+@router.post("/snapshots/compact")
+def compact_snapshots(
+    current_user: User = Depends(get_current_user)
+):
+    """Merges closed hours into daily segments and closed days into monthly ones."""
+    if not current_user.is_superadmin:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    result = snapshot_compactor.compact()
+    if result["status"] == "error":
+        raise HTTPException(status_code=500, detail=result["message"])
+    return result
+
+@router.get("/archives/query")
+def query_archives(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    event_type: Optional[List[str]] = Query(None),
+    limit: int = Query(500, ge=1, le=5000),
+    parallel: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Searches cold archives. Blocks are pruned through their sidecar indexes
+    (time range, event types, users), and only the survivors are decompressed.
+    """
+    if not current_user.is_superadmin:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    # Archived timestamps are naive UTC
+    return archive_index.query(
+        start=_naive_utc(start), end=_naive_utc(end), user_id=user_id, event_types=event_type,
+        limit=limit, parallel=parallel
+    )
@@ -1,22 +1,53 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import Session, select
+from sqlmodel import Session, select, desc, col, delete
 from datetime import timedelta
+import math
 import uuid
 
 from database import get_session
 from models import User, UserSession, CompanyProfile, MembershipStatus, CompanyInvitation, Notification, NotificationType
 from security import (
     get_current_user, 
+    get_current_session_id,
     get_password_hash, 
-    verify_password, 
+    verify_password_async, 
     create_access_token, 
+    build_context_claims,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 from utils.localization import to_english_digits, normalize_phone
+from utils.rate_limit import TokenBucketLimiter
+from utils.password_pool import password_pool
+from utils.auth_state import revoke_sessions
+from utils.context_cache import context_cache
 
 router = APIRouter()
 
+MAX_SESSIONS = 5
+
+# --- Login Admission Control ---
+# Checked before any DB or bcrypt work, so a burst can't saturate the hash pool.
+# The IP is the client's as forwarded by nginx; uvicorn only trusts the
+# forwarding headers from the proxy's address (--forwarded-allow-ips)
+login_ip_limiter = TokenBucketLimiter(capacity=20, refill_per_sec=20 / 60)
+login_user_limiter = TokenBucketLimiter(capacity=5, refill_per_sec=5 / 60)
+
+def _check_login_admission(client_ip: str, username: str):
+    # A rejected attempt must not use up the other bucket: the per-user one
+    # goes first, and its token is returned if the IP bucket then refuses
+    retry_after = login_user_limiter.try_acquire(username)
+    if retry_after <= 0:
+        retry_after = login_ip_limiter.try_acquire(client_ip)
+        if retry_after > 0:
+            login_user_limiter.refund(username)
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts. Please wait and try again.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
 # 1. LOGIN
 @router.post("/token")
 async def login_for_access_token(
@@ -27,6 +58,9 @@ async def login_for_access_token(
     # Normalize inputs
     username = to_english_digits(form_data.username).lower()
     password = to_english_digits(form_data.password)
+    client_ip = request.client.host if request.client else 'unknown'
+
+    _check_login_admission(client_ip, username)
 
     # Try finding by username
     user = session.exec(select(User).where(User.username == username)).first()
@@ -36,7 +70,7 @@ async def login_for_access_token(
         normalized_phone = normalize_phone(username)
         user = session.exec(select(User).where(User.phone_number == normalized_phone)).first()
 
-    if not user or not verify_password(password, user.hashed_password):
+    if not user or user.deleting_at or not await verify_password_async(password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -45,18 +79,20 @@ async def login_for_access_token(
     
     # --- SESSION LOGIC (Restored) ---
     # 1. Manage Active Sessions (Limit 5)
-    active_sessions = session.exec(
-        select(UserSession)
+    # Keep the newest MAX_SESSIONS - 1; served by the (user_id, last_active) index
+    evicted_ids = session.exec(
+        select(UserSession.id)
         .where(UserSession.user_id == user.id)
-        .order_by(UserSession.last_active)
+        .order_by(desc(UserSession.last_active))
+        .offset(MAX_SESSIONS - 1)
     ).all()
     
-    if len(active_sessions) >= 5:
-        session.delete(active_sessions[0])
+    if evicted_ids:
+        revoke_sessions(session, evicted_ids)
+        session.exec(delete(UserSession).where(col(UserSession.id).in_(evicted_ids)))
     
     # 2. Create New Session
     new_session_id = uuid.uuid4()
-    client_ip = request.client.host if request.client else 'unknown'
     
     new_session = UserSession(
         id=new_session_id,
@@ -71,24 +107,18 @@ async def login_for_access_token(
     # 3. Generate Token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username, "session_id": str(new_session_id), "is_superadmin": user.is_superadmin},
+        data={
+            "sub": user.username,
+            "session_id": str(new_session_id),
+            "is_superadmin": user.is_superadmin,
+            **build_context_claims(session, user)
+        },
         expires_delta=access_token_expires
     )
     
     # --- CONTEXT LOGIC (Fixed Serialization) ---
-    # Fetch profiles with company data eagerly if possible, or just access attributes
-    # We explicitly transform this to the shape frontend expects
-    profiles = [p for p in user.profiles if p.status == MembershipStatus.ACTIVE]
-    
-    available_contexts = []
-    for p in profiles:
-        available_contexts.append({
-            "company_id": p.company_id,
-            # Handle potential missing company relationship if lazy loaded
-            "company_name": p.company.name if p.company else "Organization", 
-            "role": p.role,
-            "department_id": p.department_id
-        })
+    # One joined query for profiles + company names, cached per membership version
+    available_contexts = context_cache.get_contexts(session, user.id, active_only=True)
 
     return {
         "access_token": access_token, 
@@ -162,19 +192,8 @@ def read_users_me(
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
-    profiles = session.exec(
-        select(CompanyProfile).where(CompanyProfile.user_id == current_user.id)
-    ).all()
-    
-    available_contexts = [
-        {
-            "company_id": p.company_id, 
-            "company_name": p.company.name if p.company else "Unknown",
-            "role": p.role,
-            "department_id": p.department_id
-        } 
-        for p in profiles
-    ]
+    # Served from cache on every app bootstrap; no query unless memberships changed
+    available_contexts = context_cache.get_contexts(session, current_user.id)
 
     return {
         "id": current_user.id,
@@ -182,4 +201,74 @@ def read_users_me(
         "display_name": current_user.display_name,
         "is_superadmin": current_user.is_superadmin,
         "available_contexts": available_contexts 
-    }
\ No newline at end of file
+    }
+
+# 4. HASHING POOL METRICS
+@router.get("/pool-metrics")
+def get_pool_metrics(current_user: User = Depends(get_current_user)):
+    if not current_user.is_superadmin:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    return {
+        "password_pool": password_pool.stats(),
+        "login_admission": {
+            "per_ip": login_ip_limiter.stats(),
+            "per_username": login_user_limiter.stats()
+        }
+    }
+
+# 5. SESSION MANAGEMENT
+def _serialize_session(s: UserSession, current_id: str) -> dict:
+    return {
+        "id": str(s.id),
+        "ip_address": s.ip_address,
+        "device_fingerprint": s.device_fingerprint,
+        "geo_location": s.geo_location,
+        "last_active": s.last_active,
+        "is_current": str(s.id) == current_id
+    }
+
+@router.get("/sessions")
+def list_my_sessions(
+    current_user: User = Depends(get_current_user),
+    current_session_id: str = Depends(get_current_session_id),
+    session: Session = Depends(get_session)
+):
+    sessions = session.exec(
+        select(UserSession)
+        .where(UserSession.user_id == current_user.id)
+        .order_by(desc(UserSession.last_active))
+    ).all()
+    return [_serialize_session(s, current_session_id) for s in sessions]
+
+@router.delete("/sessions/{session_id}")
+def revoke_my_session(
+    session_id: uuid.UUID,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    target = session.get(UserSession, session_id)
+    if not target or target.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    revoke_sessions(session, [target.id])
+    session.delete(target)
+    session.commit()
+    return {"ok": True}
+
+@router.post("/sessions/revoke-others")
+def revoke_other_sessions(
+    current_user: User = Depends(get_current_user),
+    current_session_id: str = Depends(get_current_session_id),
+    session: Session = Depends(get_session)
+):
+    other_ids = session.exec(
+        select(UserSession.id).where(UserSession.user_id == current_user.id)
+    ).all()
+    other_ids = [sid for sid in other_ids if str(sid) != current_session_id]
+
+    if other_ids:
+        revoke_sessions(session, other_ids)
+        session.exec(delete(UserSession).where(col(UserSession.id).in_(other_ids)))
+        session.commit()
+    return {"ok": True, "revoked": len(other_ids)}
@@ -1,5 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlmodel import Session, select, func
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
+from sqlmodel import Session, select, func, col
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 from datetime import datetime, timedelta
@@ -11,6 +11,9 @@ from models import (
 )
 from security import get_current_user
 from utils.recurrence import get_events_in_range
+from utils.auth_state import bump_membership_version, bump_company_members
+from utils.company_stats import company_stats, SORT_FIELDS as COMPANY_SORT_FIELDS
+from utils.cascade_delete import cascade_deleter
 
 router = APIRouter()
 
@@ -33,63 +36,29 @@ class AddMember(BaseModel):
     role: Role
     department_id: Optional[int] = None
 
-class CompanyStats(BaseModel):
-    id: int
-    name: str
-    user_count: int
-    department_count: int
-    event_stats: Dict[str, int]
-
 # ==========================================
 # 1. SUPERADMIN DASHBOARD & STATS
 # ==========================================
 
-@router.get("/superadmin/stats", response_model=List[CompanyStats])
+@router.get("/superadmin/stats")
 def get_companies_stats(
+    sort: str = Query("name", pattern=f"^({'|'.join(COMPANY_SORT_FIELDS)})$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    search: Optional[str] = None,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
+    """
+    Companies with user, department and event counts, as `{items, total}`.
+    Served from the CompanyStats table (see utils/company_stats), so a page
+    costs the same however many companies there are; `sort` takes any metric.
+    """
     if not current_user.is_superadmin:
         raise HTTPException(status_code=403, detail="Superadmin access required")
 
-    companies = session.exec(select(Company)).all()
-    results = []
-
-    for comp in companies:
-        user_count = session.exec(
-            select(func.count(CompanyProfile.id))
-            .where(CompanyProfile.company_id == comp.id)
-        ).one()
-
-        dept_count = session.exec(
-            select(func.count(Department.id))
-            .where(Department.company_id == comp.id)
-        ).one()
-
-        # Count 'Event' rows (Plans/Parents + Singles)
-        event_counts = session.exec(
-            select(Event.status, func.count(Event.id))
-            .where(Event.company_id == comp.id)
-            .group_by(Event.status)
-        ).all()
-        
-        stats_map = {
-            "approved": 0, "pending": 0, "rejected": 0, "cancelled": 0
-        }
-        for status_val, count in event_counts:
-            status_str = status_val.value if hasattr(status_val, 'value') else str(status_val)
-            if status_str in stats_map:
-                stats_map[status_str] = count
-
-        results.append(CompanyStats(
-            id=comp.id,
-            name=comp.name,
-            user_count=user_count,
-            department_count=dept_count,
-            event_stats=stats_map
-        ))
-
-    return results
+    return company_stats.page(session, sort, order, limit, offset, search)
 
 # ==========================================
 # 2. CORE CRUD OPERATIONS
@@ -117,12 +86,12 @@ def list_companies(
     current_user: User = Depends(get_current_user)
 ):
     if current_user.is_superadmin:
-        return session.exec(select(Company)).all()
+        return session.exec(select(Company).where(col(Company.deleting_at).is_(None))).all()
     
     statement = (
         select(Company)
         .join(CompanyProfile)
-        .where(CompanyProfile.user_id == current_user.id)
+        .where(CompanyProfile.user_id == current_user.id, col(Company.deleting_at).is_(None))
     )
     return session.exec(statement).all()
 
@@ -134,7 +103,7 @@ def get_my_companies(
     statement = (
         select(Company)
         .join(CompanyProfile)
-        .where(CompanyProfile.user_id == current_user.id)
+        .where(CompanyProfile.user_id == current_user.id, col(Company.deleting_at).is_(None))
     )
     return session.exec(statement).all()
 
@@ -145,7 +114,7 @@ def get_company(
     current_user: User = Depends(get_current_user)
 ):
     company = session.get(Company, company_id)
-    if not company:
+    if not company or company.deleting_at:
         raise HTTPException(status_code=404, detail="Company not found")
         
     if not current_user.is_superadmin:
@@ -178,6 +147,9 @@ def update_company(
             raise HTTPException(status_code=403, detail="Only Managers can update settings")
     
     if company_data.name:
+        if company_data.name != company.name:
+            # Company names are part of every member's cached contexts
+            bump_company_members(session, company_id)
         company.name = company_data.name
     if company_data.settings:
         company.settings = company_data.settings
@@ -196,20 +168,12 @@ def delete_company(
     if not current_user.is_superadmin:
         raise HTTPException(status_code=403, detail="Only Superadmins can delete companies")
 
-    company = session.get(Company, company_id)
-    if not company:
+    # Hidden right away; members, departments, events etc. are removed in the background
+    job = cascade_deleter.request(session, "company", company_id, requested_by=current_user.id)
+    if not job:
         raise HTTPException(status_code=404, detail="Company not found")
 
-    # Manual Cascade Cleanup
-    session.exec(select(CompanyProfile).where(CompanyProfile.company_id == company_id)).delete()
-    session.exec(select(Department).where(Department.company_id == company_id)).delete()
-    
-    # Cascade events (Single, Recurring, Exceptions)
-    session.exec(select(Event).where(Event.company_id == company_id)).delete()
-
-    session.delete(company)
-    session.commit()
-    return {"ok": True, "message": f"Company {company_id} deleted"}
+    return {"ok": True, "message": f"Company {company_id} is being deleted", "job_id": job.id}
 
 # ==========================================
 # 3. SUB-RESOURCE MANAGEMENT
@@ -246,6 +210,7 @@ def add_member(
         status=MembershipStatus.ACTIVE
     )
     session.add(new_profile)
+    bump_membership_version(session, [member_data.user_id])
     session.commit()
     return {"status": "User added to company"}
 
@@ -266,7 +231,7 @@ def get_company_users(
     results = session.exec(
         select(User, CompanyProfile)
         .join(CompanyProfile)
-        .where(CompanyProfile.company_id == company_id)
+        .where(CompanyProfile.company_id == company_id, col(User.deleting_at).is_(None))
     ).all()
     
     users_data = []
@@ -7,6 +7,7 @@ from datetime import datetime
 from database import get_session
 from models import User, Notification, CompanyProfile, MembershipStatus, NotificationType
 from security import get_current_user
+from utils.auth_state import bump_membership_version
 
 router = APIRouter()
 
@@ -74,6 +75,8 @@ def handle_invite(
     else:
         raise HTTPException(400, "Invalid action")
 
+    bump_membership_version(session, [current_user.id])
+
     # 2. Cleanup related notifications
     ref_id = f"invite_{company_id}"
     notifs = session.exec(select(Notification).where(
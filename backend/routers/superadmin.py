@@ -1,15 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session, select, func
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlmodel import Session, select, func, desc, col
 from pydantic import BaseModel
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from typing import Optional, List, Dict
 
 from database import get_session
 from models import (
     Company, User, Holiday, Department, 
-    CompanyProfile, Role, Event
+    CompanyProfile, Role, Event, UserSession, DeletionJob
 )
-from security import get_current_user, get_password_hash
+from security import get_current_user, get_password_hash, SESSION_EXPIRE_DAYS
+from utils.session_reaper import session_reaper
+from utils.scheduler import scheduler
+from utils.sql_profiler import sql_profiler
+from utils.slow_query_log import slow_query_log
+from utils.cascade_delete import cascade_deleter
 
 router = APIRouter()
 
@@ -63,12 +68,15 @@ def get_global_stats(
     _: User = Depends(get_superadmin_user)
 ):
     """Dashboard Stats for Super Admin"""
+    session_cutoff = datetime.utcnow() - timedelta(days=SESSION_EXPIRE_DAYS)
     return {
-        "total_companies": session.exec(select(func.count(Company.id))).one(),
-        "total_users": session.exec(select(func.count(User.id))).one(),
+        "total_companies": session.exec(select(func.count(Company.id)).where(col(Company.deleting_at).is_(None))).one(),
+        "total_users": session.exec(select(func.count(User.id)).where(col(User.deleting_at).is_(None))).one(),
         # Count all stored events
         "total_events": session.exec(select(func.count(Event.id))).one(),
-        "active_sessions": 0
+        "active_sessions": session.exec(
+            select(func.count(UserSession.id)).where(UserSession.last_active >= session_cutoff)
+        ).one()
     }
 
 # --- 2. Company Management ---
@@ -97,7 +105,7 @@ def get_all_companies(
     session: Session = Depends(get_session),
     _: User = Depends(get_superadmin_user)
 ):
-    return session.exec(select(Company)).all()
+    return session.exec(select(Company).where(col(Company.deleting_at).is_(None))).all()
 
 # --- 3. User & Manager Management ---
 
@@ -224,4 +232,149 @@ def update_global_holiday(
     session.add(holiday)
     session.commit()
     session.refresh(holiday)
-    return holiday
\ No newline at end of file
+    return holiday
+
+# --- 5. Session Management ---
+
+@router.get("/users/{user_id}/sessions")
+def get_user_sessions(
+    user_id: int,
+    session: Session = Depends(get_session),
+    _: User = Depends(get_superadmin_user)
+):
+    sessions = session.exec(
+        select(UserSession)
+        .where(UserSession.user_id == user_id)
+        .order_by(desc(UserSession.last_active))
+    ).all()
+    return [
+        {
+            "id": str(s.id),
+            "ip_address": s.ip_address,
+            "device_fingerprint": s.device_fingerprint,
+            "last_active": s.last_active
+        }
+        for s in sessions
+    ]
+
+@router.post("/sessions/reap")
+def reap_expired_sessions(_: User = Depends(get_superadmin_user)):
+    """Runs the expired-session reaper now and reports what it purged."""
+    return session_reaper.reap()
+
+@router.get("/sessions/reaper")
+def get_reaper_status(_: User = Depends(get_superadmin_user)):
+    return {"last_run": session_reaper.last_run}
+
+# --- Maintenance Jobs ---
+
+@router.get("/jobs")
+def get_jobs(
+    session: Session = Depends(get_session),
+    _: User = Depends(get_superadmin_user)
+):
+    """Scheduled jobs with their lease holder, last run and recent durations."""
+    return scheduler.status(session)
+
+@router.get("/jobs/runs")
+def get_job_runs(
+    name: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    session: Session = Depends(get_session),
+    _: User = Depends(get_superadmin_user)
+):
+    return scheduler.history(session, name, limit)
+
+@router.post("/jobs/{name}/run")
+def run_job_now(
+    name: str,
+    _: User = Depends(get_superadmin_user)
+):
+    if name not in scheduler.jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    run = scheduler.execute(name)
+    if run is None:
+        raise HTTPException(status_code=409, detail="Job is already running")
+    return run
+
+# --- Cascade Deletions ---
+
+@router.get("/deletions")
+def get_deletions(
+    status: Optional[str] = Query(None, pattern="^(pending|running|success|error)$"),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    session: Session = Depends(get_session),
+    _: User = Depends(get_superadmin_user)
+):
+    """Company and user deletions, newest first, with per-table progress."""
+    return cascade_deleter.list_jobs(session, status, limit, offset)
+
+@router.get("/deletions/{job_id}")
+def get_deletion(
+    job_id: int,
+    session: Session = Depends(get_session),
+    _: User = Depends(get_superadmin_user)
+):
+    job = session.get(DeletionJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Deletion not found")
+    return cascade_deleter.describe(job)
+
+@router.post("/deletions/{job_id}/retry")
+def retry_deletion(
+    job_id: int,
+    session: Session = Depends(get_session),
+    _: User = Depends(get_superadmin_user)
+):
+    """Requeues a failed deletion; it reruns every step, skipping quickly over finished ones."""
+    job = session.get(DeletionJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Deletion not found")
+    if job.status != "error":
+        raise HTTPException(status_code=409, detail="Only failed deletions can be retried")
+    return cascade_deleter.describe(cascade_deleter.retry(session, job))
+
+# --- Debug ---
+
+@router.get("/debug/queries")
+def get_worst_requests(
+    limit: int = Query(50, ge=1, le=200),
+    sort: str = Query("db_ms", pattern="^(db_ms|queries|total_ms)$"),
+    _: User = Depends(get_superadmin_user)
+):
+    """
+    Recent requests that were slow on the DB, ran many statements, or repeated
+    one statement shape enough to look like N+1 (this worker only).
+    """
+    return sql_profiler.worst(limit, sort)
+
+@router.delete("/debug/queries")
+def clear_worst_requests(_: User = Depends(get_superadmin_user)):
+    sql_profiler.clear()
+    return {"ok": True}
+
+@router.get("/debug/slow-queries")
+def get_slow_queries(
+    limit: int = Query(50, ge=1, le=500),
+    sort: str = Query("total_ms", pattern="^(total_ms|max_ms|avg_ms|count|last_seen)$"),
+    _: User = Depends(get_superadmin_user)
+):
+    """Statements over SQL_SLOW_QUERY_MS grouped by fingerprint, with plans (this worker only)."""
+    return slow_query_log.entries(limit, sort)
+
+@router.get("/debug/slow-queries/recent")
+def get_recent_slow_queries(limit: int = Query(50, ge=1, le=200), _: User = Depends(get_superadmin_user)):
+    return slow_query_log.recent(limit)
+
+@router.get("/debug/slow-queries/{fingerprint}")
+def get_slow_query(fingerprint: str, _: User = Depends(get_superadmin_user)):
+    entry = slow_query_log.get(fingerprint)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Unknown fingerprint")
+    return entry
+
+@router.delete("/debug/slow-queries")
+def clear_slow_queries(_: User = Depends(get_superadmin_user)):
+    slow_query_log.clear()
+    return {"ok": True}
@@ -1,7 +1,7 @@
 from typing import List, Optional, Union
 from fastapi import APIRouter, Depends, HTTPException, Request, Query, status
 from fastapi.responses import JSONResponse
-from sqlmodel import Session, select
+from sqlmodel import Session, select, col
 from pydantic import BaseModel
 
 from database import get_session
@@ -11,6 +11,8 @@ from models import (
 )
 from security import get_current_user, get_password_hash
 from utils.localization import normalize_phone
+from utils.auth_state import bump_membership_version
+from utils.cascade_delete import cascade_deleter
 
 router = APIRouter()
 
@@ -71,7 +73,7 @@ def read_users(
     results = []
     if current_user.is_superadmin and not request.state.company_id:
         if mode == "memberships":
-            profiles = session.exec(select(CompanyProfile, User).join(User)).all()
+            profiles = session.exec(select(CompanyProfile, User).join(User).where(col(User.deleting_at).is_(None))).all()
             for p, u in profiles:
                 results.append(UserRead(
                     id=u.id, username=u.username, display_name=u.display_name,
@@ -81,7 +83,7 @@ def read_users(
                 ))
             return results
         else:
-            users = session.exec(select(User)).all()
+            users = session.exec(select(User).where(col(User.deleting_at).is_(None))).all()
             for u in users:
                 results.append(UserRead(
                     id=u.id, username=u.username, display_name=u.display_name,
@@ -177,6 +179,7 @@ def invite_user(
                 # Downgrade old manager
                 existing_manager.role = Role.VIEWER
                 session.add(existing_manager)
+                bump_membership_version(session, [existing_manager.user_id])
                 # Notify old manager
                 session.add(Notification(
                     recipient_id=existing_manager.user_id,
@@ -197,6 +200,7 @@ def invite_user(
             if invite_data.role == Role.MANAGER and invite_data.replace_manager:
                 existing.role = Role.MANAGER
                 session.add(existing)
+                bump_membership_version(session, [user.id])
                 session.commit()
                 return {"status": "ok", "message": "Manager replaced"}
             raise HTTPException(400, "User already member")
@@ -209,6 +213,7 @@ def invite_user(
             status=MembershipStatus.PENDING_APPROVAL 
         )
         session.add(profile)
+        bump_membership_version(session, [user.id])
         session.add(Notification(
             recipient_id=user.id, type=NotificationType.COMPANY,
             title="دعوت به همکاری", message=f"شما به یک سازمان دعوت شدید.",
@@ -308,16 +313,13 @@ def delete_user(
     else:
         # SUPERADMIN GLOBAL DELETE
         if current_user.is_superadmin and not company_id:
-            user = session.get(User, user_id)
-            if not user: raise HTTPException(404)
-            
-            # Cascade delete everything
-            session.exec(select(CompanyProfile).where(CompanyProfile.user_id == user_id)).delete()
-            session.exec(select(CompanyInvitation).where(CompanyInvitation.inviter_id == user_id)).delete()
-            # Note: More cascades (events, etc) handled by DB or explicit deletion if needed
-            
-            session.delete(user)
-            session.commit()
+            if user_id == current_user.id:
+                raise HTTPException(400, "Cannot delete yourself")
+
+            # Signed out and hidden right away; profiles, events etc. are removed in the background
+            job = cascade_deleter.request(session, "user", user_id, requested_by=current_user.id)
+            if not job: raise HTTPException(404)
+            return {"ok": True, "job_id": job.id}
         else:
             # MANAGER REMOVE FROM CONTEXT
             if not company_id: raise HTTPException(400, "Context needed to remove user")
@@ -327,6 +329,7 @@ def delete_user(
             )).first()
             if not profile: raise HTTPException(404, "Member not found")
             session.delete(profile)
+            bump_membership_version(session, [user_id])
             session.commit()
             
         return {"ok": True}
@@ -387,5 +390,6 @@ def update_user_context(
         session.add(user)
 
     session.add(profile)
+    bump_membership_version(session, [user_id])
     session.commit()
     return {"ok": True}
\ No newline at end of file
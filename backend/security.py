@@ -1,30 +1,183 @@
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Optional, List
+from collections import OrderedDict
+import threading
+import time
+import uuid
 import jwt
-from jwt.exceptions import PyJWTError
-import bcrypt
+from jwt.exceptions import PyJWTError, ExpiredSignatureError
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlmodel import Session, select
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlmodel import Session, select, update, col
 import os
 
-from database import get_session
-from models import User, UserSession
+from database import get_session, engine
+from models import User, UserSession, Company, CompanyProfile, Role, MembershipStatus
+from utils.password_pool import password_pool, PoolSaturated, bcrypt_verify, bcrypt_hash
+from utils.auth_state import auth_state, get_membership_version
 
 SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_THIS_TO_A_LONG_RANDOM_STRING")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 
 SESSION_EXPIRE_DAYS = 14 
 
+# Opt-in: embed uid/contexts/membership version so most requests skip the DB
+TOKEN_CONTEXT_CLAIMS = os.getenv("TOKEN_CONTEXT_CLAIMS", "0") == "1"
+CLAIMS_TOKEN_VERSION = 2
+MAX_EMBEDDED_CONTEXTS = 50
+# Claims-authorized requests only refresh UserSession.last_active this often
+SESSION_TOUCH_INTERVAL_SEC = 300
+DECODED_TOKEN_CACHE_SIZE = 4096
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+# --- Decoded Token LRU ---
+# Repeat requests with the same token skip the HMAC check and JSON parsing.
+_decoded_tokens = OrderedDict()
+_decoded_lock = threading.Lock()
+decoded_token_stats = {"hits": 0, "misses": 0}
+
+def decode_token(token: str) -> dict:
+    with _decoded_lock:
+        payload = _decoded_tokens.get(token)
+        if payload is not None:
+            _decoded_tokens.move_to_end(token)
+            decoded_token_stats["hits"] += 1
+        else:
+            decoded_token_stats["misses"] += 1
+    if payload is not None:
+        if payload.get("exp", 0) <= time.time():
+            raise ExpiredSignatureError("Signature has expired")
+        return payload
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    with _decoded_lock:
+        _decoded_tokens[token] = payload
+        while len(_decoded_tokens) > DECODED_TOKEN_CACHE_SIZE:
+            _decoded_tokens.popitem(last=False)
+    return payload
+
+# --- Context Claims ---
+
+class ClaimsProfile:
+    """The subset of CompanyProfile that routers read off current_user.profiles."""
+    __slots__ = ("company_id", "role", "department_id", "status", "user_id")
+
+    def __init__(self, user_id: int, claim: list):
+        self.user_id = user_id
+        self.company_id = claim[0]
+        self.role = Role(claim[1])
+        self.department_id = claim[2]
+        self.status = MembershipStatus(claim[3])
+
+class ClaimsUser:
+    """
+    Principal built from a v2 token. Exposes the User fields routers use;
+    anything else falls through to a one-off load of the real row.
+    """
+
+    def __init__(self, payload: dict):
+        self.id = payload["uid"]
+        self.username = payload["sub"]
+        self.display_name = payload.get("dn")
+        self.is_superadmin = payload.get("is_superadmin", False)
+        self.profiles: List[ClaimsProfile] = [ClaimsProfile(self.id, c) for c in payload["ctx"]]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        with Session(engine) as session:
+            user = session.get(User, self.id)
+        if user is None:
+            raise AttributeError(name)
+        return getattr(user, name)
+
+def active_profiles(session: Session, user_id: int, company_id: Optional[int] = None) -> List[CompanyProfile]:
+    """A user's profiles, leaving out companies that are being deleted."""
+    query = (
+        select(CompanyProfile)
+        .join(Company, CompanyProfile.company_id == Company.id)
+        .where(CompanyProfile.user_id == user_id, col(Company.deleting_at).is_(None))
+    )
+    if company_id is not None:
+        query = query.where(CompanyProfile.company_id == company_id)
+    return session.exec(query).all()
+
+def _hide_deleting_companies(session: Session, user: User):
+    # Loaded as if from the DB (no change history), so routers reading
+    # user.profiles never see a company being deleted and nothing is flushed
+    set_committed_value(user, "profiles", active_profiles(session, user.id))
+
+def build_context_claims(session: Session, user: User) -> dict:
+    """Extra claims for a v2 token; empty when disabled or too large to embed."""
+    if not TOKEN_CONTEXT_CLAIMS:
+        return {}
+
+    profiles = active_profiles(session, user.id)
+    if len(profiles) > MAX_EMBEDDED_CONTEXTS:
+        return {}
+
+    return {
+        "ver": CLAIMS_TOKEN_VERSION,
+        "uid": user.id,
+        "dn": user.display_name,
+        "mv": get_membership_version(session, user.id),
+        "ctx": [
+            [p.company_id, Role(p.role).value, p.department_id, MembershipStatus(p.status).value]
+            for p in profiles
+        ],
+    }
+
+def principal_from_claims(payload: dict) -> Optional[ClaimsUser]:
+    """Returns a DB-free principal if the token's claims are still trustworthy."""
+    if payload.get("ver") != CLAIMS_TOKEN_VERSION:
+        return None
+    if auth_state.is_revoked(payload.get("session_id")):
+        return None
+    if not auth_state.is_current(payload["uid"], payload.get("mv", 0)):
+        return None
+    return ClaimsUser(payload)
+
+_session_touches = {}
+
+def _touch_session(session: Session, session_id: str):
+    now = time.monotonic()
+    if now - _session_touches.get(session_id, 0) < SESSION_TOUCH_INTERVAL_SEC:
+        return
+    _session_touches[session_id] = now
+    if len(_session_touches) > DECODED_TOKEN_CACHE_SIZE:
+        _session_touches.clear()
+    session.exec(
+        update(UserSession)
+        .where(UserSession.id == uuid.UUID(session_id))
+        .values(last_active=datetime.utcnow())
+    )
+    session.commit()
+
+def _pool_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy. Please try again shortly.",
+        headers={"Retry-After": "1"},
+    )
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return bcrypt_verify(plain_password, hashed_password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verifies on the bcrypt pool so the event loop stays responsive."""
+    try:
+        return await password_pool.run(bcrypt_verify, plain_password, hashed_password)
+    except PoolSaturated:
+        raise _pool_busy()
 
 def get_password_hash(password: str) -> str:
-    pwd_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(pwd_bytes, salt).decode('utf-8')
+    """Hashes on the bcrypt pool. Safe to call from sync endpoints."""
+    try:
+        return password_pool.run_sync(bcrypt_hash, password)
+    except PoolSaturated:
+        raise _pool_busy()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -48,7 +201,7 @@ def get_current_user(
     )
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         session_id: str = payload.get("session_id")
         
@@ -58,12 +211,22 @@ def get_current_user(
     except PyJWTError:
         raise credentials_exception
 
+    principal = principal_from_claims(payload)
+    if principal:
+        _touch_session(session, session_id)
+        return principal
+
     user = session.exec(select(User).where(User.username == username)).first()
-    if user is None:
+    if user is None or user.deleting_at:
+        raise credentials_exception
+
+    try:
+        session_uuid = uuid.UUID(session_id)
+    except ValueError:
         raise credentials_exception
 
     user_session = session.exec(
-        select(UserSession).where(UserSession.id == session_id)
+        select(UserSession).where(UserSession.id == session_uuid)
     ).first()
 
     if not user_session:
@@ -78,20 +241,27 @@ def get_current_user(
     session.add(user_session)
     session.commit()
 
+    _hide_deleting_companies(session, user)
     return user
 
-async def get_current_user_optional(
-    token: str = Depends(oauth2_scheme), 
-    session: Session = Depends(get_session)
-) -> Optional[User]:
+def get_current_session_id(token: str = Depends(oauth2_scheme)) -> Optional[str]:
+    try:
+        return decode_token(token).get("session_id")
+    except PyJWTError:
+        return None
+
+def resolve_user_optional(token: Optional[str], session: Session) -> Optional[User]:
     """
-    Safely attempts to get the current user. Returns None if ANY check fails.
-    Used by Analytics or public-facing endpoints that change behavior if logged in.
+    Safely attempts to resolve a token to a user. Returns None if ANY check fails.
+    Shared by get_current_user_optional and endpoints that receive the token
+    outside the Authorization header (e.g. sendBeacon payloads).
     """
+    if not token:
+        return None
     try:
         # We manually call the logic to avoid the HTTPException raise
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            payload = decode_token(token)
         except PyJWTError:
             return None
             
@@ -100,19 +270,34 @@ async def get_current_user_optional(
         
         if not username or not session_id:
             return None
+
+        principal = principal_from_claims(payload)
+        if principal:
+            return principal
             
         user = session.exec(select(User).where(User.username == username)).first()
-        if not user:
+        if not user or user.deleting_at:
             return None
             
-        user_session = session.exec(select(UserSession).where(UserSession.id == session_id)).first()
+        user_session = session.exec(select(UserSession).where(UserSession.id == uuid.UUID(session_id))).first()
         if not user_session:
             return None
             
         # Check expiry but don't delete/commit side-effects in a GET (optional) check
         if datetime.utcnow() - user_session.last_active > timedelta(days=SESSION_EXPIRE_DAYS):
             return None
-            
+
+        _hide_deleting_companies(session, user)
         return user
     except Exception:
-        return None
\ No newline at end of file
+        return None
+
+async def get_current_user_optional(
+    token: str = Depends(oauth2_scheme), 
+    session: Session = Depends(get_session)
+) -> Optional[User]:
+    """
+    Safely attempts to get the current user. Returns None if ANY check fails.
+    Used by Analytics or public-facing endpoints that change behavior if logged in.
+    """
+    return resolve_user_optional(token, session)
@@ -1,13 +1,17 @@
 import os
-import gzip
-import json
 from datetime import datetime, timedelta
-from sqlmodel import Session, select, delete
+from sqlmodel import Session, select, delete, func
 from models import AnalyticsLog
 from database import engine
+from utils.block_archive import BlockArchiveWriter
+from utils.log_partitions import log_partitions
+from utils.logger import get_logger
+
+log = get_logger("archiver")
 
 # Use absolute path to ensure we are looking at /app/archives in Docker
 ARCHIVE_DIR = os.path.join(os.getcwd(), "archives")
+ARCHIVE_CHUNK_SIZE = 5000
 
 class ArchiveManager:
     def __init__(self):
@@ -22,61 +26,70 @@ class ArchiveManager:
                 os.makedirs(ARCHIVE_DIR, exist_ok=True)
             self.enabled = True
         except OSError as e:
-            print(f"WARNING: ArchiveManager disabled. Failed to create '{ARCHIVE_DIR}': {e}")
+            log.warning("ArchiveManager disabled: cannot create archive dir", extra={"path": ARCHIVE_DIR, "error": str(e)})
 
     def archive_logs(self, days_older_than: int = 30):
         """
-        Moves logs older than X days from DB to a compressed JSON file.
+        Moves logs older than X days from DB to a block-indexed compressed NDJSON file.
         """
         if not self.enabled:
             return {"status": "error", "message": "Archiving disabled due to file permissions"}
 
         cutoff_date = datetime.utcnow() - timedelta(days=days_older_than)
-        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"logs_archive_{timestamp}.ndjson.gz"
+        filepath = os.path.join(ARCHIVE_DIR, filename)
+
         with Session(engine) as session:
-            # 1. Select Old Logs
-            statement = select(AnalyticsLog).where(AnalyticsLog.created_at < cutoff_date)
-            logs = session.exec(statement).all()
-            
-            if not logs:
+            # 1. Fix the id watermark so rows are archived and deleted exactly once
+            watermark = session.exec(
+                select(func.max(AnalyticsLog.id)).where(AnalyticsLog.created_at < cutoff_date)
+            ).one()
+            if watermark is None:
                 return {"status": "no_data", "count": 0}
 
-            # 2. Prepare Data
-            try:
-                data_to_save = [log.model_dump(mode='json') for log in logs]
-            except Exception as e:
-                 # Fallback for older SQLModel versions
-                 data_to_save = [log.dict() for log in logs]
-            
-            # 3. Write to GZIP File
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"logs_archive_{timestamp}.json.gz"
-            filepath = os.path.join(ARCHIVE_DIR, filename)
-            
+            # 2. Stream into a block-indexed archive (queryable via /analytics/archives/query)
+            writer = BlockArchiveWriter(filepath)
             try:
-                with gzip.open(filepath, 'wt', encoding='UTF-8') as f:
-                    json.dump(data_to_save, f)
+                rows = session.exec(
+                    select(AnalyticsLog)
+                    .where(AnalyticsLog.created_at < cutoff_date, AnalyticsLog.id <= watermark)
+                    .order_by(AnalyticsLog.id)
+                    .execution_options(yield_per=ARCHIVE_CHUNK_SIZE)
+                )
+                for row in rows:
+                    writer.add(row.model_dump(mode='json'))
+                writer.close()
             except OSError as e:
-                print(f"ERROR: Failed to write archive file: {e}")
+                writer.abort()
+                log.error("Failed to write archive file", extra={"error": str(e)})
                 return {"status": "error", "message": f"Write failed: {e}"}
-            
-            # 4. Delete from DB
-            # We delete only after successful write
-            delete_statement = delete(AnalyticsLog).where(AnalyticsLog.created_at < cutoff_date)
+            session.expunge_all()
+
+            # 3. Delete from DB
+            # We delete only after successful write. With partitioning, whole
+            # partitions older than the cutoff are dropped; the row delete then
+            # only finds stragglers (default partition, partly expired periods)
+            dropped = log_partitions.drop_before(cutoff_date, session.connection())
+            delete_statement = delete(AnalyticsLog).where(
+                AnalyticsLog.created_at < cutoff_date, AnalyticsLog.id <= watermark
+            )
             session.exec(delete_statement)
             session.commit()
             
             try:
                 file_size_kb = os.path.getsize(filepath) / 1024
-            except:
+            except OSError:
                 file_size_kb = 0
 
             return {
                 "status": "archived",
-                "count": len(logs),
+                "count": writer.rows,
                 "filename": filename,
+                "blocks": len(writer.blocks),
                 "size_kb": round(file_size_kb, 2),
-                "freed_rows": len(logs)
+                "freed_rows": writer.rows,
+                "dropped_partitions": dropped
             }
 
     def list_archives(self):
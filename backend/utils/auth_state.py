@@ -0,0 +1,136 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from sqlmodel import Session, select, delete
+from database import engine
+from models import MembershipVersion, RevokedSession, CompanyProfile
+from utils.logger import get_logger
+
+log = get_logger("auth_state")
+
+REFRESH_INTERVAL_SEC = float(os.getenv("AUTH_STATE_REFRESH_SECONDS", "5"))
+# Overlap between incremental reads, absorbs clock skew between workers
+REFRESH_OVERLAP = timedelta(seconds=5)
+# Revocations only matter while a token issued for that session can still be valid
+REVOCATION_TTL = timedelta(minutes=30)
+PRUNE_INTERVAL_SEC = 3600
+
+
+class AuthStateCache:
+    """
+    Per-worker copy of membership versions and revoked sessions.
+    Lets a token's embedded claims be trusted without a DB lookup: a token is
+    usable as long as its session isn't revoked and its membership version
+    is still current. Refreshed incrementally every few seconds.
+    """
+
+    def __init__(self):
+        self._versions = {}    # user_id -> version
+        self._revoked = {}     # session_id (str) -> revoked_at
+        self._last_seen = None
+        self._next_refresh = 0.0
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+
+    # --- Reads (hot path) ---
+
+    def is_current(self, user_id: int, version: int) -> bool:
+        self.refresh_if_due()
+        return version >= self._versions.get(user_id, 0)
+
+    def version_of(self, user_id: int) -> int:
+        self.refresh_if_due()
+        return self._versions.get(user_id, 0)
+
+    def is_revoked(self, session_id: str) -> bool:
+        self.refresh_if_due()
+        return session_id in self._revoked
+
+    # --- Local updates (applied before the writer's commit, conservatively) ---
+
+    def note_version(self, user_id: int, version: int):
+        if version > self._versions.get(user_id, 0):
+            self._versions[user_id] = version
+
+    def note_revoked(self, session_id: str):
+        self._revoked[session_id] = datetime.utcnow()
+
+    # --- Refresh ---
+
+    def refresh_if_due(self):
+        if time.monotonic() < self._next_refresh:
+            return
+        # Only one thread refreshes; others keep using the current copy
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._refresh()
+        except Exception as e:
+            log.error("AuthStateCache refresh failed", extra={"error": str(e)})
+        finally:
+            self._next_refresh = time.monotonic() + REFRESH_INTERVAL_SEC
+            self._lock.release()
+
+    def _refresh(self):
+        now = datetime.utcnow()
+        since = self._last_seen - REFRESH_OVERLAP if self._last_seen else None
+
+        with Session(engine) as session:
+            v_query = select(MembershipVersion.user_id, MembershipVersion.version)
+            r_query = select(RevokedSession.session_id, RevokedSession.revoked_at)
+            if since:
+                v_query = v_query.where(MembershipVersion.updated_at >= since)
+                r_query = r_query.where(RevokedSession.revoked_at >= since)
+            else:
+                r_query = r_query.where(RevokedSession.revoked_at >= now - REVOCATION_TTL)
+
+            for user_id, version in session.exec(v_query).all():
+                self.note_version(user_id, version)
+            for session_id, revoked_at in session.exec(r_query).all():
+                self._revoked[str(session_id)] = revoked_at
+
+            if time.monotonic() >= self._next_prune:
+                session.exec(delete(RevokedSession).where(RevokedSession.revoked_at < now - REVOCATION_TTL))
+                session.commit()
+                self._next_prune = time.monotonic() + PRUNE_INTERVAL_SEC
+
+        cutoff = now - REVOCATION_TTL
+        self._revoked = {k: v for k, v in self._revoked.items() if v >= cutoff}
+        self._last_seen = now
+
+
+auth_state = AuthStateCache()
+
+
+# --- Write helpers (caller commits) ---
+
+def get_membership_version(session: Session, user_id: int) -> int:
+    row = session.get(MembershipVersion, user_id)
+    return row.version if row else 0
+
+def bump_membership_version(session: Session, user_ids: Iterable[int]):
+    """Invalidates embedded context claims for these users."""
+    for user_id in set(user_ids):
+        if user_id is None:
+            continue
+        row = session.get(MembershipVersion, user_id)
+        if not row:
+            row = MembershipVersion(user_id=user_id, version=0)
+        row.version += 1
+        row.updated_at = datetime.utcnow()
+        session.add(row)
+        auth_state.note_version(user_id, row.version)
+
+def bump_company_members(session: Session, company_id: int):
+    user_ids = session.exec(
+        select(CompanyProfile.user_id).where(CompanyProfile.company_id == company_id)
+    ).all()
+    bump_membership_version(session, user_ids)
+
+def revoke_sessions(session: Session, session_ids: Iterable[uuid.UUID]):
+    for session_id in session_ids:
+        session.merge(RevokedSession(session_id=session_id, revoked_at=datetime.utcnow()))
+        auth_state.note_revoked(str(session_id))
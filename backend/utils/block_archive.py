@@ -0,0 +1,436 @@
+import os
+import sys
+import gzip
+import json
+import base64
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+# Rows per independently compressed block
+BLOCK_ROWS = int(os.getenv("ARCHIVE_BLOCK_ROWS", "2000"))
+# Up to this many distinct users a block lists them exactly; above it, a bloom filter
+EXACT_USERS_MAX = 64
+BLOOM_BITS_PER_USER = 10
+BLOOM_HASHES = 7
+QUERY_WORKERS = int(os.getenv("ARCHIVE_QUERY_WORKERS", str(min(4, os.cpu_count() or 1))))
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+
+
+# --- Bloom filter (user ids) ---
+
+def _bloom_positions(value, m: int, k: int):
+    digest = hashlib.blake2b(str(value).encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:], "big") | 1
+    return [(h1 + i * h2) % m for i in range(k)]
+
+def _bloom_build(values) -> dict:
+    m = max(64, len(values) * BLOOM_BITS_PER_USER)
+    bits = bytearray((m + 7) // 8)
+    for v in values:
+        for p in _bloom_positions(v, m, BLOOM_HASHES):
+            bits[p >> 3] |= 1 << (p & 7)
+    return {"m": m, "k": BLOOM_HASHES, "bits": base64.b64encode(bytes(bits)).decode()}
+
+def _bloom_contains(bloom: dict, value) -> bool:
+    bits = base64.b64decode(bloom["bits"])
+    return all(bits[p >> 3] & (1 << (p & 7)) for p in _bloom_positions(value, bloom["m"], bloom["k"]))
+
+
+# --- Writing ---
+
+class BlockArchiveWriter:
+    """
+    Writes rows as gzip NDJSON where every BLOCK_ROWS rows form a separate gzip
+    member. The concatenation is still a plain .ndjson.gz (zcat reads it), but
+    each block can also be decompressed on its own from its byte range. The
+    sidecar `<file>.idx` records, per block: offset/length, time range, id range,
+    event types and users (exact list, or a bloom filter when there are many).
+
+    Data goes to `<file>.tmp` and the index is written last, so a file with an
+    index is always complete.
+    """
+
+    def __init__(self, path: str, block_rows: int = BLOCK_ROWS):
+        self.path = path
+        self.block_rows = block_rows
+        self._tmp_path = path + ".tmp"
+        self._f = open(self._tmp_path, "wb")
+        self._lines: List[str] = []
+        self._meta = self._new_meta()
+        self.blocks: List[dict] = []
+        self.rows = 0
+
+    @staticmethod
+    def _new_meta() -> dict:
+        return {"min_time": None, "max_time": None, "min_id": None, "max_id": None,
+                "event_types": set(), "users": set()}
+
+    def add(self, row: dict):
+        self._lines.append(json.dumps(row, separators=(",", ":")))
+        meta = self._meta
+        created = row.get("created_at")
+        if created:
+            if meta["min_time"] is None or created < meta["min_time"]:
+                meta["min_time"] = created
+            if meta["max_time"] is None or created > meta["max_time"]:
+                meta["max_time"] = created
+        row_id = row.get("id")
+        if row_id is not None:
+            if meta["min_id"] is None or row_id < meta["min_id"]:
+                meta["min_id"] = row_id
+            if meta["max_id"] is None or row_id > meta["max_id"]:
+                meta["max_id"] = row_id
+        meta["event_types"].add(row.get("event_type"))
+        if row.get("user_id") is not None:
+            meta["users"].add(row["user_id"])
+
+        if len(self._lines) >= self.block_rows:
+            self._flush_block()
+
+    def add_many(self, rows: Iterable[dict]):
+        for row in rows:
+            self.add(row)
+
+    def append_archive(self, path: str, users: Optional[set] = None):
+        """
+        Appends another archive. Indexed archives are copied block-for-block
+        (no recompression, offsets shifted); unindexed ones are re-encoded.
+        When `users` is given, the distinct user ids of the archive are added to it.
+        """
+        index_path = path + INDEX_SUFFIX
+        if not os.path.exists(index_path):
+            for row in _iter_legacy_rows(path):
+                self.add(row)
+                if users is not None and row.get("user_id") is not None:
+                    users.add(row["user_id"])
+            return
+
+        self._flush_block()
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        base = self._f.tell()
+        with open(path, "rb") as src:
+            for block in index["blocks"]:
+                src.seek(block["offset"])
+                payload = src.read(block["length"])
+                self._f.write(payload)
+                self.blocks.append({**block, "offset": base + block["offset"]})
+                self.rows += block["rows"]
+                if users is not None:
+                    if "users" in block:
+                        users.update(block["users"])
+                    else:
+                        # Bloom blocks only answer membership; read the ids back
+                        for line in gzip.decompress(payload).decode("utf-8").splitlines():
+                            if line:
+                                user_id = json.loads(line).get("user_id")
+                                if user_id is not None:
+                                    users.add(user_id)
+
+    def _flush_block(self):
+        if not self._lines:
+            return
+        payload = gzip.compress(("\n".join(self._lines) + "\n").encode("utf-8"), compresslevel=6)
+        offset = self._f.tell()
+        self._f.write(payload)
+
+        meta = self._meta
+        block = {
+            "offset": offset,
+            "length": len(payload),
+            "rows": len(self._lines),
+            "min_time": meta["min_time"],
+            "max_time": meta["max_time"],
+            "min_id": meta["min_id"],
+            "max_id": meta["max_id"],
+            "event_types": sorted(t for t in meta["event_types"] if t is not None)
+        }
+        users = meta["users"]
+        if len(users) <= EXACT_USERS_MAX:
+            block["users"] = sorted(users)
+        else:
+            block["user_bloom"] = _bloom_build(users)
+
+        self.blocks.append(block)
+        self.rows += len(self._lines)
+        self._lines = []
+        self._meta = self._new_meta()
+
+    def close(self) -> dict:
+        """Finishes the file and writes its index; returns the index."""
+        self._flush_block()
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+        os.replace(self._tmp_path, self.path)
+
+        index = {
+            "version": INDEX_VERSION,
+            "file": os.path.basename(self.path),
+            "rows": self.rows,
+            "min_time": min((b["min_time"] for b in self.blocks if b["min_time"]), default=None),
+            "max_time": max((b["max_time"] for b in self.blocks if b["max_time"]), default=None),
+            "blocks": self.blocks
+        }
+        index_tmp = self.path + INDEX_SUFFIX + ".tmp"
+        with open(index_tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(index_tmp, self.path + INDEX_SUFFIX)
+        return index
+
+    def abort(self):
+        self._f.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+# --- Reading ---
+
+def _block_may_match(block: dict, start: Optional[str], end: Optional[str],
+                     user_id: Optional[int], event_types: Optional[set]) -> bool:
+    if start and block["max_time"] and block["max_time"] < start:
+        return False
+    if end and block["min_time"] and block["min_time"] > end:
+        return False
+    if event_types and not event_types.intersection(block["event_types"]):
+        return False
+    if user_id is not None:
+        if "users" in block:
+            return user_id in block["users"]
+        return _bloom_contains(block["user_bloom"], user_id)
+    return True
+
+def _scan_block(path: str, offset: int, length: int, filters: dict) -> List[dict]:
+    """Decompresses one block and returns its matching rows (process-pool safe)."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        payload = f.read(length)
+
+    start, end = filters.get("start"), filters.get("end")
+    user_id = filters.get("user_id")
+    event_types = set(filters["event_types"]) if filters.get("event_types") else None
+
+    matches = []
+    for line in gzip.decompress(payload).decode("utf-8").splitlines():
+        if not line:
+            continue
+        row = json.loads(line)
+        created = row.get("created_at") or ""
+        if start and created < start:
+            continue
+        if end and created > end:
+            continue
+        if user_id is not None and row.get("user_id") != user_id:
+            continue
+        if event_types and row.get("event_type") not in event_types:
+            continue
+        matches.append(row)
+    return matches
+
+
+class ArchiveIndex:
+    """
+    Loads `.idx` sidecars from a set of directories and answers queries by
+    pruning blocks on the index, then decompressing only the survivors.
+    Indexes are cached and reloaded when their mtime changes.
+    """
+
+    def __init__(self, directories: List[str]):
+        self.directories = directories
+        self._cache: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _indexes(self) -> List[dict]:
+        indexes = []
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith(INDEX_SUFFIX):
+                    continue
+                idx_path = os.path.join(directory, name)
+                try:
+                    mtime = os.stat(idx_path).st_mtime_ns
+                    cached = self._cache.get(idx_path)
+                    if cached is None or cached[0] != mtime:
+                        with open(idx_path, encoding="utf-8") as f:
+                            index = json.load(f)
+                        index["_path"] = os.path.join(directory, index["file"])
+                        self._cache[idx_path] = cached = (mtime, index)
+                    indexes.append(cached[1])
+                except (OSError, ValueError, KeyError):
+                    continue
+        return sorted(indexes, key=lambda i: i["min_time"] or "")
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=max(1, QUERY_WORKERS))
+        return self._pool
+
+    def query(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+              user_id: Optional[int] = None, event_types: Optional[List[str]] = None,
+              limit: int = 500, parallel: bool = False) -> dict:
+        filters = {
+            "start": start.isoformat() if start else None,
+            "end": end.isoformat() if end else None,
+            "user_id": user_id,
+            "event_types": list(event_types) if event_types else None
+        }
+        wanted_types = set(event_types) if event_types else None
+
+        # 1. Prune through the indexes
+        total_blocks = 0
+        candidates = []
+        indexes = self._indexes()
+        for index in indexes:
+            total_blocks += len(index["blocks"])
+            if filters["start"] and index["max_time"] and index["max_time"] < filters["start"]:
+                continue
+            if filters["end"] and index["min_time"] and index["min_time"] > filters["end"]:
+                continue
+            for block in index["blocks"]:
+                if _block_may_match(block, filters["start"], filters["end"], user_id, wanted_types):
+                    candidates.append((index["_path"], block["offset"], block["length"]))
+
+        # 2. Decompress matching blocks (in order, stopping once `limit` is reached)
+        rows: List[dict] = []
+        scanned = 0
+        wave = max(1, QUERY_WORKERS) * 2 if parallel else 1
+        for i in range(0, len(candidates), wave):
+            chunk = candidates[i:i + wave]
+            if parallel and len(chunk) > 1:
+                results = self._get_pool().map(_scan_block, *zip(*chunk), [filters] * len(chunk))
+            else:
+                results = (_scan_block(p, o, n, filters) for p, o, n in chunk)
+            for matches in results:
+                scanned += 1
+                rows.extend(matches)
+            if len(rows) >= limit:
+                break
+
+        return {
+            "rows": rows[:limit],
+            "truncated": len(rows) > limit or scanned < len(candidates),
+            "files": len(indexes),
+            "total_blocks": total_blocks,
+            "candidate_blocks": len(candidates),
+            "scanned_blocks": scanned
+        }
+
+
+# --- Migration of monolithic archives ---
+
+def _iter_legacy_rows(path: str):
+    """Yields rows from a JSON-array .json.gz or a single-member .ndjson.gz file."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        if head == "[":
+            f.seek(0)
+            # Legacy format can't be streamed; it's parsed once here and never again
+            yield from json.load(f)
+            return
+        f.seek(0)
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def _blocked_name(filename: str) -> str:
+    if filename.endswith(".ndjson.gz"):
+        return filename
+    return filename[:-len(".json.gz")] + ".ndjson.gz"
+
+def _retarget_snapshot_summaries(directory: str, renames: Dict[str, str]):
+    """Points summary files and the snapshot catalog at the converted file names."""
+    from utils.snapshot_catalog import get_catalog, public_summary
+
+    for name in os.listdir(directory):
+        if not (name.startswith("summary_") and name.endswith(".json")):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if summary.get("raw_file") in renames:
+            summary["raw_file"] = renames[summary["raw_file"]]
+            with open(path + ".tmp", "w") as f:
+                json.dump(summary, f)
+            os.replace(path + ".tmp", path)
+
+    catalog = get_catalog(directory)
+    if os.path.exists(catalog.manifest_path):
+        entries = [public_summary(e) for e in catalog.latest()]
+        for e in entries:
+            if e.get("raw_file") in renames:
+                e["raw_file"] = renames[e["raw_file"]]
+        catalog.rewrite(entries)
+
+def migrate_directory(directory: str, keep_original: bool = False) -> dict:
+    """Converts every unindexed .gz archive in `directory` to the block format."""
+    converted, rows_total, failed = [], 0, []
+    renames = {}
+    if not os.path.isdir(directory):
+        return {"directory": directory, "converted": 0, "rows": 0, "failed": []}
+
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".gz") or os.path.exists(os.path.join(directory, name + INDEX_SUFFIX)):
+            continue
+        source = os.path.join(directory, name)
+        target_name = _blocked_name(name)
+        target = os.path.join(directory, target_name)
+        if target != source and os.path.exists(target + INDEX_SUFFIX):
+            continue
+
+        # Same-name conversions (single-member .ndjson.gz) go through a staging name
+        staging = target + ".migrating" if target == source else target
+        writer = BlockArchiveWriter(staging)
+        try:
+            writer.add_many(_iter_legacy_rows(source))
+            writer.close()
+        except (OSError, ValueError, EOFError) as e:
+            writer.abort()
+            failed.append({"file": name, "error": str(e)})
+            continue
+
+        if staging != target:
+            os.replace(staging, target)
+            os.replace(staging + INDEX_SUFFIX, target + INDEX_SUFFIX)
+        elif not keep_original:
+            os.remove(source)
+        if target_name != name:
+            renames[name] = target_name
+
+        converted.append(target_name)
+        rows_total += writer.rows
+
+    if renames:
+        _retarget_snapshot_summaries(directory, renames)
+
+    return {"directory": directory, "converted": len(converted), "rows": rows_total, "failed": failed}
+
+
+if __name__ == "__main__":
+    # Usage: python -m utils.block_archive migrate [--keep] [dir ...]
+    args = sys.argv[1:]
+    if args and args[0] == "migrate":
+        keep = "--keep" in args
+        dirs = [a for a in args[1:] if a != "--keep"]
+        if not dirs:
+            root = os.path.join(os.getcwd(), "archives")
+            dirs = [root, os.path.join(root, "snapshots")]
+        for d in dirs:
+            print(migrate_directory(d, keep_original=keep))
+    else:
+        print("Usage: python -m utils.block_archive migrate [--keep] [dir ...]")
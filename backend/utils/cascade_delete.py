@@ -0,0 +1,308 @@
+import os
+import uuid
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+from sqlalchemy import update, or_, and_
+from sqlmodel import Session, select, delete, col, func, desc
+from database import engine
+from models import (
+    AnalyticsLog, Company, CompanyInvitation, CompanyProfile, DeletionJob, Department,
+    Event, Holiday, Issue, Notification, Tag, User, UserActivity, UserSession
+)
+from utils.auth_state import bump_company_members, bump_membership_version, revoke_sessions
+from utils.company_stats import company_stats
+from utils.logger import get_logger
+
+log = get_logger("cascade_delete")
+
+# Rows removed per transaction; each chunk commits with the job's progress
+CHUNK_SIZE = int(os.getenv("DELETION_CHUNK_SIZE", "500"))
+# Breathing room between chunks for the requests competing for the same tables
+CHUNK_PAUSE_SEC = float(os.getenv("DELETION_CHUNK_PAUSE_MS", "50")) / 1000
+# A running job without a heartbeat for this long belonged to a dead worker
+STALE_AFTER = timedelta(seconds=int(os.getenv("DELETION_STALE_SECONDS", "120")))
+POLL_SECONDS = 30
+ACTIVE_STATUSES = ("pending", "running")
+
+
+class Step(NamedTuple):
+    name: str
+    model: Any
+    key: Any # Chunks are picked and removed by this column
+    where: Callable[[int], Any] # target id -> condition
+    values: Optional[dict] = None # UPDATE with these instead of DELETE
+    company: Any = None # Touched companies get their stats refreshed
+
+
+def _events_of(condition):
+    return col(Event.parent_id).in_(select(Event.id).where(condition))
+
+# Dependency order: every step removes the last rows referencing those of a later step
+PLANS: Dict[str, List[Step]] = {
+    "company": [
+        Step("invitations", CompanyInvitation, CompanyInvitation.id, lambda i: CompanyInvitation.company_id == i),
+        Step("event_exceptions", Event, Event.id, lambda i: _events_of(Event.company_id == i)),
+        Step("events", Event, Event.id, lambda i: Event.company_id == i),
+        Step("profiles", CompanyProfile, CompanyProfile.id, lambda i: CompanyProfile.company_id == i),
+        Step("holidays", Holiday, Holiday.id, lambda i: Holiday.company_id == i),
+        Step("tags", Tag, Tag.id, lambda i: Tag.company_id == i),
+        Step("department_parents", Department, Department.id,
+             lambda i: and_(Department.company_id == i, col(Department.parent_id).is_not(None)), {"parent_id": None}),
+        Step("departments", Department, Department.id, lambda i: Department.company_id == i),
+        Step("company", Company, Company.id, lambda i: Company.id == i, company=Company.id),
+    ],
+    "user": [
+        Step("sessions", UserSession, UserSession.id, lambda i: UserSession.user_id == i),
+        Step("profiles", CompanyProfile, CompanyProfile.id, lambda i: CompanyProfile.user_id == i, company=CompanyProfile.company_id),
+        Step("invitations", CompanyInvitation, CompanyInvitation.id, lambda i: CompanyInvitation.inviter_id == i),
+        Step("notifications", Notification, Notification.id, lambda i: Notification.recipient_id == i),
+        Step("issues", Issue, Issue.id, lambda i: Issue.user_id == i),
+        Step("event_exceptions", Event, Event.id, lambda i: _events_of(Event.proposer_id == i), company=Event.company_id),
+        Step("events", Event, Event.id, lambda i: Event.proposer_id == i, company=Event.company_id),
+        # Last before the user: the ingestor may still flush the user's queued
+        # events (and their activity totals) until shortly before this point.
+        # Logs stay for the aggregates; they just stop pointing at the user
+        Step("activity", UserActivity, UserActivity.user_id, lambda i: UserActivity.user_id == i),
+        Step("analytics_logs", AnalyticsLog, AnalyticsLog.id, lambda i: AnalyticsLog.user_id == i, {"user_id": None}),
+        Step("user", User, User.id, lambda i: User.id == i),
+    ]
+}
+
+
+class CascadeDeleter:
+    """
+    Deletes a company or user together with every row that depends on it.
+    A request only marks the target as deleting (which hides it everywhere
+    and invalidates the affected tokens) and records a DeletionJob; a
+    background thread then removes the dependent rows CHUNK_SIZE at a time
+    in dependency order, committing the job's progress with each chunk.
+    Jobs survive restarts: pending ones are picked up on start, and running
+    ones whose worker stopped heartbeating are taken over after STALE_AFTER.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, pause: float = CHUNK_PAUSE_SEC):
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._wake = threading.Event() # New work (set by request/retry)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self.chunks = 0
+        self.completed = 0
+        self.failed = 0
+
+    # --- Requests ---
+
+    def request(self, session: Session, target_type: str, target_id: int,
+                requested_by: Optional[int] = None) -> Optional[DeletionJob]:
+        """Hides the target and queues its deletion; None if it doesn't exist."""
+        # 1. Already under way: hand back the same job
+        existing = session.exec(
+            select(DeletionJob)
+            .where(DeletionJob.target_type == target_type, DeletionJob.target_id == target_id,
+                   col(DeletionJob.status).in_(ACTIVE_STATUSES))
+        ).first()
+        if existing:
+            return existing
+
+        # 2. Hide the target and invalidate whatever tokens still show it
+        if target_type == "company":
+            target = session.get(Company, target_id)
+            if not target:
+                return None
+            bump_company_members(session, target_id)
+            name = target.name
+        else:
+            target = session.get(User, target_id)
+            if not target:
+                return None
+            session_ids = session.exec(select(UserSession.id).where(UserSession.user_id == target_id)).all()
+            revoke_sessions(session, session_ids)
+            bump_membership_version(session, [target_id])
+            name = target.username
+        target.deleting_at = target.deleting_at or datetime.utcnow()
+        session.add(target)
+
+        # 3. The rows themselves go in the background
+        job = DeletionJob(target_type=target_type, target_id=target_id, target_name=name, requested_by=requested_by)
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+        self.wake()
+        return job
+
+    def retry(self, session: Session, job: DeletionJob) -> DeletionJob:
+        # From the top: rows written after their step ran (the usual cause of
+        # a failed final step) are picked up again; finished steps find nothing
+        job.step = None
+        job.status = "pending"
+        job.error = None
+        job.finished_at = None
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+        self.wake()
+        return job
+
+    def describe(self, job: DeletionJob) -> dict:
+        steps = [s.name for s in PLANS[job.target_type]]
+        done = steps.index(job.step) if job.step in steps else 0
+        if job.status == "success":
+            done = len(steps)
+        return {
+            **job.model_dump(),
+            "steps": steps,
+            "steps_done": done,
+            "deleted_total": sum((job.deleted or {}).values())
+        }
+
+    def list_jobs(self, session: Session, status: Optional[str] = None, limit: int = 50, offset: int = 0) -> dict:
+        query = select(DeletionJob)
+        count_query = select(func.count(DeletionJob.id))
+        if status:
+            query = query.where(DeletionJob.status == status)
+            count_query = count_query.where(DeletionJob.status == status)
+        jobs = session.exec(query.order_by(desc(DeletionJob.id)).offset(offset).limit(limit)).all()
+        return {"items": [self.describe(j) for j in jobs], "total": session.exec(count_query).one()}
+
+    # --- Lifecycle ---
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cascade-deleter", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stops after the current chunk; an unfinished job goes back to pending."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job_id = self._claim()
+                if job_id is not None:
+                    self._process(job_id)
+                    continue
+            except Exception as e:
+                log.error("Cascade deleter loop failed", extra={"error": str(e)})
+            self._wake.wait(POLL_SECONDS)
+            self._wake.clear()
+
+    # --- Worker ---
+
+    def _claim(self) -> Optional[int]:
+        """Takes the oldest pending (or abandoned) job; a conditional UPDATE keeps it to one worker."""
+        now = datetime.utcnow()
+        claimable = or_(
+            DeletionJob.status == "pending",
+            and_(DeletionJob.status == "running", or_(
+                col(DeletionJob.heartbeat_at).is_(None), DeletionJob.heartbeat_at < now - STALE_AFTER
+            ))
+        )
+        with Session(engine) as session:
+            for job_id in session.exec(select(DeletionJob.id).where(claimable).order_by(DeletionJob.id).limit(10)).all():
+                result = session.exec(
+                    update(DeletionJob).where(DeletionJob.id == job_id, claimable)
+                    .values(status="running", owner=self.owner, heartbeat_at=now)
+                )
+                session.commit()
+                if result.rowcount:
+                    return job_id
+        return None
+
+    def _process(self, job_id: int):
+        with Session(engine) as session:
+            job = session.get(DeletionJob, job_id)
+            target_type, target_id = job.target_type, job.target_id
+            plan = PLANS[target_type]
+            names = [s.name for s in plan]
+            # Steps are idempotent, so resuming simply reruns the one in progress
+            start = names.index(job.step) if job.step in names else 0
+            deleted = dict(job.deleted or {})
+            step = plan[start]
+            try:
+                for step in plan[start:]:
+                    while True:
+                        if self._stop.is_set():
+                            self._release(session, job_id)
+                            return
+                        removed = self._chunk(session, job_id, target_id, step, deleted)
+                        if removed is None:
+                            log.warning("Deletion job taken over by another worker", extra={"job_id": job_id})
+                            return
+                        if removed < self.chunk_size:
+                            break
+                        # Not _wake: a request arriving mid-job would cut every later pause short
+                        self._stop.wait(self.pause)
+                session.exec(
+                    update(DeletionJob).where(DeletionJob.id == job_id)
+                    .values(status="success", finished_at=datetime.utcnow(), heartbeat_at=datetime.utcnow())
+                )
+                session.commit()
+                self.completed += 1
+                log.info("Deletion job finished", extra={"job_id": job_id, "target_type": target_type,
+                                                         "target_id": target_id, "deleted": deleted})
+            except Exception as e:
+                session.rollback()
+                session.exec(
+                    update(DeletionJob).where(DeletionJob.id == job_id)
+                    .values(status="error", error=str(e), finished_at=datetime.utcnow())
+                )
+                session.commit()
+                self.failed += 1
+                log.error("Deletion job failed", extra={"job_id": job_id, "step": step.name, "error": str(e)})
+
+    def _chunk(self, session: Session, job_id: int, target_id: int, step: Step, deleted: Dict[str, int]) -> Optional[int]:
+        """Removes one chunk and records progress in the same transaction; None if the job was lost."""
+        # 1. Next chunk of keys (plus their companies, for the stats)
+        condition = step.where(target_id)
+        columns = (step.key, step.company) if step.company is not None else (step.key,)
+        rows = session.exec(select(*columns).where(condition).limit(self.chunk_size)).all()
+        keys = [r[0] for r in rows] if step.company is not None else list(rows)
+
+        # 2. Remove them
+        if keys:
+            if step.values is not None:
+                session.exec(update(step.model).where(col(step.key).in_(keys)).values(**step.values))
+            else:
+                session.exec(delete(step.model).where(col(step.key).in_(keys)))
+            deleted[step.name] = deleted.get(step.name, 0) + len(keys)
+
+        # 3. Progress, only while this worker still owns the job
+        result = session.exec(
+            update(DeletionJob).where(DeletionJob.id == job_id, DeletionJob.owner == self.owner)
+            .values(step=step.name, deleted=dict(deleted), heartbeat_at=datetime.utcnow())
+        )
+        if not result.rowcount:
+            session.rollback()
+            return None
+        session.commit()
+        self.chunks += 1
+        if step.company is not None and keys:
+            company_stats.mark_dirty(r[1] for r in rows)
+        return len(keys)
+
+    def _release(self, session: Session, job_id: int):
+        session.exec(
+            update(DeletionJob).where(DeletionJob.id == job_id, DeletionJob.owner == self.owner)
+            .values(status="pending", owner=None, heartbeat_at=None)
+        )
+        session.commit()
+
+    def stats(self) -> dict:
+        return {"chunks": self.chunks, "completed": self.completed, "failed": self.failed, "chunk_size": self.chunk_size}
+
+
+cascade_deleter = CascadeDeleter()
@@ -0,0 +1,191 @@
+import os
+import time
+import threading
+from datetime import datetime
+from typing import Iterable, Optional, Set
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, select, delete, func, col, desc, asc
+from models import Company, CompanyProfile, CompanyStats, Department, Event, EventStatus
+from utils.logger import get_logger
+
+log = get_logger("company_stats")
+
+# Full refresh at most this often; covers writes this worker didn't see
+# (other workers, bulk UPDATE/DELETE statements)
+STATS_TTL_SEC = float(os.getenv("COMPANY_STATS_TTL", "60"))
+SORT_FIELDS = ("name", "created_at", "user_count", "department_count", "event_total",
+               "approved", "pending", "rejected", "cancelled")
+EVENT_STATUSES = [s.value for s in EventStatus]
+_TRACKED = (Event, CompanyProfile, Department)
+
+
+class CompanyStatsRefresher:
+    """
+    Keeps the CompanyStats table for the superadmin dashboard. Each refresh
+    is one grouped query per dimension (profiles, departments, events by
+    status) over every company or just the dirty ones, so its cost doesn't
+    depend on how many companies there are. ORM writes to events, profiles,
+    departments or companies mark their company dirty on commit, and reads
+    refresh those first; a full refresh runs when the last one is older than
+    STATS_TTL_SEC. Reads then page and sort in SQL.
+    """
+
+    def __init__(self, ttl: float = STATS_TTL_SEC):
+        self.ttl = ttl
+        self._dirty: Set[int] = set()
+        self._refreshed_at = 0.0 # monotonic; 0 forces a full refresh on first read
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.full_refreshes = 0
+        self.partial_refreshes = 0
+
+    # --- Change tracking ---
+
+    def instrument(self):
+        event.listen(OrmSession, "after_flush", self._after_flush)
+        event.listen(OrmSession, "after_commit", self._after_commit)
+        event.listen(OrmSession, "after_rollback", self._after_rollback)
+
+    @staticmethod
+    def _after_flush(session, flush_context):
+        touched = session.info.setdefault("company_stats_dirty", set())
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            if isinstance(obj, Company):
+                touched.add(obj.id)
+            elif isinstance(obj, _TRACKED) and obj.company_id is not None:
+                touched.add(obj.company_id)
+
+    def _after_commit(self, session):
+        touched = session.info.pop("company_stats_dirty", None)
+        if touched:
+            self.mark_dirty(touched)
+
+    @staticmethod
+    def _after_rollback(session):
+        session.info.pop("company_stats_dirty", None)
+
+    def mark_dirty(self, company_ids: Iterable[Optional[int]]):
+        with self._lock:
+            self._dirty.update(i for i in company_ids if i is not None)
+
+    # --- Refresh ---
+
+    def ensure_fresh(self, session: Session):
+        with self._refresh_lock:
+            with self._lock:
+                full = time.monotonic() - self._refreshed_at >= self.ttl
+                dirty = set() if full else self._dirty
+                self._dirty = set()
+            if full:
+                self.refresh(session)
+                self._refreshed_at = time.monotonic()
+            elif dirty:
+                self.refresh(session, dirty)
+
+    def refresh(self, session: Session, company_ids: Optional[Set[int]] = None):
+        """Recomputes stats for `company_ids` (all companies when None) and commits."""
+        def scoped(query, column):
+            return query if company_ids is None else query.where(col(column).in_(company_ids))
+
+        # 1. One grouped query per dimension
+        companies = session.exec(scoped(select(Company.id), Company.id)).all()
+        users = dict(session.exec(scoped(
+            select(CompanyProfile.company_id, func.count(CompanyProfile.id)), CompanyProfile.company_id
+        ).group_by(CompanyProfile.company_id)).all())
+        departments = dict(session.exec(scoped(
+            select(Department.company_id, func.count(Department.id)), Department.company_id
+        ).group_by(Department.company_id)).all())
+        events = {}
+        for company_id, status, count in session.exec(scoped(
+            select(Event.company_id, Event.status, func.count(Event.id)), Event.company_id
+        ).group_by(Event.company_id, Event.status)).all():
+            status_str = status.value if hasattr(status, "value") else str(status)
+            events.setdefault(company_id, {})[status_str] = count
+
+        # 2. Joined in memory and written over the existing rows
+        now = datetime.utcnow()
+        try:
+            with session.begin_nested():
+                existing = {s.company_id: s for s in session.exec(
+                    scoped(select(CompanyStats), CompanyStats.company_id)
+                ).all()}
+                for company_id in companies:
+                    by_status = events.get(company_id, {})
+                    values = {
+                        "user_count": users.get(company_id, 0),
+                        "department_count": departments.get(company_id, 0),
+                        "event_total": sum(by_status.values()),
+                        **{status: by_status.get(status, 0) for status in EVENT_STATUSES}
+                    }
+                    row = existing.pop(company_id, None)
+                    if row is None:
+                        row = CompanyStats(company_id=company_id)
+                    elif all(getattr(row, k) == v for k, v in values.items()):
+                        continue # Unchanged rows aren't rewritten
+                    for k, v in values.items():
+                        setattr(row, k, v)
+                    row.refreshed_at = now
+                    session.add(row)
+                # Rows left over belong to deleted companies
+                if existing:
+                    session.exec(delete(CompanyStats).where(col(CompanyStats.company_id).in_(existing.keys())))
+            session.commit()
+        except IntegrityError:
+            # Another worker inserted the same new rows first; its numbers will do
+            session.rollback()
+            log.info("Company stats refresh raced another worker")
+
+        if company_ids is None:
+            self.full_refreshes += 1
+        else:
+            self.partial_refreshes += 1
+
+    # --- Reads ---
+
+    def page(self, session: Session, sort: str = "name", order: str = "asc",
+             limit: int = 50, offset: int = 0, search: Optional[str] = None) -> dict:
+        self.ensure_fresh(session)
+
+        query = select(Company, CompanyStats).outerjoin(CompanyStats, CompanyStats.company_id == Company.id)
+        count_query = select(func.count(Company.id))
+        # Companies being deleted are already gone as far as the dashboard is concerned
+        query = query.where(col(Company.deleting_at).is_(None))
+        count_query = count_query.where(col(Company.deleting_at).is_(None))
+        if search:
+            match = col(Company.name).contains(search, autoescape=True)
+            query = query.where(match)
+            count_query = count_query.where(match)
+
+        column = getattr(Company if sort in ("name", "created_at") else CompanyStats, sort)
+        direction = desc if order == "desc" else asc
+        # A company created since the last refresh has no row yet; it sorts last
+        query = query.order_by(direction(column).nulls_last(), Company.id).offset(offset).limit(limit)
+
+        items = []
+        for company, stats in session.exec(query).all():
+            items.append({
+                "id": company.id,
+                "name": company.name,
+                "created_at": company.created_at,
+                "user_count": stats.user_count if stats else 0,
+                "department_count": stats.department_count if stats else 0,
+                "event_total": stats.event_total if stats else 0,
+                "event_stats": {s: getattr(stats, s) if stats else 0 for s in EVENT_STATUSES},
+                "refreshed_at": stats.refreshed_at if stats else None
+            })
+        return {"items": items, "total": session.exec(count_query).one()}
+
+    def stats(self) -> dict:
+        with self._lock:
+            dirty = len(self._dirty)
+        return {
+            "dirty": dirty,
+            "full_refreshes": self.full_refreshes,
+            "partial_refreshes": self.partial_refreshes,
+            "ttl_sec": self.ttl
+        }
+
+
+company_stats = CompanyStatsRefresher()
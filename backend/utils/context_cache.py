@@ -0,0 +1,73 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import List
+from sqlmodel import Session, select, col
+from models import CompanyProfile, Company, MembershipStatus
+from utils.auth_state import auth_state
+
+MAX_CACHED_USERS = 10000
+# Versions are noted before the writer commits, so a reader racing that commit
+# could cache pre-commit rows under the new version; the TTL bounds that
+ENTRY_TTL_SEC = 60
+
+
+class ContextPayloadCache:
+    """
+    Serialized `available_contexts` per user, valid for one membership version.
+    Any profile write or company rename bumps the version, which makes the
+    entry stale on the next read.
+    """
+
+    def __init__(self, max_users: int = MAX_CACHED_USERS):
+        self.max_users = max_users
+        self._entries = OrderedDict()  # (user_id, active_only) -> (version, expires, payload)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_contexts(self, session: Session, user_id: int, active_only: bool = False) -> List[dict]:
+        key = (user_id, active_only)
+        version = auth_state.version_of(user_id)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        payload = load_available_contexts(session, user_id, active_only)
+
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + ENTRY_TTL_SEC, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return payload
+
+
+def load_available_contexts(session: Session, user_id: int, active_only: bool = False) -> List[dict]:
+    """Profiles plus company names in a single joined query."""
+    query = (
+        select(CompanyProfile.company_id, Company.name, CompanyProfile.role, CompanyProfile.department_id)
+        .join(Company, CompanyProfile.company_id == Company.id, isouter=True)
+        .where(CompanyProfile.user_id == user_id, col(Company.deleting_at).is_(None))
+        .order_by(CompanyProfile.id)
+    )
+    if active_only:
+        query = query.where(CompanyProfile.status == MembershipStatus.ACTIVE)
+
+    return [
+        {
+            "company_id": company_id,
+            "company_name": company_name or "Organization",
+            "role": role,
+            "department_id": department_id
+        }
+        for company_id, company_name, role, department_id in session.exec(query).all()
+    ]
+
+
+context_cache = ContextPayloadCache()
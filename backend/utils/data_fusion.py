@@ -1,9 +1,12 @@
 import os
 import json
 from datetime import datetime, timedelta
+from sqlalchemy import case
 from sqlmodel import Session, select, func
 from database import engine
 from models import AnalyticsLog
+from utils.snapshot_catalog import get_catalog, parse_snapshot_time
+from utils.time_buckets import bucket_index, start_of
 # Ensure this path matches your SnapshotEngine path
 SNAPSHOT_DIR = os.path.join(os.getcwd(), "archives", "snapshots")
 
@@ -11,7 +14,11 @@ class DataFusionEngine:
     """
     Merges Hot Data (DB) with Cold Data (Snapshots) 
     to provide unified analytics without restoring backups.
+    Cold reads go through the snapshot catalog, never the directory itself.
     """
+
+    def __init__(self, storage_path: str = SNAPSHOT_DIR):
+        self.catalog = get_catalog(storage_path)
     
     def get_time_series(self, range_key: str):
         """
@@ -28,60 +35,50 @@ class DataFusionEngine:
 
         data_points = []
 
-        # 2. READ COLD DATA (From JSON Summaries)
-        if os.path.exists(SNAPSHOT_DIR):
-            for f in sorted(os.listdir(SNAPSHOT_DIR)):
-                if f.startswith("summary_") and f.endswith(".json"):
-                    try:
-                        # Filename: summary_YYYYMMDD_HHMMSS.json
-                        ts_part = f.replace("summary_", "").replace(".json", "")
-                        file_time = datetime.strptime(ts_part, "%Y%m%d_%H%M%S")
-                        
-                        if file_time > start_time:
-                            with open(os.path.join(SNAPSHOT_DIR, f), 'r') as file:
-                                content = json.load(file)
-                                data_points.append({
-                                    "timestamp": file_time,
-                                    "total": content['stats']['total'],
-                                    "errors": content['stats']['errors'],
-                                    "type": "archive"
-                                })
-                    except: continue
+        # 2. READ COLD DATA (Catalog, binary-searched on time)
+        for content in self.catalog.between(start_time):
+            # Compacted segments carry one point per merged hour/day
+            series = content.get('series') or [[content['timestamp'], content['stats']['total'], content['stats']['errors']]]
+            for ts, total, errors in series:
+                point_time = parse_snapshot_time(ts)
+                if point_time > start_time:
+                    data_points.append({
+                        "timestamp": point_time,
+                        "total": total,
+                        "errors": errors,
+                        "type": "archive"
+                    })
 
         # 3. READ HOT DATA (From DB - The gap between last snapshot and now)
+        # Aggregated in SQL: per minute for '1h', one "current" point otherwise
+        width = 60 if range_key == '1h' else None
         with Session(engine) as session:
-            # Fetch logs created AFTER the start time
-            logs = session.exec(select(AnalyticsLog).where(AnalyticsLog.created_at >= start_time)).all()
-            
-            if range_key == '1h':
-                # Minute-by-minute aggregation for live logs (High Resolution)
-                buckets = {}
-                for log in logs:
-                    # Key: YYYY-MM-DD HH:MM
-                    minute_key = log.created_at.replace(second=0, microsecond=0)
-                    if minute_key not in buckets: 
-                        buckets[minute_key] = {"total": 0, "errors": 0}
-                    
-                    buckets[minute_key]["total"] += 1
-                    if log.event_type == 'ERROR': 
-                        buckets[minute_key]["errors"] += 1
-                
-                for t, stats in buckets.items():
+            # Sampled request logs count for their sample_weight
+            total = func.sum(AnalyticsLog.sample_weight)
+            errors = func.sum(case((AnalyticsLog.event_type == 'ERROR', AnalyticsLog.sample_weight), else_=0))
+            if width:
+                bucket = bucket_index(AnalyticsLog.created_at, width).label("bucket")
+                rows = session.exec(
+                    select(bucket, total, errors)
+                    .where(AnalyticsLog.created_at >= start_time)
+                    .group_by(bucket)
+                ).all()
+                for index, total, errors_live in rows:
                     data_points.append({
-                        "timestamp": t,
-                        "total": stats["total"],
-                        "errors": stats["errors"],
+                        "timestamp": start_of(int(index), width),
+                        "total": total,
+                        "errors": errors_live or 0,
                         "type": "live"
                     })
             else:
-                # Aggregate total live logs into one "Current" point for larger ranges
-                total_live = len(logs)
-                errors_live = sum(1 for l in logs if l.event_type == 'ERROR')
-                if total_live > 0:
+                total_live, errors_live = session.exec(
+                    select(total, errors).where(AnalyticsLog.created_at >= start_time)
+                ).one()
+                if total_live:
                     data_points.append({
                         "timestamp": now,
                         "total": total_live,
-                        "errors": errors_live,
+                        "errors": errors_live or 0,
                         "type": "live"
                     })
 
@@ -105,24 +102,16 @@ class DataFusionEngine:
         """
         Returns merged breakdown of actions (e.g., LOGIN: 500) from Files + DB
         """
-        action_map = {}
-
-        # 1. Summaries (Cold)
-        if os.path.exists(SNAPSHOT_DIR):
-            for f in os.listdir(SNAPSHOT_DIR):
-                if f.startswith("summary_"):
-                    try:
-                        with open(os.path.join(SNAPSHOT_DIR, f)) as file:
-                            data = json.load(file)
-                            for k, v in data.get('breakdown', {}).items():
-                                action_map[k] = action_map.get(k, 0) + v
-                    except: continue
+        # 1. Summaries (Cold) - pre-summed by the catalog
+        action_map = self.catalog.breakdown_totals()
 
         # 2. Live DB (Hot)
         with Session(engine) as session:
             # Group by event_type
-            results = session.exec(select(AnalyticsLog.event_type)).all()
-            for et in results:
-                action_map[et] = action_map.get(et, 0) + 1
+            results = session.exec(
+                select(AnalyticsLog.event_type, func.sum(AnalyticsLog.sample_weight)).group_by(AnalyticsLog.event_type)
+            ).all()
+            for et, count in results:
+                action_map[et] = action_map.get(et, 0) + count
 
         return [{"name": k, "value": v} for k, v in action_map.items()]
\ No newline at end of file
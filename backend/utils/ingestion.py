@@ -0,0 +1,271 @@
+import os
+import time
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Callable, Optional
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlmodel import Session
+from database import engine
+from models import AnalyticsLog
+from utils.logger import get_logger
+
+log = get_logger("ingestion")
+
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+FLUSH_INTERVAL_SEC = float(os.getenv("INGEST_FLUSH_SECONDS", "1.0"))
+MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "50000"))
+# "drop_oldest" keeps the newest events; "reject" refuses new ones (backpressure)
+OVERFLOW_POLICY = os.getenv("INGEST_OVERFLOW_POLICY", "drop_oldest")
+# AnalyticsLog columns only some producers fill in, with their defaults
+OPTIONAL_COLUMNS = {"path": None, "status": None, "latency_ms": None, "sample_weight": 1}
+# Lost connection, locked or overloaded DB: the batch itself is fine, retry it later
+RETRYABLE_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+# The DB refuses some row in the batch (e.g. a user_id whose user was deleted)
+BAD_ROW_ERRORS = (IntegrityError, DataError)
+# Any other error this many flushes in a row is treated as a bad row too
+MAX_FLUSH_RETRIES = 3
+
+
+class AnalyticsIngestor:
+    """
+    In-process buffer for AnalyticsLog rows.
+    Request paths call `enqueue()` and return immediately; a background thread
+    bulk-inserts batches when BATCH_SIZE rows are waiting or FLUSH_INTERVAL_SEC
+    has passed. When the DB falls behind, the bounded queue sheds load
+    according to OVERFLOW_POLICY instead of growing without limit. Failed
+    batches are retried while the DB is unreachable; a batch the DB rejects
+    is split until the bad rows are found and dropped.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL_SEC,
+                 max_queue: int = MAX_QUEUE, overflow_policy: str = OVERFLOW_POLICY):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._listeners = []
+        self._commit_listeners = []
+
+        # Metrics
+        self.enqueued = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.flush_count = 0
+        self.flush_failures = 0
+        self.rejected = 0
+        self._consecutive_failures = 0
+        self.last_flush_ms = 0.0
+        self.last_flush_at = None
+
+    # --- Producer side ---
+
+    def enqueue(self, event_type: str, details: Optional[str] = None,
+                user_id: Optional[int] = None, created_at: Optional[datetime] = None,
+                path: Optional[str] = None, status: Optional[int] = None,
+                latency_ms: Optional[float] = None, sample_weight: int = 1) -> bool:
+        row = {
+            "event_type": event_type,
+            "details": details,
+            "user_id": user_id,
+            "created_at": created_at or datetime.utcnow(),
+            "path": path,
+            "status": status,
+            "latency_ms": latency_ms,
+            "sample_weight": sample_weight
+        }
+        return self.enqueue_many([row]) == 1
+
+    def enqueue_many(self, rows: list) -> int:
+        """Queues pre-built row dicts; returns how many were accepted."""
+        self.start()
+        accepted = 0
+        with self._cond:
+            for row in rows:
+                # A bulk insert needs the same keys in every row
+                for key, default in OPTIONAL_COLUMNS.items():
+                    row.setdefault(key, default)
+                if len(self._queue) >= self.max_queue:
+                    if self.overflow_policy == "reject":
+                        self.dropped += 1
+                        continue
+                    self._queue.popleft()
+                    self.dropped += 1
+                self._queue.append(row)
+                accepted += 1
+            self.enqueued += accepted
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        return accepted
+
+    def add_flush_listener(self, listener: Callable[[Session, list], None]):
+        """
+        Registers `listener(session, rows)`, run inside each flush transaction
+        after the insert. Each runs in a savepoint: a failing listener is
+        logged and rolled back without losing the raw rows.
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def add_commit_listener(self, listener: Callable[[list], None]):
+        """
+        Registers `listener(rows)`, called after each flush commits with the
+        inserted rows as dicts that include their new ids. It runs on the
+        flusher thread, so it must only hand the rows off, never block.
+        """
+        if listener not in self._commit_listeners:
+            self._commit_listeners.append(listener)
+
+    # --- Lifecycle ---
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="analytics-ingestor", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stops the flusher after draining whatever is queued."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    # --- Consumer side ---
+
+    def _take_batch(self) -> list:
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._queue) < self.batch_size and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._queue), self.batch_size)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+            elif self._stopping:
+                return
+
+    def _flush(self, batch: list):
+        started = time.perf_counter()
+        try:
+            self._write(batch)
+            self._consecutive_failures = 0
+        except Exception as e:
+            self.flush_failures += 1
+            self._consecutive_failures += 1
+            log.error("Analytics flush failed", extra={"rows": len(batch), "error": str(e)})
+            if isinstance(e, BAD_ROW_ERRORS) or (
+                not isinstance(e, RETRYABLE_ERRORS) and self._consecutive_failures >= MAX_FLUSH_RETRIES
+            ):
+                self._isolate(batch)
+            else:
+                self._requeue(batch)
+                self._backoff()
+        finally:
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+            self.last_flush_at = datetime.utcnow()
+
+    def _isolate(self, batch: list):
+        """
+        Writes a rejected batch in halves, splitting again wherever a half
+        fails, until the offending rows are alone; those are dropped and
+        counted in `rejected`. Everything else still gets stored.
+        """
+        pending = [batch]
+        while pending:
+            part = pending.pop()
+            try:
+                self._write(part)
+            except RETRYABLE_ERRORS as e:
+                # The DB itself went away; what's left goes back in order
+                log.error("Analytics flush failed", extra={"rows": len(part), "error": str(e)})
+                self._requeue(part + [row for rest in reversed(pending) for row in rest])
+                self._backoff()
+                return
+            except Exception as e:
+                if len(part) == 1:
+                    self.rejected += 1
+                    log.error("Dropped analytics row rejected by the database", extra={
+                        "event_type": part[0].get("event_type"), "user_id": part[0].get("user_id"), "error": str(e)
+                    })
+                    continue
+                middle = len(part) // 2
+                pending.append(part[middle:])
+                pending.append(part[:middle])
+        self._consecutive_failures = 0
+
+    def _backoff(self):
+        # So a down DB isn't hammered in a tight loop
+        time.sleep(min(self.flush_interval * 5, 5.0))
+
+    def _write(self, batch: list):
+        """Inserts one batch, runs the listeners and commits; raises if the insert fails."""
+        inserted = None
+        with Session(engine) as session:
+            if self._commit_listeners:
+                # Ids only come back through RETURNING; rows arrive in no particular order
+                columns = AnalyticsLog.__table__.columns
+                inserted = [dict(r._mapping) for r in session.execute(insert(AnalyticsLog).returning(*columns), batch)]
+            else:
+                session.exec(insert(AnalyticsLog), params=batch)
+            for listener in self._listeners:
+                try:
+                    with session.begin_nested():
+                        listener(session, batch)
+                except Exception as e:
+                    log.error("Analytics flush listener failed", extra={"listener": getattr(listener, '__qualname__', str(listener)), "error": str(e)})
+            session.commit()
+        self.flushed += len(batch)
+        self.flush_count += 1
+        for listener in self._commit_listeners:
+            try:
+                listener(inserted)
+            except Exception as e:
+                log.error("Analytics commit listener failed", extra={"listener": getattr(listener, '__qualname__', str(listener)), "error": str(e)})
+
+    def _requeue(self, batch: list):
+        with self._cond:
+            room = self.max_queue - len(self._queue)
+            keep = batch[-room:] if room > 0 else []
+            self.dropped += len(batch) - len(keep)
+            self._queue.extendleft(reversed(keep))
+
+    def fill(self) -> float:
+        """Fraction of the queue in use."""
+        return len(self._queue) / self.max_queue
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self._queue),
+            "max_queue": self.max_queue,
+            "overflow_policy": self.overflow_policy,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "flush_count": self.flush_count,
+            "flush_failures": self.flush_failures,
+            "rejected": self.rejected,
+            "last_flush_ms": self.last_flush_ms,
+            "last_flush_at": self.last_flush_at
+        }
+
+
+ingestor = AnalyticsIngestor()
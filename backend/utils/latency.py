@@ -0,0 +1,237 @@
+import math
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils.metrics import http_metrics
+
+# Log-spaced buckets: bucket i covers (GROWTH**(i-1), GROWTH**i] ms, so any
+# percentile is within ~4% of the true value. Everything below MIN_MS is bucket 0.
+BUCKET_GROWTH = 1.08
+MIN_MS = 0.01
+_LOG_GROWTH = math.log(BUCKET_GROWTH)
+_BUCKET_OFFSET = -math.floor(math.log(MIN_MS) / _LOG_GROWTH)
+
+# Wall-clock slices (so slices from different workers line up when merged)
+SLICE_SECONDS = 10
+WINDOWS = {"1m": 60, "5m": 300, "1h": 3600}
+SLICES_KEPT = max(WINDOWS.values()) // SLICE_SECONDS
+PERCENTILES = (50, 90, 99)
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def bucket_of(ms: float) -> int:
+    if ms <= MIN_MS:
+        return 0
+    return max(0, math.ceil(math.log(ms) / _LOG_GROWTH) + _BUCKET_OFFSET)
+
+def bucket_value(index: int) -> float:
+    """Representative value of a bucket (geometric midpoint of its range)."""
+    if index == 0:
+        return MIN_MS
+    return BUCKET_GROWTH ** (index - _BUCKET_OFFSET - 0.5)
+
+
+class _Slice:
+    __slots__ = ("index", "buckets", "count", "sum_ms", "max_ms", "status", "bytes")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.status = [0] * len(STATUS_CLASSES)
+        self.bytes = 0
+
+    def export(self) -> dict:
+        return {
+            "slice": self.index, "buckets": self.buckets, "count": self.count,
+            "sum_ms": self.sum_ms, "max_ms": self.max_ms, "status": self.status, "bytes": self.bytes
+        }
+
+
+class WindowStats:
+    """Mergeable aggregate over any set of slices, from any number of workers."""
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.status = [0] * len(STATUS_CLASSES)
+        self.bytes = 0
+
+    def add(self, s: dict):
+        for b, c in s["buckets"].items():
+            b = int(b) # JSON round trips turn keys into strings
+            self.buckets[b] = self.buckets.get(b, 0) + c
+        self.count += s["count"]
+        self.sum_ms += s["sum_ms"]
+        self.max_ms = max(self.max_ms, s["max_ms"])
+        self.status = [a + b for a, b in zip(self.status, s["status"])]
+        self.bytes += s["bytes"]
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen >= rank:
+                return round(min(bucket_value(b), self.max_ms), 2)
+        return round(self.max_ms, 2)
+
+    def summary(self, seconds: int) -> dict:
+        result = {"count": self.count, "rps": round(self.count / seconds, 3)}
+        for p in PERCENTILES:
+            result[f"p{p}"] = self.percentile(p)
+        result["mean"] = round(self.sum_ms / self.count, 2) if self.count else None
+        result["max"] = round(self.max_ms, 2) if self.count else None
+        result["status"] = dict(zip(STATUS_CLASSES, self.status))
+        result["bytes_avg"] = round(self.bytes / self.count) if self.count else None
+        return result
+
+
+class RouteHistogram:
+    """Ring of SLICE_SECONDS slices covering the longest window."""
+
+    def __init__(self):
+        self._ring: List[Optional[_Slice]] = [None] * SLICES_KEPT
+
+    def record(self, now: float, ms: float, status: int, size: int):
+        index = int(now // SLICE_SECONDS)
+        pos = index % SLICES_KEPT
+        s = self._ring[pos]
+        if s is None or s.index != index:
+            s = self._ring[pos] = _Slice(index)
+
+        b = bucket_of(ms)
+        s.buckets[b] = s.buckets.get(b, 0) + 1
+        s.count += 1
+        s.sum_ms += ms
+        if ms > s.max_ms:
+            s.max_ms = ms
+        cls = status // 100 - 1
+        if 0 <= cls < len(STATUS_CLASSES):
+            s.status[cls] += 1
+        s.bytes += size
+
+    def slices(self, now: float, seconds: int) -> List[_Slice]:
+        current = int(now // SLICE_SECONDS)
+        oldest = current - seconds // SLICE_SECONDS
+        return [s for s in self._ring if s is not None and oldest < s.index <= current]
+
+
+class LatencyRegistry:
+    """
+    Per (method, route template) latency histograms.
+    Recording happens on the event loop thread only (from LatencyMiddleware),
+    so updates need no lock: each one is a handful of dict/int operations.
+    """
+
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteHistogram] = {}
+
+    def record(self, method: str, route: str, ms: float, status: int, size: int, now: Optional[float] = None):
+        key = (method, route)
+        hist = self.routes.get(key)
+        if hist is None:
+            hist = self.routes[key] = RouteHistogram()
+        hist.record(now or time.time(), ms, status, size)
+
+    def export(self, now: Optional[float] = None) -> List[dict]:
+        """Raw slices for the longest window, for merging across workers."""
+        now = now or time.time()
+        return [
+            {"method": m, "route": r, "slices": [s.export() for s in h.slices(now, max(WINDOWS.values()))]}
+            for (m, r), h in self.routes.items()
+        ]
+
+    def summary(self, now: Optional[float] = None) -> List[dict]:
+        return summarize(self.export(now), now)
+
+
+def summarize(exports: Iterable[dict], now: Optional[float] = None) -> List[dict]:
+    """
+    Percentiles per route and window from one or more `export()` payloads
+    (e.g. collected from every worker); identical routes are merged.
+    """
+    now = now or time.time()
+    current = int(now // SLICE_SECONDS)
+    merged: Dict[Tuple[str, str], Dict[str, WindowStats]] = {}
+
+    for route in exports:
+        windows = merged.setdefault((route["method"], route["route"]), {w: WindowStats() for w in WINDOWS})
+        for s in route["slices"]:
+            age = current - s["slice"]
+            for name, seconds in WINDOWS.items():
+                if 0 <= age < seconds // SLICE_SECONDS:
+                    windows[name].add(s)
+
+    result = [
+        {"method": m, "route": r, "windows": {w: stats.summary(WINDOWS[w]) for w, stats in windows.items()}}
+        for (m, r), windows in merged.items()
+    ]
+    return sorted(result, key=lambda x: x["windows"]["5m"]["count"], reverse=True)
+
+
+latency_registry = LatencyRegistry()
+
+
+def route_template(scope) -> str:
+    """
+    Route template of the matched endpoint, e.g. "/companies/{company_id}".
+    Depending on the FastAPI version, scope["route"] carries either the full
+    path or only the path inside its router, so the prefix is recovered from
+    the concrete path the route matched.
+    """
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if not path:
+        return UNMATCHED_ROUTE
+    regex = getattr(route, "path_regex", None)
+    concrete = scope.get("path", "")
+    if regex is None or regex.match(concrete):
+        return path
+    i = concrete.find("/", 1)
+    while i != -1:
+        if regex.match(concrete[i:]):
+            return concrete[:i] + path
+        i = concrete.find("/", i + 1)
+    return path
+
+
+class LatencyMiddleware:
+    """
+    Pure ASGI middleware (no per-request task/queue like BaseHTTPMiddleware)
+    recording latency, status and response size per route template, into
+    both the windowed histograms and the Prometheus metrics.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        state = {"status": 500, "bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Templates, not raw paths, so ids don't explode the key space
+            elapsed = time.perf_counter() - started
+            template = route_template(scope)
+            latency_registry.record(scope["method"], template, elapsed * 1000, state["status"], state["bytes"])
+            http_metrics.observe(scope["method"], template, state["status"], elapsed)
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from datetime import datetime
+from typing import List, Optional, Tuple
+from utils.rollups import ERROR_EVENT_TYPES
+
+# Recent events kept for Last-Event-ID resume without touching the DB
+BUFFER_SIZE = int(os.getenv("LIVE_TAIL_BUFFER", "2000"))
+# Open streams per worker; further subscribers get a 503
+MAX_SUBSCRIBERS = int(os.getenv("LIVE_TAIL_MAX_SUBSCRIBERS", "20"))
+# Batches a slow client may fall behind by before events are dropped for it
+SUBSCRIBER_QUEUE = 200
+STATS_SECONDS = 60
+
+
+def serialize(row: dict) -> dict:
+    return {
+        "id": row["id"],
+        "event_type": row["event_type"],
+        "details": row.get("details"),
+        "user_id": row.get("user_id"),
+        "created_at": row["created_at"].isoformat(),
+        "path": row.get("path"),
+        "status": row.get("status"),
+        "latency_ms": row.get("latency_ms"),
+        "sample_weight": row.get("sample_weight") or 1
+    }
+
+def sse(data, event: Optional[str] = None, event_id: Optional[int] = None) -> str:
+    """One Server-Sent Events message."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+def status_range(status: str) -> Tuple[int, int]:
+    """"5xx" -> (500, 599), "404" -> (404, 404)."""
+    if status.endswith("xx"):
+        low = int(status[0]) * 100
+        return low, low + 99
+    return int(status), int(status)
+
+
+class LogFilter:
+    """In-memory twin of the /analytics/logs filters, applied to published rows."""
+    __slots__ = ("event_types", "user_id", "path", "status_range", "min_latency")
+
+    def __init__(self, event_types: Optional[List[str]] = None, user_id: Optional[int] = None,
+                 path: Optional[str] = None, status: Optional[str] = None, min_latency: Optional[float] = None):
+        self.event_types = set(event_types) if event_types else None
+        self.user_id = user_id
+        self.path = path
+        self.status_range = status_range(status) if status else None
+        self.min_latency = min_latency
+
+    def matches(self, e: dict) -> bool:
+        if self.event_types is not None and e["event_type"] not in self.event_types:
+            return False
+        if self.user_id is not None and e["user_id"] != self.user_id:
+            return False
+        if self.path and not (e["path"] or "").startswith(self.path):
+            return False
+        if self.status_range and not (e["status"] is not None and self.status_range[0] <= e["status"] <= self.status_range[1]):
+            return False
+        if self.min_latency is not None and not (e["latency_ms"] is not None and e["latency_ms"] >= self.min_latency):
+            return False
+        return True
+
+
+class Subscription:
+    """One open stream: a bounded asyncio queue filled from the flusher thread."""
+
+    def __init__(self, log_filter: LogFilter, loop: asyncio.AbstractEventLoop):
+        self.filter = log_filter
+        self.loop = loop
+        self.queue: "asyncio.Queue[List[dict]]" = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE)
+        self.lost = 0 # Events dropped because the client fell behind
+
+    def _deliver(self, events: List[dict]):
+        # Runs on the event loop (call_soon_threadsafe)
+        try:
+            self.queue.put_nowait(events)
+        except asyncio.QueueFull:
+            self.lost += len(events)
+
+    async def next(self, timeout: float) -> Optional[List[dict]]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LiveTail:
+    """
+    In-process pub/sub behind the /analytics/logs/stream SSE endpoint. The
+    ingestor publishes every committed batch (with ids) here; each open
+    stream gets the rows matching its filters pushed to it, so watching the
+    console costs nothing per tab beyond the connection. A ring buffer of
+    recent events serves Last-Event-ID resume, and per-second counters of
+    everything published feed the live stats. Like the ingestor, it only sees
+    this worker's events.
+    """
+
+    def __init__(self, buffer_size: int = BUFFER_SIZE, max_subscribers: int = MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._buffer = deque(maxlen=buffer_size)
+        # Every id above the floor that this worker committed is in the buffer
+        self._floor: Optional[int] = None
+        self._seconds = deque(maxlen=STATS_SECONDS)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.published = 0
+
+    # --- Publishing (flusher thread) ---
+
+    def publish(self, rows: List[dict]):
+        if not rows:
+            return
+        events = sorted((serialize(r) for r in rows), key=lambda e: e["id"])
+        now = int(time.time())
+        with self._lock:
+            if self._floor is None:
+                self._floor = events[0]["id"] - 1
+            overflow = len(self._buffer) + len(events) - self._buffer.maxlen
+            if overflow > 0:
+                # The newest evicted id; anything up to it now has to come from the DB
+                if overflow <= len(self._buffer):
+                    self._floor = self._buffer[overflow - 1]["id"]
+                else:
+                    self._floor = events[overflow - len(self._buffer) - 1]["id"]
+            self._buffer.extend(events)
+            self._count(now, events)
+            self.published += len(events)
+            subscribers = list(self._subscribers)
+
+        for sub in subscribers:
+            matching = [e for e in events if sub.filter.matches(e)]
+            if matching:
+                try:
+                    sub.loop.call_soon_threadsafe(sub._deliver, matching)
+                except RuntimeError:
+                    pass # Loop already closed (shutdown)
+
+    def _count(self, second: int, events: List[dict]):
+        if not self._seconds or self._seconds[-1]["second"] != second:
+            self._seconds.append({"second": second, "events": 0, "errors": 0, "by_type": {}, "latency_sum": 0.0, "latency_count": 0})
+        c = self._seconds[-1]
+        for e in events:
+            w = e["sample_weight"]
+            c["events"] += w
+            c["by_type"][e["event_type"]] = c["by_type"].get(e["event_type"], 0) + w
+            if e["event_type"] in ERROR_EVENT_TYPES or (e["status"] or 0) >= 500:
+                c["errors"] += w
+            if e["latency_ms"] is not None:
+                c["latency_sum"] += e["latency_ms"] * w
+                c["latency_count"] += w
+
+    # --- Subscribers (event loop) ---
+
+    def subscribe(self, log_filter: LogFilter) -> Optional[Subscription]:
+        """None when this worker already serves max_subscribers streams."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            sub = Subscription(log_filter, asyncio.get_running_loop())
+            self._subscribers.add(sub)
+            return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def replay(self, after_id: int, log_filter: LogFilter) -> Optional[List[dict]]:
+        """Buffered events newer than `after_id`, or None if the buffer no longer reaches back that far."""
+        with self._lock:
+            if self._floor is None or after_id < self._floor:
+                return None
+            return [e for e in self._buffer if e["id"] > after_id and log_filter.matches(e)]
+
+    def counters_since(self, second: int) -> List[dict]:
+        """Completed seconds after `second`, oldest first."""
+        current = int(time.time())
+        with self._lock:
+            seconds = [dict(c, by_type=dict(c["by_type"])) for c in self._seconds if second < c["second"] < current]
+        for c in seconds:
+            latency_count = c.pop("latency_count")
+            latency_sum = c.pop("latency_sum")
+            c["avg_latency_ms"] = round(latency_sum / latency_count, 2) if latency_count else None
+            c["at"] = datetime.utcfromtimestamp(c["second"]).isoformat()
+        return seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "max_subscribers": self.max_subscribers,
+                "buffered": len(self._buffer),
+                "oldest_buffered_id": self._buffer[0]["id"] if self._buffer else None,
+                "published": self.published
+            }
+
+
+live_tail = LiveTail()
@@ -0,0 +1,264 @@
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import text, inspect
+from database import engine, log_partitioning
+from models import AnalyticsLog
+from utils.logger import get_logger
+
+log = get_logger("log_partitions")
+
+# Partitions created ahead of the current period, so inserts never wait on DDL
+PARTITIONS_AHEAD = int(os.getenv("ANALYTICS_PARTITIONS_AHEAD", "3"))
+# Client events may be backdated up to 24h (CLIENT_TS_MAX_AGE in the analytics
+# router), so a partition keeps receiving rows for a while after it closes
+DROP_GRACE = timedelta(hours=25)
+
+PARENT = AnalyticsLog.__tablename__
+DEFAULT_PARTITION = f"{PARENT}_default"
+_NAME = re.compile(rf"^{PARENT}_p(\d{{8}}|\d{{6}})$")
+
+Partition = Tuple[str, datetime, datetime]
+
+
+def period_start(dt: datetime, mode: str) -> datetime:
+    dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return dt.replace(day=1) if mode == "month" else dt
+
+def next_period(start: datetime, mode: str) -> datetime:
+    if mode == "month":
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+def partition_name(start: datetime, mode: str) -> str:
+    return f"{PARENT}_p{start.strftime('%Y%m' if mode == 'month' else '%Y%m%d')}"
+
+
+class LogPartitionManager:
+    """
+    Native range partitioning of AnalyticsLog on created_at (Postgres only,
+    enabled with ANALYTICS_PARTITIONING=day|month). Partitions are named
+    analyticslog_pYYYYMMDD / analyticslog_pYYYYMM and created ahead of time;
+    a DEFAULT partition catches rows outside every range (e.g. backdated
+    events) so inserts never fail. Retention drops whole partitions instead of
+    deleting rows, and Postgres prunes partitions for created_at filters.
+
+    A fresh database gets a partitioned table from create_all (the model
+    carries the partitioning clause). An existing plain table has to be
+    converted once, with the app stopped: `python -m utils.log_partitions convert`.
+    """
+
+    def __init__(self, mode: Optional[str] = log_partitioning, ahead: int = PARTITIONS_AHEAD):
+        self.mode = mode
+        self.ahead = ahead
+        self.active = False
+
+    def setup(self):
+        """Called after create_db_and_tables: checks the table and creates partitions."""
+        if not self.mode:
+            if os.getenv("ANALYTICS_PARTITIONING", "off").lower() not in ("off", ""):
+                log.warning("Log partitioning needs Postgres; keeping a plain table", extra={"dialect": engine.dialect.name})
+            return
+        with engine.connect() as conn:
+            self.active = self._is_partitioned(conn)
+        if not self.active:
+            log.warning(f"{PARENT} is not partitioned yet; run `python -m utils.log_partitions convert` with the app stopped")
+            return
+        self.ensure_partitions()
+
+    @staticmethod
+    def _is_partitioned(conn) -> bool:
+        return conn.execute(text(
+            "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :name"
+        ), {"name": PARENT}).first() is not None
+
+    @staticmethod
+    def _quote(name: str) -> str:
+        return engine.dialect.identifier_preparer.quote(name)
+
+    # --- Partition inventory ---
+
+    def partitions(self, conn=None) -> List[Partition]:
+        """Range partitions as (name, start, end), oldest first; the default partition is excluded."""
+        if conn is None:
+            with engine.connect() as conn:
+                return self.partitions(conn)
+        names = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :parent"
+        ), {"parent": PARENT}).scalars().all()
+
+        result = []
+        for name in names:
+            match = _NAME.match(name)
+            if not match:
+                continue
+            digits = match.group(1)
+            # Parsed from the name, so partitions made under another mode still resolve
+            mode = "month" if len(digits) == 6 else "day"
+            start = datetime.strptime(digits, "%Y%m" if mode == "month" else "%Y%m%d")
+            result.append((name, start, next_period(start, mode)))
+        return sorted(result, key=lambda p: p[1])
+
+    # --- Creation ---
+
+    def ensure_partitions(self, now: Optional[datetime] = None, conn=None) -> dict:
+        """Creates the default partition and the current + PARTITIONS_AHEAD periods."""
+        if not self.active:
+            return {"status": "skipped", "message": "Log partitioning is off"}
+        if conn is None:
+            with engine.begin() as conn:
+                return self.ensure_partitions(now, conn)
+
+        now = now or datetime.utcnow()
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {self._quote(DEFAULT_PARTITION)} PARTITION OF {self._quote(PARENT)} DEFAULT"))
+        created = []
+        start = period_start(now, self.mode)
+        for _ in range(self.ahead + 1):
+            if self.create_partition(start, conn):
+                created.append(partition_name(start, self.mode))
+            start = next_period(start, self.mode)
+        return {"status": "success", "created": created}
+
+    def create_partition(self, start: datetime, conn) -> bool:
+        """Creates one period's partition; False if it already exists or overlaps another."""
+        end = next_period(start, self.mode)
+        name = partition_name(start, self.mode)
+        if name in {p[0] for p in self.partitions(conn)}:
+            return False
+
+        bounds = {"start": start, "end": end}
+        parent, default, part = self._quote(PARENT), self._quote(DEFAULT_PARTITION), self._quote(name)
+        ddl = f"CREATE TABLE {part} PARTITION OF {parent} FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        try:
+            with conn.begin_nested():
+                stragglers = conn.execute(text(
+                    f"SELECT 1 FROM {default} WHERE created_at >= :start AND created_at < :end LIMIT 1"
+                ), bounds).first()
+                if stragglers is None:
+                    conn.execute(text(ddl))
+                    return True
+
+                # Postgres refuses a new range the default partition already holds
+                # rows for, so those rows move into the new partition first
+                conn.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {default}"))
+                conn.execute(text(ddl))
+                conn.execute(text(
+                    f"INSERT INTO {parent} SELECT * FROM {default} WHERE created_at >= :start AND created_at < :end"
+                ), bounds)
+                conn.execute(text(f"DELETE FROM {default} WHERE created_at >= :start AND created_at < :end"), bounds)
+                conn.execute(text(f"ALTER TABLE {parent} ATTACH PARTITION {default} DEFAULT"))
+                return True
+        except Exception as e:
+            # e.g. overlaps a partition made under the other mode
+            log.error("Creating partition failed", extra={"partition": name, "error": str(e)})
+            return False
+
+    # --- Retention ---
+
+    def drop_before(self, cutoff: datetime, conn=None) -> List[str]:
+        """Drops partitions whose whole range is older than `cutoff`."""
+        if not self.active:
+            return []
+        if conn is None:
+            with engine.begin() as conn:
+                return self.drop_before(cutoff, conn)
+        dropped = []
+        for name, _, end in self.partitions(conn):
+            if end <= cutoff:
+                conn.execute(text(f"DROP TABLE {self._quote(name)}"))
+                dropped.append(name)
+        return dropped
+
+    def drop_covered(self, watermark: int, now: Optional[datetime] = None) -> List[str]:
+        """
+        Drops closed partitions (past DROP_GRACE) whose rows all have
+        id <= watermark, i.e. were already snapshotted.
+        """
+        if not self.active:
+            return []
+        now = now or datetime.utcnow()
+        dropped = []
+        with engine.begin() as conn:
+            for name, _, end in self.partitions(conn):
+                if end > now - DROP_GRACE:
+                    break
+                highest = conn.execute(text(f"SELECT max(id) FROM {self._quote(name)}")).scalar()
+                if highest is None or highest <= watermark:
+                    conn.execute(text(f"DROP TABLE {self._quote(name)}"))
+                    dropped.append(name)
+        return dropped
+
+    # --- One-off conversion ---
+
+    def convert(self) -> dict:
+        """
+        Rebuilds an existing plain analyticslog as a partitioned table in one
+        transaction: the old table is renamed, the partitioned one created
+        from the model, partitions made for every period in the data, rows
+        copied and the id sequence carried over.
+        """
+        if not self.mode:
+            return {"status": "error", "message": "Set ANALYTICS_PARTITIONING=day|month on Postgres first"}
+
+        legacy = f"{PARENT}_unpartitioned"
+        q = self._quote
+        with engine.begin() as conn:
+            if not inspect(conn).has_table(PARENT):
+                return {"status": "error", "message": f"{PARENT} does not exist"}
+            if self._is_partitioned(conn):
+                return {"status": "skipped", "message": "Already partitioned"}
+
+            # 1. Move the old table, its sequence and index names out of the way
+            sequence = conn.execute(text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": PARENT}).scalar()
+            conn.execute(text(f"ALTER TABLE {q(PARENT)} RENAME TO {q(legacy)}"))
+            if sequence:
+                conn.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO {q(legacy + '_id_seq')}"))
+            for index in inspect(conn).get_indexes(legacy):
+                conn.execute(text(f"DROP INDEX {q(index['name'])}"))
+            pk = inspect(conn).get_pk_constraint(legacy).get("name")
+            if pk:
+                conn.execute(text(f"ALTER TABLE {q(legacy)} RENAME CONSTRAINT {q(pk)} TO {q(legacy + '_pkey')}"))
+
+            # 2. Partitioned table (with its indexes) straight from the model
+            AnalyticsLog.__table__.create(conn)
+
+            # 3. Partitions for every period with data, then up to PARTITIONS_AHEAD
+            self.active = True
+            oldest = conn.execute(text(f"SELECT min(created_at) FROM {q(legacy)}")).scalar()
+            if oldest is not None:
+                start = period_start(oldest, self.mode)
+                while start < period_start(datetime.utcnow(), self.mode):
+                    self.create_partition(start, conn)
+                    start = next_period(start, self.mode)
+            self.ensure_partitions(conn=conn)
+
+            # 4. Rows and the id sequence
+            columns = ", ".join(q(c.name) for c in AnalyticsLog.__table__.columns)
+            copied = conn.execute(text(f"INSERT INTO {q(PARENT)} ({columns}) SELECT {columns} FROM {q(legacy)}")).rowcount
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence(:t, 'id'), GREATEST((SELECT max(id) FROM {q(PARENT)}), 1))"
+            ), {"t": PARENT})
+            conn.execute(text(f"DROP TABLE {q(legacy)}"))
+            partitions = len(self.partitions(conn))
+
+        return {"status": "converted", "rows": copied, "partitions": partitions}
+
+
+log_partitions = LogPartitionManager()
+
+
+if __name__ == "__main__":
+    # Usage: python -m utils.log_partitions [convert | ensure | list]
+    command = sys.argv[1] if len(sys.argv) >= 2 else ""
+    if command == "convert":
+        print(log_partitions.convert())
+    elif command in ("ensure", "list"):
+        log_partitions.setup()
+        for name, start, end in log_partitions.partitions() if log_partitions.active else []:
+            print(f"{name}  {start:%Y-%m-%d} .. {end:%Y-%m-%d}")
+    else:
+        print("Usage: python -m utils.log_partitions [convert | ensure | list]")
@@ -0,0 +1,103 @@
+import os
+import random
+from typing import List, Optional, Set, Tuple
+from utils.ingestion import ingestor
+
+# Share of ordinary requests logged (1 = every request)
+BASE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+# Per-route overrides, first match wins: "GET /events/{event_id}=0.1,/auth/*=1"
+# (the method is optional; a trailing * matches a route template prefix)
+ROUTE_RATES = os.getenv("LOG_SAMPLE_ROUTES", "")
+# Always logged regardless of rates: server errors, slow requests and these users
+KEEP_LATENCY_MS = float(os.getenv("LOG_KEEP_LATENCY_MS", "1000"))
+KEEP_USERS = os.getenv("LOG_KEEP_USERS", "")
+# Once the ingest queue is this full, rates shrink linearly down to
+# MIN_LOAD_FACTOR of their configured value at a full queue
+SHED_START = float(os.getenv("LOG_SAMPLE_SHED_AT", "0.25"))
+MIN_LOAD_FACTOR = float(os.getenv("LOG_SAMPLE_MIN_FACTOR", "0.05"))
+
+Rule = Tuple[Optional[str], str, bool, float]
+
+
+def parse_rules(spec: str) -> List[Rule]:
+    """"GET /a=0.1,/b/*=0.5" -> [(method, pattern, is_prefix, rate), ...]"""
+    rules = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        target, _, rate = item.rpartition("=")
+        method, _, pattern = target.strip().rpartition(" ")
+        prefix = pattern.endswith("*")
+        rules.append((method.upper() or None, pattern.rstrip("*"), prefix, min(max(float(rate), 0.0), 1.0)))
+    return rules
+
+
+class SamplingPolicy:
+    """
+    Decides which API_REQ rows LogMiddleware writes. Errors (status >= 500),
+    slow requests and watched users are always kept; everything else is
+    sampled at its route's rate, scaled down further while the ingest queue
+    backs up. Sampling is 1-in-N, and a kept row records N as its
+    sample_weight, so every count built from the logs (rollups, user
+    activity, dashboards) scales back up by summing weights and stays a
+    whole number.
+    """
+
+    def __init__(self, base_rate: float = BASE_RATE, rules: Optional[List[Rule]] = None,
+                 keep_latency_ms: float = KEEP_LATENCY_MS, keep_users: Optional[Set[int]] = None):
+        self.base_rate = base_rate
+        self.rules = parse_rules(ROUTE_RATES) if rules is None else rules
+        self.keep_latency_ms = keep_latency_ms
+        self.keep_users = {int(u) for u in KEEP_USERS.split(",") if u.strip()} if keep_users is None else keep_users
+
+        # Metrics (updated on the event loop only)
+        self.logged = 0
+        self.kept_always = 0
+        self.skipped = 0
+
+    def rate_for(self, method: str, route: str) -> float:
+        for rule_method, pattern, prefix, rate in self.rules:
+            if rule_method and rule_method != method:
+                continue
+            if route.startswith(pattern) if prefix else route == pattern:
+                return rate
+        return self.base_rate
+
+    def load_factor(self) -> float:
+        fill = ingestor.fill()
+        if fill <= SHED_START:
+            return 1.0
+        shed = (fill - SHED_START) / (1 - SHED_START)
+        return max(MIN_LOAD_FACTOR, 1 - shed * (1 - MIN_LOAD_FACTOR))
+
+    def weight(self, method: str, route: str, status: int, latency_ms: float, user_id: Optional[int] = None) -> int:
+        """The sample weight to log this request with, or 0 to skip it."""
+        if status >= 500 or latency_ms >= self.keep_latency_ms or (user_id is not None and user_id in self.keep_users):
+            self.kept_always += 1
+            return 1
+
+        rate = self.rate_for(method, route) * self.load_factor()
+        if rate <= 0:
+            self.skipped += 1
+            return 0
+        every = max(1, round(1 / rate))
+        if every > 1 and random.randrange(every):
+            self.skipped += 1
+            return 0
+        self.logged += 1
+        return every
+
+    def stats(self) -> dict:
+        return {
+            "base_rate": self.base_rate,
+            "rules": [
+                {"method": m, "route": p + ("*" if prefix else ""), "rate": r}
+                for m, p, prefix, r in self.rules
+            ],
+            "keep_latency_ms": self.keep_latency_ms,
+            "load_factor": round(self.load_factor(), 3),
+            "logged": self.logged,
+            "kept_always": self.kept_always,
+            "skipped": self.skipped
+        }
+
+
+sampling_policy = SamplingPolicy()
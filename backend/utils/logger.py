@@ -1,98 +1,204 @@
-import logging
+import os
+import sys
 import json
 import time
-import sys
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
-from uuid import uuid4
-from sqlmodel import Session
-from database import engine 
-from models import AnalyticsLog 
-
-# Configure Console Logger
+import queue
+import atexit
+import logging
+import threading
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-logger overrides: "zaman_negar.sql=WARNING,uvicorn.access=ERROR"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# Records waiting for the writer thread; beyond this they are dropped and counted
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Identical warnings/errors beyond BURST per WINDOW are counted instead of written
+RATE_LIMIT_BURST = int(os.getenv("LOG_RATE_LIMIT_BURST", "5"))
+RATE_LIMIT_WINDOW = float(os.getenv("LOG_RATE_LIMIT_SECONDS", "60"))
+
+APP_LOGGER = "zaman_negar"
+
+# Set per request by RequestIdMiddleware; copied into threadpool work like any ContextVar
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+def dumps(payload: dict) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass # e.g. integers beyond 64 bits; the stdlib copes
+    return json.dumps(payload, default=str)
+
+
 class StructuredLogger(logging.Logger):
-    def _log(self, level, msg, args, exc_info=None, extra=None, stack_info=False):
-        if extra is None: extra = {}
+    """
+    Keeps `extra` under one record attribute, so any key (even "name" or
+    "message") is allowed and the formatter knows which fields are custom.
+    """
+
+    def _log(self, level, msg, args, exc_info=None, extra=None, stack_info=False, stacklevel=1):
+        super()._log(level, msg, args, exc_info=exc_info, extra={"fields": extra or {}},
+                     stack_info=stack_info, stacklevel=stacklevel + 1)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line. Runs on the writer thread, not the caller's."""
+
+    def format(self, record: logging.LogRecord) -> str:
         payload = {
-            "timestamp": time.time(),
-            "level": logging.getLevelName(level),
-            "message": msg,
-            **extra
+            "timestamp": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
         }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            payload["request_id"] = request_id
+        # Custom fields never overwrite the standard keys
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            payload.setdefault(key, value)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            payload["suppressed"] = suppressed
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return dumps(payload)
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id while still on the caller's thread."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `burst` copies of the same warning/error (same
+    logger, message and error text) per `window` seconds. The first one
+    after a quiet window reports how many were suppressed.
+    """
+
+    def __init__(self, burst: int = RATE_LIMIT_BURST, window: float = RATE_LIMIT_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._seen: Dict[Tuple, list] = {} # key -> [window_start, count, suppressed]
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+        fields = getattr(record, "fields", None) or {}
+        key = (record.name, record.levelno, record.msg, str(fields.get("error", "")))
+        now = time.monotonic()
+        with self._lock:
+            state = self._seen.get(key)
+            if state is None or now - state[0] >= self.window:
+                if len(self._seen) > 10000:
+                    self._seen.clear()
+                record.suppressed = state[2] if state else 0
+                self._seen[key] = [now, 1, 0]
+                return True
+            state[1] += 1
+            if state[1] <= self.burst:
+                return True
+            state[2] += 1
+            self.suppressed += 1
+            return False
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the writer thread; never blocks, drops (and counts) when the queue is full."""
+
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merges msg % args here; JSON encoding happens on the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
         try:
-            json_payload = json.dumps(payload, default=str)
-        except TypeError:
-            json_payload = json.dumps({"message": "Log serialization failed"})
-        
-        # Pass arguments correctly to super
-        super()._log(level, json_payload, args, exc_info=exc_info, extra=None, stack_info=stack_info)
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """
+    Application logging: loggers under "zaman_negar" hand records to a
+    bounded queue, and a QueueListener thread encodes them as JSON (orjson
+    when installed) and writes them to stdout. Request threads therefore
+    never wait on a slow stdout pipe. Levels come from LOG_LEVEL and the
+    per-logger LOG_LEVELS.
+    """
+
+    def __init__(self):
+        self.queue: "queue.Queue" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self.handler = NonBlockingQueueHandler(self.queue)
+        self.rate_limit = RateLimitFilter()
+        self.handler.addFilter(RequestIdFilter())
+        self.handler.addFilter(self.rate_limit)
+        self.listener: Optional[QueueListener] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.listener is not None:
+                return
+            root = logging.getLogger(APP_LOGGER)
+            root.handlers = [self.handler]
+            root.propagate = False
+            root.setLevel(LOG_LEVEL)
+            for name, level in parse_levels(LOG_LEVELS).items():
+                logging.getLogger(name).setLevel(level)
+
+            stream = logging.StreamHandler(sys.stdout)
+            stream.setFormatter(JsonFormatter())
+            self.listener = QueueListener(self.queue, stream, respect_handler_level=True)
+            self.listener.start()
+
+    def stop(self):
+        with self._lock:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "rate_limited": self.rate_limit.suppressed,
+            "encoder": "orjson" if orjson is not None else "json"
+        }
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def get_logger(name: Optional[str] = None) -> logging.Logger:
+    """The app logger, or its child "zaman_negar.<name>" (so LOG_LEVELS can target it)."""
+    return logging.getLogger(f"{APP_LOGGER}.{name}" if name else APP_LOGGER)
+
 
 logging.setLoggerClass(StructuredLogger)
-logger = logging.getLogger("zaman_negar")
-logger.setLevel(logging.INFO)
-if not logger.handlers:
-    logger.addHandler(logging.StreamHandler(sys.stdout))
-
-class LogMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        request_id = str(uuid4())
-        start_time = time.time()
-        
-        # --- HELPER: Save to DB with Error Printing ---
-        def save_log_to_db(event_type: str, details: dict, user_id: int = None):
-            try:
-                # IMPORTANT: Convert details dict to string immediately
-                details_str = json.dumps(details, default=str)
-                
-                with Session(engine) as session:
-                    log_entry = AnalyticsLog(
-                        event_type=event_type,
-                        details=details_str,
-                        user_id=user_id
-                    )
-                    session.add(log_entry)
-                    session.commit()
-            except Exception as db_err:
-                # PRINT ERROR TO DOCKER LOGS VISIBLY
-                print(f"!!!!!!!! DB LOG ERROR !!!!!!!!: {db_err}")
-                print(f"Attempted to save: {event_type}")
-
-        # Process Request
-        try:
-            response = await call_next(request)
-            process_time = (time.time() - start_time) * 1000
-            
-            # --- LOGIC UPDATE: NOISE FILTER ---
-            # Don't log static files, nextjs internals, OR analytics calls
-            # This ensures the log viewer doesn't fill up with "Get Logs" requests
-            is_noise = any(x in request.url.path for x in ["_next", "favicon.ico", "static", "/analytics/"])
-            
-            if request.url.path.startswith("/") and not is_noise:
-                save_log_to_db(
-                    "API_REQ", 
-                    {
-                        "method": request.method,
-                        "path": request.url.path,
-                        "status": response.status_code,
-                        "latency": round(process_time, 2),
-                        "ip": request.client.host if request.client else "unknown"
-                    }
-                )
-            
-            return response
-            
-        except Exception as e:
-            process_time = (time.time() - start_time) * 1000
-            
-            # Log Error to DB
-            save_log_to_db(
-                "ERROR", 
-                {
-                    "path": request.url.path,
-                    "error": str(e),
-                    "latency": round(process_time, 2)
-                }
-            )
-            
-            logger.error("Request failed", extra={"error": str(e)})
-            raise e
\ No newline at end of file
+log_pipeline = LogPipeline()
+log_pipeline.start()
+# Writes out whatever is still queued on exit
+atexit.register(log_pipeline.stop)
+logger = get_logger()
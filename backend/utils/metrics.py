@@ -0,0 +1,258 @@
+import time
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_str(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        """
+        Returns the child for a label set, creating it once. Callers on hot
+        paths should keep the child (or a tuple-keyed cache of children)
+        rather than resolve labels per call.
+        """
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child(_label_str(self.labelnames, values))
+        return child
+
+    def _new_child(self, label_str: str):
+        raise NotImplementedError
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for child in list(self._children.values()):
+            lines.extend(child.expose(self.name))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("label_str", "value", "_lock")
+
+    def __init__(self, label_str: str):
+        self.label_str = label_str
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def expose(self, name: str) -> List[str]:
+        return [f"{name}{self.label_str} {_fmt(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self, label_str):
+        return _CounterChild(label_str)
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+
+class _HistogramChild:
+    __slots__ = ("label_str", "bounds", "counts", "sum", "count", "_lock", "_bucket_labels")
+
+    def __init__(self, label_str: str, bounds: Tuple[float, ...]):
+        self.label_str = label_str
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+        # Pre-rendered `le` label sets
+        inner = label_str[1:-1] + "," if label_str else ""
+        self._bucket_labels = [f'{{{inner}le="{_fmt(b)}"}}' for b in bounds] + [f'{{{inner}le="+Inf"}}']
+
+    def observe(self, value: float):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def expose(self, name: str) -> List[str]:
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines, cumulative = [], 0
+        for labels, c in zip(self._bucket_labels, counts):
+            cumulative += c
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        lines.append(f"{name}_sum{self.label_str} {_fmt(total)}")
+        lines.append(f"{name}_count{self.label_str} {count}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self, label_str):
+        return _HistogramChild(label_str, self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+
+class CallbackMetric:
+    """
+    Gauge or counter whose value is read at scrape time from existing state
+    (queue depths, cache counters), so the hot path pays nothing.
+    `fn` returns a number, or a list of (label_values, number).
+    """
+
+    def __init__(self, name: str, help_text: str, fn: Callable, labelnames: Iterable[str] = (), kind: str = "gauge"):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def expose(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            return [] # A broken collector must not break the scrape
+        if value is None:
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        samples = value if isinstance(value, list) else [((), value)]
+        for label_values, v in samples:
+            lines.append(f"{self.name}{_label_str(self.labelnames, label_values)} {_fmt(v)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name, help_text, fn, labelnames=(), kind="gauge") -> CallbackMetric:
+        return self.register(CallbackMetric(name, help_text, fn, labelnames, kind))
+
+    def exposition(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# --- Application metrics (collected on hot paths) ---
+
+http_requests = registry.counter(
+    "zamannegar_http_requests_total", "HTTP requests by route template and status class",
+    ("method", "route", "status")
+)
+http_duration = registry.histogram(
+    "zamannegar_http_request_duration_seconds", "Server-side request latency by route template",
+    ("method", "route")
+)
+db_pool_checkout = registry.histogram(
+    "zamannegar_db_pool_checkout_seconds", "Time spent waiting for a pooled DB connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+)
+recurrence_expansions = registry.counter(
+    "zamannegar_recurrence_expansions_total", "Calls to get_events_in_range"
+)
+recurrence_duration = registry.histogram(
+    "zamannegar_recurrence_expansion_seconds", "Duration of get_events_in_range"
+)
+recurrence_instances = registry.counter(
+    "zamannegar_recurrence_instances_total", "Virtual occurrences generated from recurrence rules"
+)
+
+
+class HttpMetrics:
+    """Tuple-keyed cache of metric children, so a request does one dict lookup per metric."""
+
+    def __init__(self):
+        self._counters: Dict[Tuple[str, str, int], _CounterChild] = {}
+        self._histograms: Dict[Tuple[str, str], _HistogramChild] = {}
+
+    def observe(self, method: str, route: str, status: int, seconds: float):
+        key = (method, route, status // 100)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = http_requests.labels(method, route, f"{status // 100}xx")
+        counter.inc()
+
+        hist = self._histograms.get(key[:2])
+        if hist is None:
+            hist = self._histograms[key[:2]] = http_duration.labels(method, route)
+        hist.observe(seconds)
+
+
+http_metrics = HttpMetrics()
+
+
+def instrument_pool(engine):
+    """Times connection checkouts and exposes the pool's gauges (QueuePool only)."""
+    pool = engine.pool
+    original_connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return original_connect()
+        finally:
+            db_pool_checkout.observe(time.perf_counter() - started)
+
+    pool.connect = timed_connect
+
+    def gauge(method: str):
+        return lambda: getattr(engine.pool, method)() if hasattr(engine.pool, method) else None
+
+    registry.callback("zamannegar_db_pool_size", "Configured pool size", gauge("size"))
+    registry.callback("zamannegar_db_pool_checked_out", "Connections currently checked out", gauge("checkedout"))
+    # QueuePool.overflow() counts up from -pool_size; only the part above zero is real overflow
+    registry.callback(
+        "zamannegar_db_pool_overflow", "Connections open beyond pool_size",
+        lambda: max(0, engine.pool.overflow()) if hasattr(engine.pool, "overflow") else None
+    )
@@ -0,0 +1,56 @@
+import os
+import time
+from datetime import datetime, timedelta
+from sqlmodel import Session, select, delete, col
+from database import engine
+from models import Notification
+
+READ_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "90"))
+UNREAD_RETENTION_DAYS = int(os.getenv("NOTIFICATION_UNREAD_RETENTION_DAYS", "365"))
+PURGE_BATCH_SIZE = 500
+
+
+class NotificationRetention:
+    """
+    Deletes read notifications after READ_RETENTION_DAYS and unread ones after
+    UNREAD_RETENTION_DAYS, in small id batches like the session reaper.
+    """
+
+    def __init__(self, read_days: int = READ_RETENTION_DAYS, unread_days: int = UNREAD_RETENTION_DAYS,
+                 batch_size: int = PURGE_BATCH_SIZE):
+        self.read_days = read_days
+        self.unread_days = unread_days
+        self.batch_size = batch_size
+
+    def purge(self):
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        purged = 0
+
+        with Session(engine) as session:
+            for is_read, days in ((True, self.read_days), (False, self.unread_days)):
+                cutoff = now - timedelta(days=days)
+                while True:
+                    ids = session.exec(
+                        select(Notification.id)
+                        .where(Notification.created_at < cutoff, Notification.is_read == is_read)
+                        .limit(self.batch_size)
+                    ).all()
+                    if not ids:
+                        break
+
+                    session.exec(delete(Notification).where(col(Notification.id).in_(ids)))
+                    session.commit()
+                    purged += len(ids)
+
+                    if len(ids) < self.batch_size:
+                        break
+
+        return {
+            "status": "success",
+            "purged": purged,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+
+
+notification_retention = NotificationRetention()
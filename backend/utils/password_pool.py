@@ -0,0 +1,129 @@
+import os
+import time
+import asyncio
+import threading
+import bcrypt
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# bcrypt releases the GIL while hashing, so plain threads give real parallelism
+POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", "4"))
+POOL_MAX_QUEUE = int(os.getenv("PASSWORD_POOL_MAX_QUEUE", "64"))
+LATENCY_SAMPLES = 512
+
+
+class PoolSaturated(Exception):
+    """Raised when the hashing queue is full and the job was refused."""
+
+
+class PasswordHasherPool:
+    """
+    Runs bcrypt hashing/verification on a dedicated, bounded thread pool so
+    the event loop (and FastAPI's shared worker threads) never stall on it.
+    Jobs beyond `max_queue` in flight are rejected instead of piling up.
+    """
+
+    def __init__(self, workers: int = POOL_WORKERS, max_queue: int = POOL_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_ms = deque(maxlen=LATENCY_SAMPLES)
+        self._run_ms = deque(maxlen=LATENCY_SAMPLES)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Created lazily so CLI scripts importing security.py don't spawn threads
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix="bcrypt"
+                    )
+        return self._executor
+
+    def _acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PoolSaturated("Password hashing queue is full")
+        with self._lock:
+            self._in_flight += 1
+
+    def _timed(self, fn, *args):
+        queued_at = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self._wait_ms.append((started - queued_at) * 1000)
+                    self._run_ms.append((finished - started) * 1000)
+                    self._completed += 1
+        return job
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args):
+        self._acquire()
+        try:
+            future = self._get_executor().submit(self._timed(fn, *args))
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    # --- Public API ---
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def run_sync(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            wait = sorted(self._wait_ms)
+            run = sorted(self._run_ms)
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "wait_ms": _summarize(wait),
+                "run_ms": _summarize(run),
+            }
+
+
+def _summarize(samples: list) -> dict:
+    if not samples:
+        return {"p50": 0, "p99": 0, "max": 0}
+    return {
+        "p50": round(samples[len(samples) // 2], 2),
+        "p99": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 2),
+        "max": round(samples[-1], 2),
+    }
+
+
+def bcrypt_verify(plain_password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def bcrypt_hash(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
+
+password_pool = PasswordHasherPool()
@@ -0,0 +1,53 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """
+    In-memory token buckets keyed by an arbitrary string (username, IP...).
+    Each key holds up to `capacity` tokens and refills at `refill_per_sec`.
+    The number of tracked keys is capped; the least recently used is evicted.
+    """
+
+    def __init__(self, capacity: float, refill_per_sec: float, max_keys: int = 10000):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, last_ts)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def try_acquire(self, key: str, cost: float = 1.0) -> float:
+        """
+        Takes `cost` tokens from the bucket.
+        Returns 0 on success, otherwise the seconds until enough tokens refill.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last_ts = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last_ts) * self.refill_per_sec)
+
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                retry_after = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                self.rejected += 1
+                retry_after = (cost - tokens) / self.refill_per_sec
+
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return retry_after
+
+    def refund(self, key: str, cost: float = 1.0):
+        """Gives back tokens taken for a request that was turned away by another check."""
+        with self._lock:
+            if key in self._buckets:
+                tokens, last_ts = self._buckets[key]
+                self._buckets[key] = (min(self.capacity, tokens + cost), last_ts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"tracked_keys": len(self._buckets), "rejected": self.rejected}
@@ -1,8 +1,13 @@
+import time
 from datetime import datetime, timedelta
 from typing import List, Dict
 from dateutil.rrule import rrulestr
 from sqlmodel import Session, select, or_
 from models import Event, EventScope
+from utils.metrics import recurrence_expansions, recurrence_duration, recurrence_instances
+from utils.logger import get_logger
+
+log = get_logger("recurrence")
 
 def _to_date_str(dt: datetime) -> str:
     return dt.strftime("%Y-%m-%d")
@@ -19,7 +24,8 @@ def get_events_in_range(
     company_ids: List[int],
     is_superadmin: bool = False
 ) -> List[Dict]:
-    
+    started = time.perf_counter()
+    virtual_count = 0
     start_range = _ensure_naive(start_range)
     end_range = _ensure_naive(end_range)
 
@@ -77,13 +83,18 @@ def get_events_in_range(
                 instance_end = dt + duration
                 # FIX: is_virtual (no underscore)
                 results.append(_event_to_dict(evt, dt, instance_end, is_virtual=True))
+                virtual_count += 1
                 
         except Exception as e:
-            print(f"Recurrence Error Event {evt.id}: {e}")
+            log.error("Recurrence expansion failed", extra={"event_id": evt.id, "error": str(e)})
             if evt_start >= start_range and evt_start <= end_range:
                 results.append(_event_to_dict(evt, evt_start, evt_end))
 
     results.sort(key=lambda x: x['start_time'])
+
+    recurrence_expansions.inc()
+    recurrence_instances.inc(virtual_count)
+    recurrence_duration.observe(time.perf_counter() - started)
     return results
 
 def _event_to_dict(evt: Event, start: datetime, end: datetime, is_virtual: bool = False) -> Dict:
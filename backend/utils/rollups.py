@@ -0,0 +1,303 @@
+import sys
+import json
+import math
+import hashlib
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select, delete, col, func
+from database import engine
+from models import AnalyticsLog, AnalyticsRollup
+from utils.time_buckets import bucket_index, first_index, start_of, fill_series
+
+GRANULARITIES = ("m", "h", "d")
+# Distinct-user sketches only where they are actually queried
+SKETCH_GRANULARITIES = ("h", "d")
+# How long each granularity is kept by prune()
+RETENTION = {"m": timedelta(days=2), "h": timedelta(days=90), "d": None}
+# Latency histogram upper bounds in ms; the last bucket is open-ended
+LATENCY_BOUNDS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+ERROR_EVENT_TYPES = {"ERROR"}
+LATENCY_EVENT_TYPES = {"API_REQ", "ERROR"}
+
+HLL_P = 10
+HLL_M = 1 << HLL_P
+_HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_M)
+
+
+# --- HyperLogLog ---
+
+def hll_new() -> bytearray:
+    return bytearray(HLL_M)
+
+def hll_add(registers: bytearray, value) -> None:
+    h = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+    idx = h >> (64 - HLL_P)
+    rest = h & ((1 << (64 - HLL_P)) - 1)
+    rank = (64 - HLL_P) - rest.bit_length() + 1
+    if rank > registers[idx]:
+        registers[idx] = rank
+
+def hll_merge(into: bytearray, other: Optional[bytes]) -> None:
+    if not other:
+        return
+    for i, r in enumerate(other):
+        if r > into[i]:
+            into[i] = r
+
+def hll_count(registers: Optional[bytes]) -> int:
+    if not registers:
+        return 0
+    estimate = _HLL_ALPHA * HLL_M * HLL_M / sum(2.0 ** -r for r in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * HLL_M and zeros:
+        estimate = HLL_M * math.log(HLL_M / zeros)
+    return int(round(estimate))
+
+
+# --- Bucketing ---
+
+def bucket_start(dt: datetime, granularity: str) -> datetime:
+    if granularity == "m":
+        return dt.replace(second=0, microsecond=0)
+    if granularity == "h":
+        return dt.replace(minute=0, second=0, microsecond=0)
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _parse_details(details: Optional[str]) -> dict:
+    if not details:
+        return {}
+    try:
+        parsed = json.loads(details)
+        return parsed if isinstance(parsed, dict) else {}
+    except (ValueError, TypeError):
+        return {}
+
+
+class _Aggregate:
+    __slots__ = ("count", "error_count", "latency_count", "latency_sum", "latency_hist", "sketch")
+
+    def __init__(self, with_sketch: bool):
+        self.count = 0
+        self.error_count = 0
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_hist = [0] * (len(LATENCY_BOUNDS_MS) + 1)
+        self.sketch = hll_new() if with_sketch else None
+
+
+def aggregate_rows(rows: Iterable[dict]) -> Dict[Tuple[str, datetime, str], _Aggregate]:
+    """Folds raw log rows (dicts) into per-bucket aggregates for every granularity."""
+    aggregates = {}
+    for row in rows:
+        event_type = row["event_type"]
+        created_at = row["created_at"]
+        # A sampled row stands for `sample_weight` requests
+        weight = row.get("sample_weight") or 1
+
+        is_error = event_type in ERROR_EVENT_TYPES
+        latency = None
+        if event_type in LATENCY_EVENT_TYPES:
+            details = _parse_details(row.get("details"))
+            status = details.get("status")
+            if isinstance(status, int) and status >= 500:
+                is_error = True
+            if isinstance(details.get("latency"), (int, float)):
+                latency = float(details["latency"])
+
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(created_at, granularity), event_type)
+            agg = aggregates.get(key)
+            if agg is None:
+                agg = aggregates[key] = _Aggregate(granularity in SKETCH_GRANULARITIES)
+
+            agg.count += weight
+            if is_error:
+                agg.error_count += weight
+            if latency is not None:
+                agg.latency_count += weight
+                agg.latency_sum += latency * weight
+                agg.latency_hist[bisect_left(LATENCY_BOUNDS_MS, latency)] += weight
+            if agg.sketch is not None and row.get("user_id") is not None:
+                hll_add(agg.sketch, row["user_id"])
+    return aggregates
+
+
+class RollupEngine:
+    """
+    Maintains AnalyticsRollup incrementally from ingested batches, and serves
+    dashboard reads from it so their cost doesn't grow with AnalyticsLog.
+    """
+
+    def apply(self, session: Session, rows: List[dict]):
+        """Merges a batch into the rollup tables inside the caller's transaction."""
+        aggregates = aggregate_rows(rows)
+        if not aggregates:
+            return
+
+        # Another worker may insert the same new bucket concurrently; retry as an update
+        for attempt in range(3):
+            try:
+                with session.begin_nested():
+                    self._merge(session, aggregates)
+                return
+            except IntegrityError:
+                if attempt == 2:
+                    raise
+
+    def _merge(self, session: Session, aggregates: dict):
+        for granularity in GRANULARITIES:
+            keys = [k for k in aggregates if k[0] == granularity]
+            if not keys:
+                continue
+
+            existing = session.exec(
+                select(AnalyticsRollup)
+                .where(
+                    AnalyticsRollup.granularity == granularity,
+                    col(AnalyticsRollup.bucket_start).in_({k[1] for k in keys}),
+                    col(AnalyticsRollup.event_type).in_({k[2] for k in keys})
+                )
+                .with_for_update()
+            ).all()
+            by_key = {(r.granularity, r.bucket_start, r.event_type): r for r in existing}
+
+            for key in keys:
+                agg = aggregates[key]
+                row = by_key.get(key)
+                if row is None:
+                    row = AnalyticsRollup(
+                        granularity=key[0], bucket_start=key[1], event_type=key[2],
+                        latency_hist=[0] * (len(LATENCY_BOUNDS_MS) + 1)
+                    )
+                row.count += agg.count
+                row.error_count += agg.error_count
+                row.latency_count += agg.latency_count
+                row.latency_sum += agg.latency_sum
+                hist = list(row.latency_hist or [0] * len(agg.latency_hist))
+                row.latency_hist = [a + b for a, b in zip(hist, agg.latency_hist)]
+                if agg.sketch is not None:
+                    merged = bytearray(row.users_sketch or hll_new())
+                    hll_merge(merged, agg.sketch)
+                    row.users_sketch = bytes(merged)
+                session.add(row)
+            session.flush()
+
+    # --- Reads ---
+
+    def rows(self, session: Session, granularity: str, start: datetime, end: Optional[datetime] = None):
+        query = select(AnalyticsRollup).where(
+            AnalyticsRollup.granularity == granularity,
+            AnalyticsRollup.bucket_start >= bucket_start(start, granularity)
+        )
+        if end:
+            query = query.where(AnalyticsRollup.bucket_start <= end)
+        return session.exec(query.order_by(AnalyticsRollup.bucket_start)).all()
+
+    def series(self, session: Session, start: datetime, end: datetime, width: int) -> List[dict]:
+        """
+        Totals and errors per `width`-second bucket, grouped in SQL from the
+        coarsest rollup granularity that divides the width, gap-filled with zeros.
+        """
+        granularity = "d" if width % 86400 == 0 else "h" if width % 3600 == 0 else "m"
+        bucket = bucket_index(AnalyticsRollup.bucket_start, width).label("bucket")
+        rows = session.exec(
+            select(bucket, func.sum(AnalyticsRollup.count), func.sum(AnalyticsRollup.error_count))
+            .where(
+                AnalyticsRollup.granularity == granularity,
+                AnalyticsRollup.bucket_start >= start_of(first_index(start, width), width),
+                AnalyticsRollup.bucket_start <= end
+            )
+            .group_by(bucket)
+        ).all()
+        return fill_series({int(b): (total or 0, errors or 0) for b, total, errors in rows}, start, end, width, ("total", "errors"))
+
+    def distinct_users(self, rows: Iterable[AnalyticsRollup]) -> int:
+        merged = hll_new()
+        for r in rows:
+            hll_merge(merged, r.users_sketch)
+        return hll_count(merged)
+
+    # --- Maintenance ---
+
+    def prune(self) -> dict:
+        now = datetime.utcnow()
+        purged = {}
+        with Session(engine) as session:
+            for granularity, keep in RETENTION.items():
+                if keep is None:
+                    continue
+                result = session.exec(
+                    delete(AnalyticsRollup).where(
+                        AnalyticsRollup.granularity == granularity,
+                        AnalyticsRollup.bucket_start < now - keep
+                    )
+                )
+                purged[granularity] = result.rowcount
+            session.commit()
+        return purged
+
+    def rebuild(self, days: Optional[int] = None, chunk_size: int = 5000) -> dict:
+        """
+        Recomputes rollups from the raw logs still in the DB, one day at a time.
+        Existing rollup rows for those days are replaced, so if older logs were
+        already snapshotted away, the oldest remaining day may come out partial.
+        """
+        with Session(engine) as session:
+            query = select(AnalyticsLog.created_at).order_by(AnalyticsLog.created_at)
+            if days:
+                query = query.where(AnalyticsLog.created_at >= datetime.utcnow() - timedelta(days=days))
+            first = session.exec(query.limit(1)).first()
+            if first is None:
+                return {"status": "no_data", "days": 0, "rows": 0}
+
+            day = bucket_start(first, "d")
+            end = datetime.utcnow()
+            total_rows = 0
+            rebuilt_days = 0
+
+            while day <= end:
+                next_day = day + timedelta(days=1)
+                session.exec(delete(AnalyticsRollup).where(
+                    AnalyticsRollup.bucket_start >= day,
+                    AnalyticsRollup.bucket_start < next_day
+                ))
+
+                result = session.exec(
+                    select(AnalyticsLog.event_type, AnalyticsLog.details, AnalyticsLog.user_id,
+                           AnalyticsLog.created_at, AnalyticsLog.sample_weight)
+                    .where(AnalyticsLog.created_at >= day, AnalyticsLog.created_at < next_day)
+                    .execution_options(yield_per=chunk_size)
+                )
+                seen = [0]
+
+                def day_rows():
+                    for et, d, uid, ts, w in result:
+                        seen[0] += 1
+                        yield {"event_type": et, "details": d, "user_id": uid, "created_at": ts, "sample_weight": w}
+
+                aggregates = aggregate_rows(day_rows())
+                if aggregates:
+                    self._merge(session, aggregates)
+                total_rows += seen[0]
+                session.commit()
+
+                rebuilt_days += 1
+                day = next_day
+
+        return {"status": "rebuilt", "days": rebuilt_days, "rows": total_rows}
+
+
+rollup_engine = RollupEngine()
+
+
+if __name__ == "__main__":
+    # Usage: python -m utils.rollups rebuild [days]
+    if len(sys.argv) >= 2 and sys.argv[1] == "rebuild":
+        days_arg = int(sys.argv[2]) if len(sys.argv) >= 3 else None
+        print(rollup_engine.rebuild(days_arg))
+    elif len(sys.argv) >= 2 and sys.argv[1] == "prune":
+        print(rollup_engine.prune())
+    else:
+        print("Usage: python -m utils.rollups [rebuild [days] | prune]")
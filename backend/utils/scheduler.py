@@ -0,0 +1,297 @@
+import os
+import json
+import uuid
+import time
+import socket
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update, or_
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select, delete, desc
+from database import engine
+from models import JobLease, JobRun
+from utils.logger import get_logger
+
+log = get_logger("scheduler")
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+TICK_SECONDS = 30
+JOB_HISTORY_DAYS = int(os.getenv("JOB_HISTORY_DAYS", "30"))
+
+
+# --- Cron expressions ---
+
+class CronSchedule:
+    """
+    Standard 5-field cron ("minute hour day-of-month month day-of-week"),
+    evaluated in UTC. Fields accept *, */n, a-b, a-b/n and comma lists;
+    day-of-week is 0-6 with 0 = Sunday. As in cron, when both day fields are
+    restricted a day matches if either does.
+    """
+
+    _BOUNDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(f, lo, hi) for f, (lo, hi) in zip(fields, self._BOUNDS)
+        )
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, lo: int, hi: int) -> set:
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_str = part.split("/", 1)
+                step = int(step_str)
+            if part == "*":
+                start, end = lo, hi
+            elif "-" in part:
+                start, end = (int(x) for x in part.split("-", 1))
+            else:
+                start = end = int(part)
+            if start < lo or end > hi or step < 1:
+                raise ValueError(f"Cron field {field!r} out of range {lo}-{hi}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt: datetime) -> bool:
+        weekday = (dt.weekday() + 1) % 7 # Python: Monday=0; cron: Sunday=0
+        if self._any_day:
+            return weekday in self.weekdays
+        if self._any_weekday:
+            return dt.day in self.days
+        return dt.day in self.days or weekday in self.weekdays
+
+    def next_after(self, after: datetime) -> datetime:
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Four years covers every valid combination (e.g. Feb 29)
+        limit = dt + timedelta(days=366 * 4)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+                continue
+            if dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+                continue
+            return dt
+        raise ValueError(f"Cron expression never fires: {self.expression!r}")
+
+
+# --- Jobs ---
+
+class ScheduledJob:
+    def __init__(self, name: str, schedule: str, func: Callable[[], Optional[dict]], lease_seconds: int):
+        self.name = name
+        self.cron = CronSchedule(schedule)
+        self.func = func
+        self.lease_seconds = lease_seconds
+        self.next_run: Optional[datetime] = None
+        self.running = False
+        self.guard = threading.Lock()
+
+
+class MaintenanceScheduler:
+    """
+    In-process cron for maintenance jobs, started from the app lifespan.
+    Every worker runs the same loop; a JobLease row decides which one actually
+    executes each schedule slot, so jobs run once per slot however many
+    workers are up. Every execution is recorded in JobRun.
+
+    A job's schedule can be overridden with SCHEDULE_<NAME> (e.g.
+    SCHEDULE_SNAPSHOT="5 * * * *"), or disabled with SCHEDULE_<NAME>=off.
+    """
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._task: Optional[asyncio.Task] = None
+        # The loop only keeps weak references to tasks; these keep running jobs alive
+        self._runs: Set[asyncio.Task] = set()
+
+    def add_job(self, name: str, schedule: str, func: Callable[[], Optional[dict]], lease_seconds: int = 900):
+        schedule = os.getenv(f"SCHEDULE_{name.upper()}", schedule)
+        if schedule.lower() == "off":
+            return
+        self.jobs[name] = ScheduledJob(name, schedule, func, lease_seconds)
+
+    # --- Lifecycle ---
+
+    def start(self):
+        if not SCHEDULER_ENABLED or self._task:
+            return
+        now = datetime.utcnow()
+        for job in self.jobs.values():
+            job.next_run = job.cron.next_after(now)
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            now = datetime.utcnow()
+            for job in self.jobs.values():
+                if job.next_run and job.next_run <= now:
+                    slot = job.next_run
+                    job.next_run = job.cron.next_after(now)
+                    # A run that overlaps its next slot skips that slot
+                    if not job.running:
+                        run = asyncio.create_task(self._run_async(job, slot))
+                        self._runs.add(run)
+                        run.add_done_callback(self._runs.discard)
+            await asyncio.sleep(TICK_SECONDS)
+
+    async def _run_async(self, job: ScheduledJob, slot: datetime):
+        try:
+            await run_in_threadpool(self.execute, job.name, slot)
+        except Exception as e:
+            log.exception("Scheduler job crashed", extra={"job": job.name, "error": str(e)})
+
+    # --- Execution ---
+
+    def execute(self, name: str, slot: Optional[datetime] = None) -> Optional[JobRun]:
+        """
+        Runs a job if this worker can take its lease. `slot` is the scheduled
+        time (None for manual runs). Returns the recorded run, or None when
+        another worker holds the lease or already ran this slot.
+        """
+        job = self.jobs[name]
+        with job.guard:
+            if job.running or not self._acquire(job, slot):
+                return None
+            job.running = True
+
+        try:
+            return self._record(job, slot)
+        finally:
+            job.running = False
+            self._release(name)
+
+    def _record(self, job: ScheduledJob, slot: Optional[datetime]) -> JobRun:
+        started = time.perf_counter()
+        with Session(engine) as session:
+            run = JobRun(job_name=job.name, owner=self.owner, trigger="schedule" if slot else "manual")
+            session.add(run)
+            session.commit()
+            session.refresh(run)
+
+            try:
+                result = job.func()
+                # Jobs report soft failures as {"status": "error", ...}
+                failed = isinstance(result, dict) and result.get("status") == "error"
+                run.status = "error" if failed else "success"
+                run.result = json.loads(json.dumps(result, default=str)) if result is not None else None
+                if failed:
+                    run.error = str(result.get("message"))
+            except Exception as e:
+                run.status = "error"
+                run.error = f"{type(e).__name__}: {e}"
+                log.error("Scheduler job failed", extra={"job": job.name, "error": str(e)})
+
+            run.finished_at = datetime.utcnow()
+            run.duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            session.add(run)
+            # Keep history bounded
+            session.exec(delete(JobRun).where(
+                JobRun.job_name == job.name,
+                JobRun.started_at < datetime.utcnow() - timedelta(days=JOB_HISTORY_DAYS)
+            ))
+            session.commit()
+            session.refresh(run)
+            return run
+
+    def _acquire(self, job: ScheduledJob, slot: Optional[datetime]) -> bool:
+        now = datetime.utcnow()
+        values = {"owner": self.owner, "acquired_at": now, "expires_at": now + timedelta(seconds=job.lease_seconds)}
+        conditions = [JobLease.name == job.name, or_(JobLease.expires_at < now, JobLease.owner == self.owner)]
+        if slot:
+            values["last_slot"] = slot
+            conditions.append(or_(JobLease.last_slot == None, JobLease.last_slot < slot))
+
+        with Session(engine) as session:
+            result = session.exec(update(JobLease).where(*conditions).values(**values))
+            if result.rowcount == 1:
+                session.commit()
+                return True
+            if session.get(JobLease, job.name):
+                return False
+            try:
+                session.add(JobLease(name=job.name, **values))
+                session.commit()
+                return True
+            except IntegrityError:
+                # Another worker created the row first
+                session.rollback()
+                return False
+
+    def _release(self, name: str):
+        with Session(engine) as session:
+            session.exec(
+                update(JobLease)
+                .where(JobLease.name == name, JobLease.owner == self.owner)
+                .values(expires_at=datetime.utcnow())
+            )
+            session.commit()
+
+    # --- Reporting ---
+
+    def status(self, session: Session, recent: int = 20) -> List[dict]:
+        leases = {l.name: l for l in session.exec(select(JobLease)).all()}
+        jobs = []
+        for job in self.jobs.values():
+            runs = session.exec(
+                select(JobRun).where(JobRun.job_name == job.name)
+                .order_by(desc(JobRun.started_at)).limit(recent)
+            ).all()
+            durations = [r.duration_ms for r in runs if r.duration_ms is not None]
+            lease = leases.get(job.name)
+            jobs.append({
+                "name": job.name,
+                "schedule": job.cron.expression,
+                "next_run": job.next_run,
+                "running_here": job.running,
+                "lease": {
+                    "owner": lease.owner,
+                    "expires_at": lease.expires_at,
+                    "last_slot": lease.last_slot
+                } if lease else None,
+                "last_run": runs[0] if runs else None,
+                "recent": {
+                    "runs": len(runs),
+                    "failures": sum(1 for r in runs if r.status == "error"),
+                    "avg_ms": round(sum(durations) / len(durations), 2) if durations else None,
+                    "max_ms": max(durations) if durations else None
+                }
+            })
+        return jobs
+
+    def history(self, session: Session, name: Optional[str] = None, limit: int = 50) -> List[JobRun]:
+        query = select(JobRun)
+        if name:
+            query = query.where(JobRun.job_name == name)
+        return session.exec(query.order_by(desc(JobRun.started_at)).limit(limit)).all()
+
+
+scheduler = MaintenanceScheduler()
@@ -0,0 +1,57 @@
+import time
+from datetime import datetime, timedelta
+from sqlmodel import Session, select, delete, col
+from database import engine
+from models import UserSession
+from security import SESSION_EXPIRE_DAYS
+
+REAP_BATCH_SIZE = 500
+
+
+class SessionReaper:
+    """
+    Deletes sessions idle for longer than the expiry window.
+    Works in small id batches, each in its own transaction, so no single
+    statement holds locks on the session table for long.
+    """
+
+    def __init__(self, expire_days: int, batch_size: int = REAP_BATCH_SIZE):
+        self.expire_days = expire_days
+        self.batch_size = batch_size
+        self.last_run = None
+
+    def reap(self):
+        started = time.perf_counter()
+        cutoff = datetime.utcnow() - timedelta(days=self.expire_days)
+        purged = 0
+        batches = 0
+
+        with Session(engine) as session:
+            while True:
+                ids = session.exec(
+                    select(UserSession.id)
+                    .where(UserSession.last_active < cutoff)
+                    .limit(self.batch_size)
+                ).all()
+                if not ids:
+                    break
+
+                session.exec(delete(UserSession).where(col(UserSession.id).in_(ids)))
+                session.commit()
+                purged += len(ids)
+                batches += 1
+
+                if len(ids) < self.batch_size:
+                    break
+
+        self.last_run = {
+            "status": "success",
+            "purged": purged,
+            "batches": batches,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            "finished_at": datetime.utcnow()
+        }
+        return self.last_run
+
+
+session_reaper = SessionReaper(SESSION_EXPIRE_DAYS)
@@ -0,0 +1,210 @@
+import os
+import time
+import queue
+import random
+import hashlib
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import event
+from utils.logger import get_logger
+from utils.sql_profiler import fingerprint, current_route
+
+log = get_logger("sql")
+
+# Statements at or above this duration are logged and kept for browsing
+SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+# Fraction of all statements logged at INFO (0 = off, 1 = everything)
+SAMPLE_RATE = float(os.getenv("SQL_LOG_SAMPLE_RATE", "0"))
+# Capture a plan for the first occurrence of each slow statement shape
+EXPLAIN_SLOW = os.getenv("SQL_EXPLAIN_SLOW", "1") == "1"
+MAX_FINGERPRINTS = 500
+RECENT_KEPT = 200
+EXPLAIN_QUEUE_SIZE = 50
+STATEMENT_CHARS = 2000
+
+
+def _type_runs(values) -> List[str]:
+    """Type names with consecutive repeats collapsed, e.g. ["int x 40", "str"]."""
+    runs = []
+    for v in values:
+        name = type(v).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return [name if n == 1 else f"{name} x {n}" for name, n in runs]
+
+def param_shape(parameters, executemany: bool = False):
+    """Types of the bound parameters, never their values."""
+    if executemany:
+        rows = list(parameters or [])
+        return {"rows": len(rows), "row": param_shape(rows[0]) if rows else None}
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return _type_runs(parameters)
+    return None
+
+
+class SlowQueryLog:
+    """
+    Replaces engine echo with two cheap outputs: a sampled statement log
+    (SQL_LOG_SAMPLE_RATE) and a slow-query log for anything over
+    SQL_SLOW_QUERY_MS. Slow statements are grouped by fingerprint (literals and
+    IN-lists collapsed) with their parameter types, timings and calling routes;
+    the first occurrence of each fingerprint gets an EXPLAIN (EXPLAIN QUERY PLAN
+    on SQLite), run on a background thread with its own connection so the
+    request never waits for it and a failing EXPLAIN can't touch its transaction.
+    Kept in memory per worker, like the SQL profiler's buffer.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self._entries: Dict[str, dict] = {}
+        self._recent = deque(maxlen=RECENT_KEPT)
+        self._lock = threading.Lock()
+        self._explain_queue: "queue.Queue" = queue.Queue(maxsize=EXPLAIN_QUEUE_SIZE)
+        self._worker: Optional[threading.Thread] = None
+        self._local = threading.local()
+
+    def instrument(self, engine):
+        self.engine = engine
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("slow_query_start")
+        if not starts:
+            return
+        ms = (time.perf_counter() - starts.pop()) * 1000
+        if getattr(self._local, "explaining", False):
+            return
+
+        slow = ms >= SLOW_QUERY_MS
+        if not slow and not (SAMPLE_RATE and random.random() < SAMPLE_RATE):
+            return
+
+        # Only statements that get logged pay for normalization
+        shape = fingerprint(statement)
+        fp = hashlib.md5(shape.encode()).hexdigest()[:12]
+        record = {
+            "fingerprint": fp,
+            "sql": shape[:STATEMENT_CHARS],
+            "params": param_shape(parameters, executemany),
+            "ms": round(ms, 2),
+            "route": current_route()
+        }
+        if not slow:
+            log.info("SQL statement", extra=record)
+            return
+
+        log.warning("Slow query", extra=record)
+        if self._remember(fp, shape, record) and EXPLAIN_SLOW and not executemany:
+            self._queue_explain(fp, statement, parameters)
+
+    # --- Slow-query store ---
+
+    def _remember(self, fp: str, shape: str, record: dict) -> bool:
+        """Adds an occurrence; True if this is the first time the fingerprint is seen."""
+        now = datetime.utcnow()
+        with self._lock:
+            self._recent.append({**record, "at": now})
+            entry = self._entries.get(fp)
+            if entry is not None:
+                entry["count"] += 1
+                entry["total_ms"] += record["ms"]
+                entry["max_ms"] = max(entry["max_ms"], record["ms"])
+                entry["last_ms"] = record["ms"]
+                entry["last_seen"] = now
+                if record["route"]:
+                    entry["routes"][record["route"]] = entry["routes"].get(record["route"], 0) + 1
+                return False
+
+            if len(self._entries) >= MAX_FINGERPRINTS:
+                stale = min(self._entries, key=lambda k: self._entries[k]["last_seen"])
+                del self._entries[stale]
+            self._entries[fp] = {
+                "fingerprint": fp,
+                "sql": shape[:STATEMENT_CHARS],
+                "params": record["params"],
+                "count": 1,
+                "total_ms": record["ms"],
+                "max_ms": record["ms"],
+                "last_ms": record["ms"],
+                "first_seen": now,
+                "last_seen": now,
+                "routes": {record["route"]: 1} if record["route"] else {},
+                "plan": None,
+                "plan_error": None
+            }
+            return True
+
+    def entries(self, limit: int = 50, sort: str = "total_ms") -> List[dict]:
+        with self._lock:
+            entries = [
+                {**e, "total_ms": round(e["total_ms"], 2), "avg_ms": round(e["total_ms"] / e["count"], 2), "routes": dict(e["routes"])}
+                for e in self._entries.values()
+            ]
+        return sorted(entries, key=lambda e: e[sort], reverse=True)[:limit]
+
+    def get(self, fp: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(fp)
+            return {**entry, "routes": dict(entry["routes"])} if entry else None
+
+    def recent(self, limit: int = 50) -> List[dict]:
+        with self._lock:
+            return list(self._recent)[-limit:][::-1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._recent.clear()
+
+    # --- EXPLAIN capture ---
+
+    def _queue_explain(self, fp: str, statement: str, parameters):
+        if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            return # EXPLAIN of writes is dialect-specific and not worth the risk
+        if isinstance(parameters, dict):
+            parameters = dict(parameters)
+        elif isinstance(parameters, (list, tuple)):
+            parameters = tuple(parameters)
+        try:
+            self._explain_queue.put_nowait((fp, statement, parameters))
+        except queue.Full:
+            return # Plans are best effort
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._explain_loop, name="slow-query-explain", daemon=True)
+                self._worker.start()
+
+    def _explain_loop(self):
+        self._local.explaining = True
+        while True:
+            fp, statement, parameters = self._explain_queue.get()
+            plan, error = None, None
+            try:
+                plan = self.explain(statement, parameters)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            with self._lock:
+                entry = self._entries.get(fp)
+                if entry is not None:
+                    entry["plan"], entry["plan_error"] = plan, error
+
+    def explain(self, statement: str, parameters=None) -> List[str]:
+        prefix = "EXPLAIN QUERY PLAN " if self.engine.dialect.name == "sqlite" else "EXPLAIN "
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql(prefix + statement, parameters or ()).all()
+            conn.rollback()
+        # SQLite: (id, parent, notused, detail); Postgres: one text line per row
+        return [str(row[-1]) if len(row) == 4 or len(row) == 1 else " | ".join(map(str, row)) for row in rows]
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,164 @@
+import os
+import json
+import threading
+from bisect import bisect_right
+from datetime import datetime
+from typing import Dict, List, Optional
+
+MANIFEST_NAME = "catalog.jsonl"
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+
+def parse_snapshot_time(timestamp: str) -> datetime:
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+
+
+class SnapshotCatalog:
+    """
+    Append-only manifest of snapshot summaries (one JSON object per line,
+    same shape as summary_*.json). Readers keep a time-sorted copy in memory
+    and reload it only when the manifest's mtime/size changes, so queries
+    never list the directory or open per-snapshot files.
+    """
+
+    def __init__(self, storage_path: str):
+        self.storage_path = storage_path
+        self.manifest_path = os.path.join(storage_path, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._signature = None
+        self._entries: List[dict] = []
+        self._times: List[datetime] = []
+        self._breakdown: Dict[str, int] = {}
+
+    # --- Writes ---
+
+    def append(self, summary: dict):
+        """Call after the summary file is on disk."""
+        if not os.path.exists(self.manifest_path):
+            # First write since upgrading: index older summaries (and this one) too,
+            # keeping fields only the manifest records (e.g. deletion_pending)
+            self.rebuild_from_summaries()
+            self.update(summary["raw_file"], summary)
+            return
+        line = json.dumps(summary, separators=(",", ":"))
+        with self._write_lock, open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def update(self, raw_file: str, changes: dict):
+        """Rewrites one entry's fields (None removes a field)."""
+        with self._write_lock:
+            self._load()
+            entries = []
+            for entry in self._entries:
+                entry = public_summary(entry)
+                if entry.get("raw_file") == raw_file:
+                    entry.update(changes)
+                    entry = {k: v for k, v in entry.items() if v is not None}
+                entries.append(entry)
+            self.rewrite(entries)
+
+    def replace(self, remove_raw_files: set, add: List[dict]):
+        """
+        Atomically swaps entries (matched by raw_file) for new ones. Used by
+        compaction; holds the write lock so concurrent appends aren't lost.
+        """
+        with self._write_lock:
+            self._load()
+            kept = [public_summary(e) for e in self._entries if e.get("raw_file") not in remove_raw_files]
+            self.rewrite(kept + add)
+
+    def rewrite(self, summaries: List[dict]):
+        """Atomically replaces the manifest (used by rebuilds and compaction)."""
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for summary in sorted(summaries, key=lambda s: s["timestamp"]):
+                f.write(json.dumps(summary, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def rebuild_from_summaries(self) -> int:
+        """
+        Indexes summary_*.json files (one-off migration, or recovery of a lost
+        manifest). Summaries already merged into a compacted segment are skipped.
+        """
+        summaries = []
+        for f in os.listdir(self.storage_path):
+            if f.startswith("summary_") and f.endswith(".json"):
+                try:
+                    with open(os.path.join(self.storage_path, f)) as file:
+                        summaries.append(json.load(file))
+                except (OSError, ValueError):
+                    continue
+        merged = {f for s in summaries for f in s.get("merged", [])}
+        summaries = [s for s in summaries if s.get("raw_file") not in merged]
+        self.rewrite(summaries)
+        return len(summaries)
+
+    # --- Reads ---
+
+    def _load(self):
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            if not os.path.isdir(self.storage_path):
+                return
+            self.rebuild_from_summaries()
+            stat = os.stat(self.manifest_path)
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+
+        with self._lock:
+            if signature == self._signature:
+                return
+            entries = []
+            with open(self.manifest_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        summary = json.loads(line)
+                        summary["_time"] = parse_snapshot_time(summary["timestamp"])
+                        entries.append(summary)
+                    except (ValueError, KeyError):
+                        continue # Torn trailing line from a crash mid-append
+            entries.sort(key=lambda s: s["_time"])
+
+            breakdown = {}
+            for s in entries:
+                for k, v in s.get("breakdown", {}).items():
+                    breakdown[k] = breakdown.get(k, 0) + v
+
+            self._entries = entries
+            self._times = [s["_time"] for s in entries]
+            self._breakdown = breakdown
+            self._signature = signature
+
+    def between(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+        """Summaries with start < time <= end, oldest first."""
+        self._load()
+        lo = bisect_right(self._times, start) if start else 0
+        hi = bisect_right(self._times, end) if end else len(self._times)
+        return self._entries[lo:hi]
+
+    def latest(self, limit: Optional[int] = None) -> List[dict]:
+        self._load()
+        entries = self._entries[::-1]
+        return entries[:limit] if limit else entries
+
+    def breakdown_totals(self) -> Dict[str, int]:
+        self._load()
+        return dict(self._breakdown)
+
+
+_catalogs: Dict[str, SnapshotCatalog] = {}
+
+def get_catalog(storage_path: str) -> SnapshotCatalog:
+    if storage_path not in _catalogs:
+        _catalogs[storage_path] = SnapshotCatalog(storage_path)
+    return _catalogs[storage_path]
+
+
+def public_summary(entry: dict) -> dict:
+    return {k: v for k, v in entry.items() if not k.startswith("_")}
@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+from datetime import datetime
+from typing import Dict, List
+from utils.block_archive import BlockArchiveWriter, INDEX_SUFFIX
+from utils.snapshot_catalog import get_catalog
+
+LEVEL_HOUR = "hour"
+LEVEL_DAY = "day"
+LEVEL_MONTH = "month"
+SEGMENT_PREFIXES = {LEVEL_DAY: "d", LEVEL_MONTH: "m"}
+
+
+def _level(entry: dict) -> str:
+    return entry.get("level", LEVEL_HOUR)
+
+def summary_name_for(raw_file: str) -> str:
+    """snapshot_<x>.ndjson.gz / snapshot_<x>.json.gz -> summary_<x>.json"""
+    stem = raw_file[len("snapshot_"):]
+    for ext in (".ndjson.gz", ".json.gz"):
+        if stem.endswith(ext):
+            stem = stem[:-len(ext)]
+    return f"summary_{stem}.json"
+
+
+class SnapshotCompactor:
+    """
+    Merges closed hours into daily segments and closed days into monthly ones,
+    so the snapshot directory (and the catalog) grows with months, not hours.
+
+    A segment keeps each input's totals in `series` ([timestamp, total, errors];
+    hourly points for a day, daily points for a month) for the fusion time
+    series, and lists the raw files it replaced in `merged`.
+
+    Each merge is crash-safe and idempotent:
+      1. write the segment data + index (temp file, then rename)
+      2. write the segment summary (temp file, then rename)
+      3. swap inputs for the segment in the catalog (atomic manifest rewrite)
+      4. delete the inputs
+    Anything interrupted after step 2 is finished by `_finish_pending()`.
+    """
+
+    def __init__(self, storage_path: str):
+        self.storage_path = storage_path
+        self.catalog = get_catalog(storage_path)
+
+    def compact(self, now: datetime = None) -> dict:
+        # Snapshot timestamps are local time (SnapshotEngine uses datetime.now())
+        now = now or datetime.now()
+        if not os.path.isdir(self.storage_path):
+            return {"status": "error", "message": "Storage system unavailable"}
+
+        recovered = self._finish_pending()
+        today = now.strftime("%Y%m%d")
+        this_month = now.strftime("%Y%m")
+
+        # 1. Closed hours -> days
+        days: Dict[str, List[dict]] = {}
+        for entry in self.catalog.latest():
+            if _level(entry) == LEVEL_HOUR and entry["timestamp"][:8] < today:
+                days.setdefault(entry["timestamp"][:8], []).append(entry)
+        for day, entries in days.items():
+            self._merge(LEVEL_DAY, day, entries)
+
+        # 2. Closed days -> months (stray hours of a closed month go in too)
+        months: Dict[str, List[dict]] = {}
+        for entry in self.catalog.latest():
+            if _level(entry) != LEVEL_MONTH and entry["timestamp"][:6] < this_month:
+                months.setdefault(entry["timestamp"][:6], []).append(entry)
+        for month, entries in months.items():
+            self._merge(LEVEL_MONTH, month, entries)
+
+        return {
+            "status": "compacted",
+            "days": len(days),
+            "months": len(months),
+            "recovered": recovered,
+            "catalog_entries": len(self.catalog.latest())
+        }
+
+    def _segment_name(self, level: str, key: str) -> str:
+        # Late inputs for an already compacted period get a second segment
+        taken = {e.get("raw_file") for e in self.catalog.latest()}
+        base = f"snapshot_{SEGMENT_PREFIXES[level]}_{key}"
+        name, n = f"{base}.ndjson.gz", 1
+        while name in taken:
+            n += 1
+            name = f"{base}_{n}.ndjson.gz"
+        return name
+
+    def _merge(self, level: str, key: str, entries: List[dict]):
+        entries = sorted(entries, key=lambda e: e["_time"])
+        raw_file = self._segment_name(level, key)
+
+        # 1. Segment data: indexed inputs are copied block-for-block
+        users = set()
+        writer = BlockArchiveWriter(self._path(raw_file))
+        try:
+            for entry in entries:
+                path = self._path(entry["raw_file"])
+                if os.path.exists(path):
+                    writer.append_archive(path, users)
+            writer.close()
+        except Exception:
+            writer.abort()
+            raise
+
+        # 2. Rolled-up summary
+        breakdown: Dict[str, int] = {}
+        for entry in entries:
+            for k, v in entry.get("breakdown", {}).items():
+                breakdown[k] = breakdown.get(k, 0) + v
+        time_ranges = [e["time_range"] for e in entries if e.get("time_range")]
+        first_ids = [e["first_id"] for e in entries if e.get("first_id") is not None]
+        watermarks = [e["watermark_id"] for e in entries if e.get("watermark_id") is not None]
+
+        summary = {
+            "timestamp": entries[-1]["timestamp"],
+            "level": level,
+            "period": key,
+            "stats": {
+                "total": sum(e["stats"]["total"] for e in entries),
+                "errors": sum(e["stats"]["errors"] for e in entries),
+                "users": len(users)
+            },
+            "breakdown": breakdown,
+            "raw_file": raw_file,
+            "merged": [e["raw_file"] for e in entries],
+            "series": [[e["timestamp"], e["stats"]["total"], e["stats"]["errors"]] for e in entries],
+            "first_id": min(first_ids) if first_ids else None,
+            "watermark_id": max(watermarks) if watermarks else None,
+            "time_range": [min(r[0] for r in time_ranges), max(r[1] for r in time_ranges)] if time_ranges else None
+        }
+        self._write_json(summary_name_for(raw_file), summary)
+
+        # 3 + 4. Swap in the catalog, then drop the inputs
+        self._retire(summary, {e["raw_file"] for e in entries})
+
+    def _retire(self, segment: dict, inputs: set):
+        self.catalog.replace(inputs | {segment["raw_file"]}, [segment])
+        for raw_file in segment["merged"]:
+            self._remove(raw_file, raw_file + INDEX_SUFFIX, summary_name_for(raw_file))
+
+    def _finish_pending(self) -> int:
+        """Completes merges whose segment summary was written but whose inputs survive."""
+        segments = []
+        for name in os.listdir(self.storage_path):
+            if not (name.startswith("summary_d_") or name.startswith("summary_m_")) or not name.endswith(".json"):
+                continue
+            try:
+                with open(self._path(name)) as f:
+                    segments.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+        # A day summary left behind by an interrupted month merge is an input, not a segment
+        merged_away = {r for s in segments for r in s.get("merged", [])}
+        catalogued = {e.get("raw_file") for e in self.catalog.latest()}
+        recovered = 0
+        for segment in segments:
+            if segment["raw_file"] in merged_away:
+                continue
+            merged = segment.get("merged", [])
+            pending = segment["raw_file"] not in catalogued or any(r in catalogued for r in merged)
+            leftover_files = any(os.path.exists(self._path(r)) for r in merged)
+            if pending or leftover_files:
+                self._retire(segment, set(merged))
+                recovered += 1
+        return recovered
+
+    # --- File helpers ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.storage_path, name)
+
+    def _write_json(self, name: str, data: dict):
+        tmp = self._path(name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(name))
+
+    def _remove(self, *names: str):
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+
+if __name__ == "__main__":
+    # Usage: python -m utils.snapshot_compactor [storage_path]
+    path = sys.argv[1] if len(sys.argv) >= 2 else os.path.join(os.getcwd(), "archives", "snapshots")
+    print(SnapshotCompactor(path).compact())
@@ -1,16 +1,29 @@
 import os
+import sys
 import json
-import gzip
+import time
+import shutil
 import tempfile
 from datetime import datetime
-from sqlmodel import Session, select, delete
-from database import engine
+from typing import Optional
+from sqlalchemy.schema import CreateTable
+from sqlmodel import Session, select, delete, func, create_engine
+from database import engine as default_engine
 from models import AnalyticsLog
+from utils.snapshot_catalog import get_catalog, public_summary
+from utils.block_archive import BlockArchiveWriter
+from utils.log_partitions import log_partitions
+from utils.logger import get_logger
+
+log = get_logger("snapshot_engine")
+
+SNAPSHOT_CHUNK_SIZE = 5000
 
 class SnapshotEngine:
-    def __init__(self):
+    def __init__(self, storage_path: Optional[str] = None, db_engine=None):
         # Try main directory first, fallback to /tmp if permission denied
-        self.storage_path = os.path.join(os.getcwd(), "archives", "snapshots")
+        self.storage_path = storage_path or os.path.join(os.getcwd(), "archives", "snapshots")
+        self.engine = db_engine or default_engine
         self.enabled = False
         
         try:
@@ -22,78 +35,191 @@ class SnapshotEngine:
             os.remove(test_file)
             self.enabled = True
         except OSError:
-            print(f"WARNING: Main archive dir readonly. Switching to /tmp...")
+            log.warning("Main archive dir readonly; switching to /tmp")
             try:
                 self.storage_path = os.path.join(tempfile.gettempdir(), "zaman_archives")
                 os.makedirs(self.storage_path, exist_ok=True)
                 self.enabled = True
-                print(f"SUCCESS: Using fallback storage at {self.storage_path}")
+                log.info("Using fallback snapshot storage", extra={"path": self.storage_path})
             except OSError as e:
-                print(f"CRITICAL: SnapshotEngine disabled. No writable paths. {e}")
+                log.critical("SnapshotEngine disabled: no writable paths", extra={"error": str(e)})
 
     def take_hourly_snapshot(self):
+        """
+        Streams every log up to a fixed id watermark into a block-indexed gzip
+        NDJSON file (see utils.block_archive), then deletes exactly those rows in id-range chunks. Rows inserted while
+        the snapshot runs sit above the watermark and are kept for the next one.
+        Memory stays flat regardless of table size.
+        """
         if not self.enabled:
             return {"status": "error", "message": "Storage system unavailable"}
 
-        cutoff_date = datetime.utcnow()
+        catalog = get_catalog(self.storage_path)
+
+        # 0. Finish a deletion interrupted by a crash, so nothing is snapshotted twice.
+        # Only while it is marked pending: once done, ids up to the watermark may
+        # belong to new rows (SQLite tables created without AUTOINCREMENT reuse them)
+        previous = catalog.latest(limit=1)
+        if previous and previous[0].get("deletion_pending"):
+            self._delete_up_to(previous[0]["watermark_id"], previous[0].get("first_id"))
+            catalog.update(previous[0]["raw_file"], {"deletion_pending": None})
 
-        with Session(engine) as session:
-            logs = session.exec(select(AnalyticsLog)).all()
-            
-            if not logs:
-                return {"status": "skipped", "message": "No logs to snapshot"}
+        with Session(self.engine) as session:
+            first_id, watermark = session.exec(
+                select(func.min(AnalyticsLog.id), func.max(AnalyticsLog.id))
+            ).one()
 
-            # Stats
-            total = len(logs)
-            errors = sum(1 for l in logs if l.event_type == 'ERROR')
-            users = len(set(l.user_id for l in logs if l.user_id))
-            breakdown = {}
-            for l in logs:
-                breakdown[l.event_type] = breakdown.get(l.event_type, 0) + 1
+        if watermark is None:
+            return {"status": "skipped", "message": "No logs to snapshot"}
 
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename_raw = f"snapshot_{timestamp}.json.gz"
-            filename_meta = f"summary_{timestamp}.json"
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename_raw = f"snapshot_{timestamp}.ndjson.gz"
+        filename_meta = f"summary_{timestamp}.json"
+        path_raw = os.path.join(self.storage_path, filename_raw)
+        path_meta = os.path.join(self.storage_path, filename_meta)
 
-            # Prepare Summary
+        try:
+            # 1. Stream rows into the archive, computing stats on the fly
+            stats = self._stream_to_file(first_id, watermark, path_raw)
+
+            # 2. Summary + catalog entry (records the watermark before anything is deleted)
             summary = {
                 "timestamp": timestamp,
-                "stats": { "total": total, "errors": errors, "users": users },
-                "breakdown": breakdown,
-                "raw_file": filename_raw
+                "stats": {"total": stats["total"], "errors": stats["errors"], "users": len(stats["users"])},
+                "breakdown": stats["breakdown"],
+                "raw_file": filename_raw,
+                "first_id": first_id,
+                "watermark_id": watermark,
+                "time_range": [stats["min_time"], stats["max_time"]]
             }
+            with open(path_meta + ".tmp", 'w') as f:
+                json.dump(summary, f)
+            os.replace(path_meta + ".tmp", path_meta)
+            catalog.append({**summary, "deletion_pending": True})
 
-            try:
-                # Save Raw
-                path_raw = os.path.join(self.storage_path, filename_raw)
-                data = [l.model_dump(mode='json') for l in logs]
-                with gzip.open(path_raw, 'wt', encoding='UTF-8') as f:
-                    json.dump(data, f)
-
-                # Save Meta
-                path_meta = os.path.join(self.storage_path, filename_meta)
-                with open(path_meta, 'w') as f:
-                    json.dump(summary, f)
-
-                # Clean DB
-                session.exec(delete(AnalyticsLog))
+            # 3. Clean DB, exactly up to the watermark
+            self._delete_up_to(watermark, first_id)
+            catalog.update(filename_raw, {"deletion_pending": None})
+
+            return {"status": "success", "count": stats["total"], "watermark_id": watermark, "path": path_meta}
+
+        except Exception as e:
+            log.exception("Snapshot failed", extra={"error": str(e)})
+            return {"status": "error", "message": str(e)}
+
+    def _stream_to_file(self, first_id: int, watermark: int, path: str) -> dict:
+        stats = {"total": 0, "errors": 0, "users": set(), "breakdown": {}, "min_time": None, "max_time": None}
+        breakdown = stats["breakdown"]
+        users = stats["users"]
+
+        writer = BlockArchiveWriter(path)
+        try:
+            with Session(self.engine) as session:
+                rows = session.exec(
+                    select(AnalyticsLog.id, AnalyticsLog.event_type, AnalyticsLog.details,
+                           AnalyticsLog.user_id, AnalyticsLog.created_at, AnalyticsLog.sample_weight)
+                    .where(AnalyticsLog.id >= first_id, AnalyticsLog.id <= watermark)
+                    .order_by(AnalyticsLog.id)
+                    .execution_options(yield_per=SNAPSHOT_CHUNK_SIZE)
+                )
+                for log_id, event_type, details, user_id, created_at, weight in rows:
+                    created = created_at.isoformat()
+                    writer.add({
+                        "id": log_id, "event_type": event_type, "details": details,
+                        "user_id": user_id, "created_at": created, "sample_weight": weight
+                    })
+
+                    # Totals are scaled back up for sampled request logs
+                    stats["total"] += weight
+                    if event_type == 'ERROR':
+                        stats["errors"] += weight
+                    if user_id:
+                        users.add(user_id)
+                    breakdown[event_type] = breakdown.get(event_type, 0) + weight
+                    if stats["min_time"] is None or created < stats["min_time"]:
+                        stats["min_time"] = created
+                    if stats["max_time"] is None or created > stats["max_time"]:
+                        stats["max_time"] = created
+            writer.close()
+        except Exception:
+            writer.abort()
+            raise
+        return stats
+
+    def _delete_up_to(self, watermark: int, first_id: Optional[int] = None):
+        """
+        Deletes ids <= watermark in bounded id ranges, one short transaction each.
+        With partitioning, closed partitions holding only such ids are dropped
+        whole first, so only the open period is deleted row by row.
+        """
+        if log_partitions.drop_covered(watermark):
+            first_id = None
+        with Session(self.engine) as session:
+            if first_id is None:
+                first_id = session.exec(
+                    select(func.min(AnalyticsLog.id)).where(AnalyticsLog.id <= watermark)
+                ).one()
+                if first_id is None:
+                    return
+            lo = first_id
+            while lo <= watermark:
+                hi = min(lo + SNAPSHOT_CHUNK_SIZE - 1, watermark)
+                session.exec(delete(AnalyticsLog).where(AnalyticsLog.id >= lo, AnalyticsLog.id <= hi))
                 session.commit()
-                
-                return {"status": "success", "count": total, "path": path_meta}
-                
-            except Exception as e:
-                print(f"Snapshot Failed: {e}")
-                return {"status": "error", "message": str(e)}
+                lo = hi + 1
 
     def get_snapshots(self):
         if not self.enabled or not os.path.exists(self.storage_path):
             return []
         
-        results = []
-        for f in os.listdir(self.storage_path):
-            if f.startswith("summary_") and f.endswith(".json"):
-                try:
-                    with open(os.path.join(self.storage_path, f)) as file:
-                        results.append(json.load(file))
-                except: continue
-        return sorted(results, key=lambda x: x['timestamp'], reverse=True)
\ No newline at end of file
+        # Newest first, straight from the catalog manifest
+        return [public_summary(s) for s in get_catalog(self.storage_path).latest()]
+
+
+def check_id_reuse() -> dict:
+    """
+    Regression check: snapshot, insert, snapshot on a scratch SQLite database,
+    once with AUTOINCREMENT and once with a table from before it (which
+    reuses ids). The second snapshot must archive the rows inserted in between.
+    """
+    results = {}
+    for label, autoincrement in (("autoincrement", True), ("legacy_table", False)):
+        scratch = tempfile.mkdtemp(prefix="snapshot_check_")
+        try:
+            db_engine = create_engine(f"sqlite:///{os.path.join(scratch, 'check.db')}")
+            ddl = str(CreateTable(AnalyticsLog.__table__).compile(db_engine))
+            if not autoincrement:
+                ddl = ddl.replace(" AUTOINCREMENT", "")
+            with db_engine.begin() as conn:
+                conn.exec_driver_sql(ddl)
+            engine_ = SnapshotEngine(os.path.join(scratch, "snapshots"), db_engine)
+
+            def insert(count: int):
+                with Session(db_engine) as session:
+                    session.add_all(AnalyticsLog(event_type="CHECK") for _ in range(count))
+                    session.commit()
+
+            insert(10)
+            first = engine_.take_hourly_snapshot()
+            time.sleep(1.1) # Snapshot files are named by the second
+            insert(5)
+            second = engine_.take_hourly_snapshot()
+            with Session(db_engine) as session:
+                left = session.exec(select(func.count(AnalyticsLog.id))).one()
+            db_engine.dispose()
+            results[label] = {
+                "ok": first.get("count") == 10 and second.get("count") == 5 and left == 0,
+                "first": first.get("count"), "second": second.get("count"), "left": left
+            }
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    # Usage: python -m utils.snapshot_engine check
+    if sys.argv[1:] == ["check"]:
+        outcome = check_id_reuse()
+        print(outcome)
+        sys.exit(0 if all(r["ok"] for r in outcome.values()) else 1)
+    print("Usage: python -m utils.snapshot_engine check")
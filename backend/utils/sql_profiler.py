@@ -0,0 +1,186 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import event
+from utils.latency import route_template
+
+# Headers are for development; the worst-requests buffer is always on
+DEBUG_HEADERS = os.getenv("DEBUG", "0") == "1"
+# Same statement shape this many times in one request = likely N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+# A request is kept in the buffer if it crosses any of these
+SLOW_REQUEST_DB_MS = float(os.getenv("SQL_SLOW_REQUEST_DB_MS", "100"))
+MANY_QUERIES = int(os.getenv("SQL_MANY_QUERIES", "20"))
+WORST_REQUESTS_KEPT = 200
+
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|:\w+|\$\d+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+|\$\d+))*\s*\)")
+_NUMBER = re.compile(r"(?<![\w.])\d+(?:\.\d+)?\b")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """Statement shape with literals and expanded IN-lists collapsed."""
+    shape = _STRING.sub("?", statement)
+    shape = _NUMBER.sub("?", shape)
+    shape = _IN_LIST.sub("(?)", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+
+class RequestProfile:
+    __slots__ = ("method", "path", "route", "scope", "started", "count", "db_ms", "statements")
+
+    def __init__(self, method: str, path: str, scope: Optional[dict] = None):
+        self.method = method
+        self.path = path
+        self.route = None
+        self.scope = scope
+        self.started = datetime.utcnow()
+        self.count = 0
+        self.db_ms = 0.0
+        self.statements: Dict[str, list] = {}  # shape -> [count, total_ms]
+
+    def record(self, statement: str, ms: float):
+        self.count += 1
+        self.db_ms += ms
+        shape = fingerprint(statement)
+        entry = self.statements.get(shape)
+        if entry is None:
+            self.statements[shape] = [1, ms]
+        else:
+            entry[0] += 1
+            entry[1] += ms
+
+    def repeated(self) -> List[dict]:
+        return sorted(
+            (
+                {
+                    "fingerprint": hashlib.md5(shape.encode()).hexdigest()[:12],
+                    "statement": shape[:500],
+                    "count": count,
+                    "total_ms": round(total, 2)
+                }
+                for shape, (count, total) in self.statements.items()
+                if count >= N_PLUS_ONE_THRESHOLD
+            ),
+            key=lambda x: x["count"], reverse=True
+        )
+
+    def report(self, status: int, total_ms: float) -> dict:
+        return {
+            "method": self.method,
+            "route": self.route,
+            "path": self.path,
+            "status": status,
+            "at": self.started,
+            "total_ms": round(total_ms, 2),
+            "db_ms": round(self.db_ms, 2),
+            "queries": self.count,
+            "distinct_statements": len(self.statements),
+            "n_plus_one": self.repeated()
+        }
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("sql_profile", default=None)
+
+
+def current_route() -> Optional[str]:
+    """"METHOD /route/template" of the request running the current statement, if any."""
+    profile = _current.get()
+    if profile is None:
+        return None
+    # The router sets scope["route"] before the endpoint runs; statements from
+    # middleware that runs earlier fall back to the raw path
+    if profile.scope and profile.scope.get("route"):
+        return f"{profile.method} {route_template(profile.scope)}"
+    return f"{profile.method} {profile.path}"
+
+
+class SqlProfiler:
+    """
+    Counts statements and DB time per request through cursor-execute events.
+    The profile lives in a ContextVar, which FastAPI copies into the
+    threadpool for sync endpoints and dependencies, so queries made there are
+    attributed to the right request. Work outside a request isn't profiled.
+    """
+
+    def __init__(self):
+        self._worst = deque(maxlen=WORST_REQUESTS_KEPT)
+        self._lock = threading.Lock()
+
+    def instrument(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    @staticmethod
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("sql_profiler_start", []).append(time.perf_counter())
+
+    @staticmethod
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        profile = _current.get()
+        if profile is None:
+            return
+        starts = conn.info.get("sql_profiler_start")
+        if starts:
+            profile.record(statement, (time.perf_counter() - starts.pop()) * 1000)
+
+    def keep_if_bad(self, report: dict):
+        if report["db_ms"] >= SLOW_REQUEST_DB_MS or report["queries"] >= MANY_QUERIES or report["n_plus_one"]:
+            with self._lock:
+                self._worst.append(report)
+
+    def worst(self, limit: int = 50, sort: str = "db_ms") -> List[dict]:
+        with self._lock:
+            reports = list(self._worst)
+        return sorted(reports, key=lambda r: r[sort], reverse=True)[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._worst.clear()
+
+
+sql_profiler = SqlProfiler()
+
+
+class SqlProfilerMiddleware:
+    """Opens a RequestProfile per HTTP request; adds Server-Timing/X-DB-Queries when DEBUG=1."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], scope)
+        token = _current.set(profile)
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if DEBUG_HEADERS:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", f'db;dur={profile.db_ms:.2f};desc="{profile.count} queries"'.encode()))
+                    headers.append((b"x-db-queries", str(profile.count).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            if profile.count:
+                profile.route = route_template(scope)
+                profile.scope = None
+                sql_profiler.keep_if_bad(profile.report(status["code"], (time.perf_counter() - started) * 1000))
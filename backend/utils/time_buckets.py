@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence, Tuple
+from sqlalchemy import BigInteger, Integer, cast, func
+from database import engine
+
+BUCKET_WIDTHS = {"1m": 60, "5m": 300, "1h": 3600, "1d": 86400}
+_EPOCH = datetime(1970, 1, 1)
+
+
+def epoch_seconds(column):
+    """SQL expression for a naive-UTC timestamp column as whole epoch seconds."""
+    if engine.dialect.name == "postgresql":
+        return cast(func.floor(func.extract("epoch", column)), BigInteger)
+    # SQLite keeps timestamps as ISO text
+    return cast(func.strftime("%s", column), Integer)
+
+def bucket_index(column, width: int):
+    """
+    Bucket number of a timestamp column for `width`-second buckets, computed in
+    SQL so rows can be GROUPed BY it. Buckets are aligned to the epoch, so 1h
+    and 1d buckets start on the hour / at UTC midnight.
+    """
+    if engine.dialect.name == "postgresql":
+        return cast(func.floor(func.extract("epoch", column) / width), BigInteger)
+    # Floor division: SQLAlchemy 2.0 compiles "/" on integers as true division
+    return epoch_seconds(column) // width
+
+def index_of(dt: datetime, width: int) -> int:
+    return int((dt - _EPOCH).total_seconds()) // width
+
+def first_index(start: datetime, width: int) -> int:
+    """First bucket starting at or after `start`, so a window never opens with a partial bucket."""
+    return -(-int((start - _EPOCH).total_seconds()) // width)
+
+def start_of(index: int, width: int) -> datetime:
+    return _EPOCH + timedelta(seconds=index * width)
+
+def fill_series(values: Dict[int, Sequence[float]], start: datetime, end: datetime, width: int,
+                fields: Tuple[str, ...]) -> List[dict]:
+    """
+    One point per bucket from the first one starting at or after `start` up to
+    the one containing `end`, zero-filled where `values` (bucket index ->
+    field values) has nothing.
+    """
+    empty = (0,) * len(fields)
+    series = []
+    for index in range(first_index(start, width), index_of(end, width) + 1):
+        point = {"bucket_start": start_of(index, width)}
+        point.update(zip(fields, values.get(index, empty)))
+        series.append(point)
+    return series
+
+def label_for(dt: datetime, width: int, span: timedelta) -> str:
+    if width >= 86400:
+        return dt.strftime("%Y-%m-%d")
+    if span > timedelta(days=1):
+        return dt.strftime("%m-%d %H:%M")
+    return dt.strftime("%H:%M")
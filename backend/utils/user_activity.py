@@ -0,0 +1,173 @@
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select, delete, func, col, desc, asc, or_
+from database import engine
+from models import AnalyticsLog, User, UserActivity
+
+ACTIVE_DAYS = 30
+SORT_FIELDS = ("last_active", "total_actions", "first_seen", "name")
+
+
+class _UserTotals:
+    __slots__ = ("count", "by_type", "first", "last")
+
+    def __init__(self, created_at: datetime):
+        self.count = 0
+        self.by_type: Dict[str, int] = {}
+        self.first = created_at
+        self.last = created_at
+
+    def add(self, event_type: str, created_at: datetime, count: int = 1, last: Optional[datetime] = None):
+        self.count += count
+        self.by_type[event_type] = self.by_type.get(event_type, 0) + count
+        if created_at < self.first:
+            self.first = created_at
+        last = last or created_at
+        if last > self.last:
+            self.last = last
+
+
+class UserActivityTracker:
+    """
+    Keeps UserActivity in step with AnalyticsLog as a flush listener, so the
+    profiling view reads one row per user instead of grouping the whole log.
+    Each flush costs one SELECT ... FOR UPDATE plus one write per user in the
+    batch, however many events those users sent.
+    """
+
+    def apply(self, session: Session, rows: List[dict]):
+        """Merges a batch into UserActivity inside the caller's transaction."""
+        totals: Dict[int, _UserTotals] = {}
+        for row in rows:
+            user_id = row.get("user_id")
+            if user_id is None:
+                continue
+            t = totals.get(user_id)
+            if t is None:
+                t = totals[user_id] = _UserTotals(row["created_at"])
+            t.add(row["event_type"], row["created_at"], row.get("sample_weight") or 1)
+        if not totals:
+            return
+
+        # Another worker may create the same user's row concurrently; retry as an update
+        for attempt in range(3):
+            try:
+                with session.begin_nested():
+                    self._merge(session, totals)
+                return
+            except IntegrityError:
+                if attempt == 2:
+                    raise
+
+    def _merge(self, session: Session, totals: Dict[int, _UserTotals]):
+        existing = session.exec(
+            select(UserActivity).where(col(UserActivity.user_id).in_(totals.keys())).with_for_update()
+        ).all()
+        by_user = {a.user_id: a for a in existing}
+
+        for user_id, t in totals.items():
+            activity = by_user.get(user_id)
+            if activity is None:
+                activity = UserActivity(user_id=user_id, first_seen=t.first, last_active=t.last)
+            activity.total_actions += t.count
+            by_type = dict(activity.actions_by_type or {})
+            for event_type, n in t.by_type.items():
+                by_type[event_type] = by_type.get(event_type, 0) + n
+            # Reassigned (not mutated) so the JSON column is marked dirty
+            activity.actions_by_type = by_type
+            activity.first_seen = min(activity.first_seen, t.first)
+            activity.last_active = max(activity.last_active, t.last)
+            session.add(activity)
+        session.flush()
+
+    # --- Reads ---
+
+    def page(self, session: Session, sort: str = "last_active", order: str = "desc",
+             limit: int = 50, offset: int = 0, search: Optional[str] = None) -> dict:
+        """Users joined to their activity (users without any have zero actions)."""
+        query = select(User, UserActivity).outerjoin(UserActivity, UserActivity.user_id == User.id)
+        count_query = select(func.count(User.id))
+        query = query.where(col(User.deleting_at).is_(None))
+        count_query = count_query.where(col(User.deleting_at).is_(None))
+        if search:
+            match = or_(
+                col(User.username).contains(search, autoescape=True),
+                col(User.display_name).contains(search, autoescape=True)
+            )
+            query = query.where(match)
+            count_query = count_query.where(match)
+
+        column = {
+            "last_active": UserActivity.last_active,
+            "total_actions": func.coalesce(UserActivity.total_actions, 0),
+            "first_seen": UserActivity.first_seen,
+            "name": User.display_name
+        }[sort]
+        direction = desc if order == "desc" else asc
+        # Users who never did anything go last either way
+        query = query.order_by(direction(column).nulls_last(), User.id).offset(offset).limit(limit)
+
+        now = datetime.utcnow()
+        items = []
+        for user, activity in session.exec(query).all():
+            last_active = activity.last_active if activity else None
+            items.append({
+                "user_id": user.id,
+                "name": user.display_name,
+                "username": user.username,
+                "role": "SuperAdmin" if user.is_superadmin else "User",
+                "total_actions": activity.total_actions if activity else 0,
+                "actions_by_type": activity.actions_by_type if activity else {},
+                "first_seen": activity.first_seen if activity else None,
+                "last_active": last_active,
+                "status": "Active" if last_active and last_active > now - timedelta(days=ACTIVE_DAYS) else "Inactive"
+            })
+        return {"items": items, "total": session.exec(count_query).one()}
+
+    # --- Maintenance ---
+
+    def rebuild(self) -> dict:
+        """
+        Recomputes UserActivity from the logs still in the DB (one grouped
+        pass). Logs already archived away are no longer counted, and events
+        flushed while this runs may be missed, so run it while ingestion is quiet.
+        """
+        with Session(engine) as session:
+            result = session.exec(
+                select(
+                    AnalyticsLog.user_id, AnalyticsLog.event_type, func.sum(AnalyticsLog.sample_weight),
+                    func.min(AnalyticsLog.created_at), func.max(AnalyticsLog.created_at)
+                )
+                .where(AnalyticsLog.user_id != None)
+                .group_by(AnalyticsLog.user_id, AnalyticsLog.event_type)
+            ).all()
+
+            totals: Dict[int, _UserTotals] = {}
+            for user_id, event_type, count, first, last in result:
+                t = totals.get(user_id)
+                if t is None:
+                    t = totals[user_id] = _UserTotals(first)
+                t.add(event_type, first, count, last)
+
+            session.exec(delete(UserActivity))
+            for user_id, t in totals.items():
+                session.add(UserActivity(
+                    user_id=user_id, total_actions=t.count, actions_by_type=t.by_type,
+                    first_seen=t.first, last_active=t.last
+                ))
+            session.commit()
+
+        return {"status": "rebuilt", "users": len(totals), "actions": sum(t.count for t in totals.values())}
+
+
+user_activity = UserActivityTracker()
+
+
+if __name__ == "__main__":
+    # Usage: python -m utils.user_activity rebuild
+    if len(sys.argv) >= 2 and sys.argv[1] == "rebuild":
+        print(user_activity.rebuild())
+    else:
+        print("Usage: python -m utils.user_activity rebuild")
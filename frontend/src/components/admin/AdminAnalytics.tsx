@@ -1,8 +1,9 @@
 "use client";
 
-import { useState } from "react";
-import { useQuery, useMutation, useQueryClient } from "@tanstack/react-query";
+import { useState, useEffect } from "react";
+import { useQuery, useInfiniteQuery, useMutation, useQueryClient } from "@tanstack/react-query";
 import api from "@/lib/api";
+import { openEventStream } from "@/lib/sse";
 import { 
     Activity, Layers, Terminal, Database, Users, 
     BarChart2, RefreshCw, Smartphone, Wifi, Play, FileDown, History,
@@ -45,14 +46,46 @@ export default function AdminAnalytics() {
   // 1. Core Stats
   const { data: stats } = useQuery({ queryKey: ['admin-stats'], queryFn: () => api.get("/analytics/stats?days=7").then(res => res.data) });
   const { data: system } = useQuery({ queryKey: ['admin-system'], queryFn: () => api.get("/analytics/system").then(res => res.data) });
-  const { data: profiling } = useQuery({ queryKey: ['admin-profiling'], queryFn: () => api.get("/analytics/users/profiling").then(res => res.data) });
+  const { data: profiling } = useQuery({ queryKey: ['admin-profiling', 'top'], queryFn: () => api.get("/analytics/users/profiling?sort=total_actions&limit=500").then(res => res.data.items) });
   
-  // 2. Live Logs
-  const { data: logs = [] } = useQuery({
-    queryKey: ['admin-logs'],
-    queryFn: () => api.get("/analytics/logs?limit=200").then(res => res.data),
-    refetchInterval: 5000 
+  // 2. Live Logs (keyset pages + an SSE stream of rows newer than the first page)
+  const [logFilters, setLogFilters] = useState({ event_type: '', path: '', status: '', min_latency: '' });
+  const logParams = new URLSearchParams(
+      Object.entries(logFilters).filter(([, v]) => v.trim() !== '').map(([k, v]) => [k, v.trim()])
+  ).toString();
+
+  const logPages = useInfiniteQuery({
+    queryKey: ['admin-logs', logParams],
+    queryFn: ({ pageParam }) => api.get(
+        `/analytics/logs?limit=200&${logParams}${pageParam ? `&cursor=${encodeURIComponent(pageParam)}` : ''}`
+    ).then(res => res.data),
+    initialPageParam: null as string | null,
+    getNextPageParam: (last: any) => last?.next_cursor ?? undefined,
+    enabled: activeTab === 'terminal'
   });
+
+  const [liveLogs, setLiveLogs] = useState<any[]>([]);
+  const [liveStats, setLiveStats] = useState<any>(null);
+  const [streamConnected, setStreamConnected] = useState(false);
+  const firstPage = logPages.data?.pages[0];
+
+  // A new first page (new filters) restarts the stream from its newest row
+  useEffect(() => {
+      setLiveLogs([]);
+      if (activeTab !== 'terminal' || !firstPage) return;
+      return openEventStream(`/analytics/logs/stream?${logParams}`, {
+          lastEventId: firstPage.last_id,
+          onStatus: setStreamConnected,
+          onMessage: ({ event, data }) => {
+              if (event === 'logs') setLiveLogs(prev => [...[...data].reverse(), ...prev].slice(0, 1000));
+              else if (event === 'stats') setLiveStats(data);
+              // Rows were skipped: start over from a fresh first page
+              else if (event === 'gap') queryClient.invalidateQueries({ queryKey: ['admin-logs', logParams] });
+          }
+      });
+  }, [firstPage, activeTab]);
+
+  const logs = [...liveLogs, ...(logPages.data?.pages.flatMap((p: any) => p.items) ?? [])];
   
   // 3. Snapshots
   const { data: snapshots = [] } = useQuery({ 
@@ -264,30 +297,86 @@ export default function AdminAnalytics() {
 
             {/* --- TERMINAL (FULL SCREEN TABLE) --- */}
             {activeTab === 'terminal' && (
-                <motion.div className="h-full p-4">
-                    <SmartTable 
-                        title="ترمینال زنده (Live Logs)" 
-                        data={logs} 
-                        columns={logColumns} 
-                        icon={Terminal}
-                        rowClassName={(l) => l.event_type === 'ERROR' ? "bg-red-500/10 border-l-2 border-l-red-500" : ""}
-                        expandedRowRender={(log) => {
-                            let details = {};
-                            try { details = typeof log.details === 'string' ? JSON.parse(log.details) : log.details; } 
-                            catch { details = { raw: log.details }; }
-                            return (
-                                <div className="p-4 flex gap-6 text-xs text-gray-300 bg-black/40">
-                                    {(details as any).context && (
-                                        <div className="flex flex-col gap-2 min-w-[150px] border-l border-white/10 pl-4 text-gray-400">
-                                            <div className="flex items-center gap-2"><Smartphone size={12}/> {(details as any).context.screen?.width < 768 ? "موبایل" : "دسکتاپ"}</div>
-                                            <div className="flex items-center gap-2"><Wifi size={12}/> {(details as any).context.network?.type || "نامشخص"}</div>
-                                        </div>
-                                    )}
-                                    <div className="flex-1"><JsonTree data={details} /></div>
-                                </div>
-                            );
-                        }}
-                    />
+                <motion.div className="h-full p-4 flex flex-col gap-3">
+                    <div className="flex flex-wrap items-center gap-2 shrink-0">
+                        <select
+                            value={logFilters.event_type}
+                            onChange={(e) => setLogFilters(f => ({ ...f, event_type: e.target.value }))}
+                            className="bg-[#18181b] border border-white/10 rounded-lg px-3 py-1.5 text-xs text-gray-300"
+                        >
+                            <option value="">همه رویدادها</option>
+                            <option value="API_REQ">API_REQ</option>
+                            <option value="ERROR">ERROR</option>
+                        </select>
+                        <input
+                            placeholder="/path..."
+                            value={logFilters.path}
+                            onChange={(e) => setLogFilters(f => ({ ...f, path: e.target.value }))}
+                            className="bg-[#18181b] border border-white/10 rounded-lg px-3 py-1.5 text-xs text-gray-300 font-mono ltr w-48"
+                        />
+                        <select
+                            value={logFilters.status}
+                            onChange={(e) => setLogFilters(f => ({ ...f, status: e.target.value }))}
+                            className="bg-[#18181b] border border-white/10 rounded-lg px-3 py-1.5 text-xs text-gray-300"
+                        >
+                            <option value="">همه وضعیت‌ها</option>
+                            <option value="2xx">2xx</option>
+                            <option value="4xx">4xx</option>
+                            <option value="5xx">5xx</option>
+                        </select>
+                        <input
+                            type="number"
+                            min={0}
+                            placeholder="حداقل تاخیر (ms)"
+                            value={logFilters.min_latency}
+                            onChange={(e) => setLogFilters(f => ({ ...f, min_latency: e.target.value }))}
+                            className="bg-[#18181b] border border-white/10 rounded-lg px-3 py-1.5 text-xs text-gray-300 w-36"
+                        />
+                        <div className="mr-auto flex items-center gap-3 text-[10px] text-gray-400 font-mono">
+                            <span className={clsx("w-2 h-2 rounded-full", streamConnected ? "bg-emerald-500 animate-pulse" : "bg-gray-600")} />
+                            {liveStats && (
+                                <span>
+                                    {liveStats.events}/s · خطا {liveStats.errors}
+                                    {liveStats.avg_latency_ms != null && ` · ${liveStats.avg_latency_ms}ms`}
+                                </span>
+                            )}
+                        </div>
+                    </div>
+                    <div className="flex-1 min-h-0">
+                        <SmartTable 
+                            title="ترمینال زنده (Live Logs)" 
+                            data={logs} 
+                            columns={logColumns} 
+                            icon={Terminal}
+                            rowClassName={(l) => l.event_type === 'ERROR' ? "bg-red-500/10 border-l-2 border-l-red-500" : ""}
+                            expandedRowRender={(log) => {
+                                let details = {};
+                                try { details = typeof log.details === 'string' ? JSON.parse(log.details) : log.details; } 
+                                catch { details = { raw: log.details }; }
+                                return (
+                                    <div className="p-4 flex gap-6 text-xs text-gray-300 bg-black/40">
+                                        {(details as any).context && (
+                                            <div className="flex flex-col gap-2 min-w-[150px] border-l border-white/10 pl-4 text-gray-400">
+                                                <div className="flex items-center gap-2"><Smartphone size={12}/> {(details as any).context.screen?.width < 768 ? "موبایل" : "دسکتاپ"}</div>
+                                                <div className="flex items-center gap-2"><Wifi size={12}/> {(details as any).context.network?.type || "نامشخص"}</div>
+                                            </div>
+                                        )}
+                                        <div className="flex-1"><JsonTree data={details} /></div>
+                                    </div>
+                                );
+                            }}
+                        />
+                    </div>
+                    {logPages.hasNextPage && (
+                        <button
+                            onClick={() => logPages.fetchNextPage()}
+                            disabled={logPages.isFetchingNextPage}
+                            className="shrink-0 self-center px-4 py-2 rounded-xl text-xs font-bold bg-white/5 text-gray-300 hover:bg-white/10 disabled:opacity-50 flex items-center gap-2"
+                        >
+                            <RefreshCw size={14} className={clsx(logPages.isFetchingNextPage && "animate-spin")} />
+                            لاگ‌های قدیمی‌تر
+                        </button>
+                    )}
                 </motion.div>
             )}
 
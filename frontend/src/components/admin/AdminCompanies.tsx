@@ -1,9 +1,9 @@
 "use client";
 
-import { useState, useEffect } from "react";
+import { useState } from "react";
 import api from "@/lib/api";
-import { Search, Plus, Building, Users, Calendar, ArrowUpRight, Loader2 } from "lucide-react";
-import { useQuery } from "@tanstack/react-query";
+import { Search, Plus, Building, Users, Calendar, ArrowUpRight, ChevronLeft, ChevronRight } from "lucide-react";
+import { useQuery, keepPreviousData } from "@tanstack/react-query";
 import CompanySettingsModal from "./CompanySettingsModal"; 
 import clsx from "clsx";
 
@@ -12,40 +12,51 @@ interface CompanyStats {
   name: string;
   user_count: number;
   department_count: number;
+  event_total: number;
   event_stats: {
     approved: number;
     pending: number;
     rejected: number;
+    cancelled: number;
   };
 }
 
+const PAGE_SIZE = 24;
+
+const SORT_OPTIONS = [
+  { value: 'name', label: 'نام' },
+  { value: 'user_count', label: 'تعداد کاربر' },
+  { value: 'department_count', label: 'تعداد دپارتمان' },
+  { value: 'event_total', label: 'تعداد رویداد' },
+  { value: 'pending', label: 'رویدادهای در انتظار' },
+  { value: 'created_at', label: 'تاریخ ایجاد' },
+];
+
 export default function AdminCompanies() {
   const [search, setSearch] = useState("");
+  const [sort, setSort] = useState('name');
+  const [page, setPage] = useState(0);
   const [selectedCompanyId, setSelectedCompanyId] = useState<number | null>(null);
   const [isModalOpen, setIsModalOpen] = useState(false);
 
-  // 1. Fetch Aggregated Stats
-  const { data: companies = [], isLoading, refetch, isError } = useQuery<CompanyStats[]>({
-    queryKey: ['admin', 'companies-stats'],
-    queryFn: async () => {
-      // FIX: Ensure correct path (assuming companies router has prefix)
-      // Also handle potential 404s gracefully
-      try {
-        const res = await api.get("/companies/superadmin/stats");
-        return Array.isArray(res.data) ? res.data : [];
-      } catch (e) {
-        console.error("Failed to fetch company stats", e);
-        return [];
-      }
-    }
+  // 1. Fetch Aggregated Stats (one page, sorted and searched on the server)
+  const { data, isLoading, refetch, isError } = useQuery<{ items: CompanyStats[]; total: number }>({
+    queryKey: ['admin', 'companies-stats', sort, search, page],
+    queryFn: () => {
+      const params = new URLSearchParams({
+        sort,
+        order: sort === 'name' ? 'asc' : 'desc',
+        limit: String(PAGE_SIZE),
+        offset: String(page * PAGE_SIZE),
+      });
+      if (search.trim()) params.set('search', search.trim());
+      return api.get(`/companies/superadmin/stats?${params}`).then(res => res.data);
+    },
+    placeholderData: keepPreviousData
   });
 
-  // FIX: Safety check before filtering
-  const safeCompanies = Array.isArray(companies) ? companies : [];
-  
-  const filtered = safeCompanies.filter(c => 
-    c.name?.toLowerCase().includes(search.toLowerCase())
-  );
+  const companies = data?.items ?? [];
+  const pageCount = Math.max(1, Math.ceil((data?.total ?? 0) / PAGE_SIZE));
 
   const handleCreate = async () => {
      const name = prompt("نام سازمان جدید:");
@@ -81,15 +92,24 @@ export default function AdminCompanies() {
          </button>
       </div>
 
-      {/* Search */}
-      <div className="relative max-w-md">
-         <Search className="absolute right-4 top-3.5 text-gray-500" size={20} />
-         <input 
-            value={search}
-            onChange={e => setSearch(e.target.value)}
-            placeholder="جستجو در سازمان‌ها..."
-            className="w-full bg-[#18181b] border border-white/10 rounded-2xl py-3 pr-12 pl-4 text-white focus:border-blue-500 outline-none transition-colors"
-         />
+      {/* Search & Sort */}
+      <div className="flex flex-col md:flex-row gap-3">
+         <div className="relative max-w-md flex-1">
+            <Search className="absolute right-4 top-3.5 text-gray-500" size={20} />
+            <input 
+               value={search}
+               onChange={e => { setSearch(e.target.value); setPage(0); }}
+               placeholder="جستجو در سازمان‌ها..."
+               className="w-full bg-[#18181b] border border-white/10 rounded-2xl py-3 pr-12 pl-4 text-white focus:border-blue-500 outline-none transition-colors"
+            />
+         </div>
+         <select
+            value={sort}
+            onChange={e => { setSort(e.target.value); setPage(0); }}
+            className="bg-[#18181b] border border-white/10 rounded-2xl px-4 py-3 text-sm text-gray-300 outline-none"
+         >
+            {SORT_OPTIONS.map(o => <option key={o.value} value={o.value}>مرتب‌سازی: {o.label}</option>)}
+         </select>
       </div>
 
       {/* Grid */}
@@ -97,14 +117,14 @@ export default function AdminCompanies() {
          <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
             {[1,2,3].map(i => <div key={i} className="h-48 bg-[#18181b] rounded-3xl animate-pulse" />)}
          </div>
-      ) : isError || safeCompanies.length === 0 ? (
+      ) : isError || companies.length === 0 ? (
          <div className="text-center py-20 bg-[#18181b] rounded-3xl border border-dashed border-white/10">
             <Building className="mx-auto text-gray-600 mb-4" size={48} />
             <p className="text-gray-400">سازمانی یافت نشد یا خطایی رخ داده است.</p>
          </div>
       ) : (
          <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
-            {filtered.map(comp => (
+            {companies.map(comp => (
                <div 
                   key={comp.id} 
                   className="group bg-[#18181b] border border-white/5 rounded-3xl p-6 relative overflow-hidden hover:border-white/10 transition-all hover:shadow-2xl hover:shadow-blue-900/10 cursor-pointer"
@@ -149,6 +169,19 @@ export default function AdminCompanies() {
          </div>
       )}
 
+      {/* Pagination */}
+      {pageCount > 1 && (
+         <div className="flex items-center justify-center gap-4 text-sm text-gray-400">
+            <button onClick={() => setPage(p => Math.max(0, p - 1))} disabled={page === 0} className="p-2 rounded-xl hover:bg-white/5 disabled:opacity-30">
+               <ChevronRight size={18} />
+            </button>
+            <span>{page + 1} / {pageCount}</span>
+            <button onClick={() => setPage(p => Math.min(pageCount - 1, p + 1))} disabled={page >= pageCount - 1} className="p-2 rounded-xl hover:bg-white/5 disabled:opacity-30">
+               <ChevronLeft size={18} />
+            </button>
+         </div>
+      )}
+
       {/* Settings Modal */}
       <CompanySettingsModal 
          isOpen={isModalOpen}
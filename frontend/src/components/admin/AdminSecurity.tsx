@@ -1,16 +1,31 @@
 "use client";
 
-import { useQuery } from "@tanstack/react-query";
+import { useState } from "react";
+import { useQuery, keepPreviousData } from "@tanstack/react-query";
 import api from "@/lib/api";
-import { ShieldAlert, Smartphone, Monitor, Globe, Clock, Trash2 } from "lucide-react";
+import { ShieldAlert, Smartphone, Monitor, Globe, Clock, Trash2, ChevronLeft, ChevronRight, Activity } from "lucide-react";
+import clsx from "clsx";
+
+const PAGE_SIZE = 20;
 
 export default function AdminSecurity() {
-  // Assuming backend adds /analytics/sessions endpoint or similar
-  // For now we mock based on the 'profiling' data we saw in AdminAnalytics
-  const { data: users = [] } = useQuery({
-    queryKey: ['admin-profiling'],
-    queryFn: () => api.get("/analytics/users/profiling").then(res => res.data) 
+  const [sort, setSort] = useState<'last_active' | 'total_actions'>('last_active');
+  const [page, setPage] = useState(0);
+
+  // Reads the per-user activity table (one row per user), paged on the server
+  const { data } = useQuery({
+    queryKey: ['admin-profiling', sort, page],
+    queryFn: () => api.get(`/analytics/users/profiling?sort=${sort}&limit=${PAGE_SIZE}&offset=${page * PAGE_SIZE}`).then(res => res.data),
+    placeholderData: keepPreviousData
   });
+  const users = data?.items ?? [];
+  const total = data?.total ?? 0;
+  const pageCount = Math.max(1, Math.ceil(total / PAGE_SIZE));
+
+  const changeSort = (s: 'last_active' | 'total_actions') => {
+    setSort(s);
+    setPage(0);
+  };
 
   return (
     <div className="space-y-6">
@@ -34,14 +49,28 @@ export default function AdminSecurity() {
             </div>
          </div>
 
-         {/* Active Sessions List (Mocked Visualization) */}
-         <div className="bg-[#1e1e1e] rounded-2xl border border-white/5 overflow-hidden">
-            <div className="p-4 border-b border-white/5 bg-white/[0.02]">
-               <h3 className="font-bold text-white text-sm">آخرین نشست‌های فعال</h3>
+         {/* User Activity */}
+         <div className="bg-[#1e1e1e] rounded-2xl border border-white/5 overflow-hidden flex flex-col">
+            <div className="p-4 border-b border-white/5 bg-white/[0.02] flex items-center justify-between">
+               <h3 className="font-bold text-white text-sm">فعالیت کاربران</h3>
+               <div className="flex gap-1">
+                  <button
+                     onClick={() => changeSort('last_active')}
+                     className={clsx("px-2 py-1 rounded text-[10px] flex items-center gap-1", sort === 'last_active' ? "bg-white/10 text-white" : "text-gray-500 hover:text-white")}
+                  >
+                     <Clock size={12} /> آخرین حضور
+                  </button>
+                  <button
+                     onClick={() => changeSort('total_actions')}
+                     className={clsx("px-2 py-1 rounded text-[10px] flex items-center gap-1", sort === 'total_actions' ? "bg-white/10 text-white" : "text-gray-500 hover:text-white")}
+                  >
+                     <Activity size={12} /> تعداد فعالیت
+                  </button>
+               </div>
             </div>
-            <div className="divide-y divide-white/5 max-h-[250px] overflow-y-auto custom-scrollbar">
-               {users.slice(0, 10).map((u: any, i: number) => (
-                  <div key={i} className="p-4 flex items-center justify-between hover:bg-white/[0.02]">
+            <div className="divide-y divide-white/5 max-h-[250px] overflow-y-auto custom-scrollbar flex-1">
+               {users.map((u: any, i: number) => (
+                  <div key={u.user_id} className="p-4 flex items-center justify-between hover:bg-white/[0.02]">
                      <div className="flex items-center gap-3">
                         <div className="bg-gray-800 p-2 rounded-lg">
                            {i % 2 === 0 ? <Monitor size={16} className="text-blue-400"/> : <Smartphone size={16} className="text-green-400"/>}
@@ -49,9 +78,9 @@ export default function AdminSecurity() {
                         <div>
                            <div className="text-white text-xs font-bold">{u.username}</div>
                            <div className="text-[10px] text-gray-500 flex gap-2">
-                              <span>IP: 192.168.1.{i}</span>
+                              <span>{u.last_active ? new Date(u.last_active).toLocaleString('fa-IR') : '-'}</span>
                               <span>•</span>
-                              <span>{i % 2 === 0 ? "Chrome / Windows" : "Safari / iPhone"}</span>
+                              <span>{u.total_actions} فعالیت</span>
                            </div>
                         </div>
                      </div>
@@ -61,8 +90,17 @@ export default function AdminSecurity() {
                   </div>
                ))}
             </div>
+            <div className="p-2 border-t border-white/5 flex items-center justify-between text-[10px] text-gray-400">
+               <button onClick={() => setPage(p => Math.max(0, p - 1))} disabled={page === 0} className="p-1 rounded hover:bg-white/5 disabled:opacity-30">
+                  <ChevronRight size={14} />
+               </button>
+               <span>{page + 1} / {pageCount}</span>
+               <button onClick={() => setPage(p => Math.min(pageCount - 1, p + 1))} disabled={page >= pageCount - 1} className="p-1 rounded hover:bg-white/5 disabled:opacity-30">
+                  <ChevronLeft size={14} />
+               </button>
+            </div>
          </div>
       </div>
     </div>
   );
-}
\ No newline at end of file
+}
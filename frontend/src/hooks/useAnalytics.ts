@@ -1,74 +1,115 @@
-import { useMutation } from "@tanstack/react-query";
 import api from "@/lib/api";
 import { useEffect } from "react";
-import { onCLS, onINP, onLCP, Metric } from 'web-vitals'; 
+import { onCLS, onINP, onLCP, Metric } from 'web-vitals';
 import { useAuthStore } from "@/stores/authStore"; // Import Auth Store
 
 type EventType = "PERFORMANCE" | "ERROR" | "PWA_ACTION" | "VIEW" | "ACTION" | "RAGE_CLICK" | "DEAD_CLICK";
 
-export function useAnalytics() {
-  const mutation = useMutation({
-    mutationFn: async (payload: { event_type: EventType; details: any }) => {
-      
-      // --- FIX START: Check for Token ---
-      // Do not send analytics if user is not logged in
-      const token = useAuthStore.getState().token;
-      if (!token) return null;
-      // --- FIX END ---
-
-      // FORCE STRINGIFICATION
-      const detailsString = typeof payload.details === 'string' 
-        ? payload.details 
-        : JSON.stringify(payload.details);
-
-      return api.post("/analytics/log", { 
-        event_type: payload.event_type, 
-        details: detailsString 
-      });
-    },
-    onError: (err) => {
-        // Optional: Suppress errors in console to keep it clean
-        if (process.env.NODE_ENV === 'development') {
-            console.error("Analytics Failed to Send:", err);
-        }
+type QueuedEvent = { event_type: EventType; details: string; ts: number };
+
+// --- Shared Batch Queue ---
+// One buffer for every hook instance; flushed to /analytics/log/batch
+const FLUSH_INTERVAL_MS = 5000;
+const MAX_BATCH = 50;
+const baseURL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+
+let queue: QueuedEvent[] = [];
+let flushTimer: ReturnType<typeof setTimeout> | null = null;
+let pageHideBound = false;
+
+function flush() {
+  if (flushTimer) {
+    clearTimeout(flushTimer);
+    flushTimer = null;
+  }
+  if (queue.length === 0) return;
+
+  const events = queue;
+  queue = [];
+
+  api.post("/analytics/log/batch", { events }).catch((err) => {
+    // Optional: Suppress errors in console to keep it clean
+    if (process.env.NODE_ENV === 'development') {
+      console.error("Analytics Failed to Send:", err);
     }
   });
+}
+
+// sendBeacon survives page unload but can't set headers: token goes in the body,
+// and text/plain avoids a CORS preflight
+function flushWithBeacon() {
+  if (queue.length === 0) return;
+  const token = useAuthStore.getState().token;
+  if (!token || typeof navigator === 'undefined' || !navigator.sendBeacon) {
+    flush();
+    return;
+  }
+
+  const body = new Blob([JSON.stringify({ events: queue, token })], { type: "text/plain" });
+  if (navigator.sendBeacon(`${baseURL}/analytics/log/batch`, body)) {
+    queue = [];
+  } else {
+    flush();
+  }
+}
+
+function enqueue(event_type: EventType, details: any) {
+  // Do not send analytics if user is not logged in
+  if (!useAuthStore.getState().token) return;
+
+  // FORCE STRINGIFICATION
+  const detailsString = typeof details === 'string' ? details : JSON.stringify(details);
+  queue.push({ event_type, details: detailsString, ts: Date.now() });
+
+  if (queue.length >= MAX_BATCH) {
+    flush();
+  } else if (!flushTimer) {
+    flushTimer = setTimeout(flush, FLUSH_INTERVAL_MS);
+  }
+}
+
+export function useAnalytics() {
+  // 0. Flush on page hide (tab switch, close, navigation away)
+  useEffect(() => {
+    if (typeof window === 'undefined' || pageHideBound) return;
+    pageHideBound = true;
+
+    const handleVisibility = () => {
+      if (document.visibilityState === 'hidden') flushWithBeacon();
+    };
+    window.addEventListener("pagehide", flushWithBeacon);
+    document.addEventListener("visibilitychange", handleVisibility);
+  }, []);
 
   // 1. Auto-track Web Vitals
   useEffect(() => {
     if (typeof window !== 'undefined') {
-        onCLS((metric: Metric) => mutation.mutate({ event_type: "PERFORMANCE", details: { name: metric.name, value: metric.value } }));
-        onINP((metric: Metric) => mutation.mutate({ event_type: "PERFORMANCE", details: { name: metric.name, value: metric.value } }));
-        onLCP((metric: Metric) => mutation.mutate({ event_type: "PERFORMANCE", details: { name: metric.name, value: metric.value } }));
+        onCLS((metric: Metric) => enqueue("PERFORMANCE", { name: metric.name, value: metric.value }));
+        onINP((metric: Metric) => enqueue("PERFORMANCE", { name: metric.name, value: metric.value }));
+        onLCP((metric: Metric) => enqueue("PERFORMANCE", { name: metric.name, value: metric.value }));
     }
   }, []);
 
   // 2. Auto-track Crashes
   useEffect(() => {
     const handleError = (event: ErrorEvent) => {
-      mutation.mutate({ 
-        event_type: "ERROR", 
-        details: { message: event.message, filename: event.filename, lineno: event.lineno } 
-      });
+      enqueue("ERROR", { message: event.message, filename: event.filename, lineno: event.lineno });
     };
-    
+
     const handleRejection = (event: PromiseRejectionEvent) => {
-        mutation.mutate({
-            event_type: "ERROR",
-            details: { message: "Unhandled Rejection", reason: String(event.reason) }
-        });
+        enqueue("ERROR", { message: "Unhandled Rejection", reason: String(event.reason) });
     };
 
     window.addEventListener("error", handleError);
     window.addEventListener("unhandledrejection", handleRejection);
-    
+
     return () => {
         window.removeEventListener("error", handleError);
         window.removeEventListener("unhandledrejection", handleRejection);
     };
   }, []);
 
-  return { 
-      logEvent: (type: EventType, data: any) => mutation.mutate({ event_type: type, details: data }) 
+  return {
+      logEvent: (type: EventType, data: any) => enqueue(type, data)
   };
-}
\ No newline at end of file
+}
@@ -0,0 +1,86 @@
+import { useAuthStore } from '@/stores/authStore';
+
+const baseURL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+
+export interface StreamMessage {
+  event: string;
+  data: any;
+  id?: string;
+}
+
+interface StreamOptions {
+  lastEventId?: string | number | null;
+  onMessage: (message: StreamMessage) => void;
+  onStatus?: (connected: boolean) => void;
+}
+
+// Server-Sent Events over fetch, since EventSource can't send the Authorization header.
+// Reconnects after drops, resuming with Last-Event-ID. Returns a function that closes the stream.
+export function openEventStream(path: string, { lastEventId, onMessage, onStatus }: StreamOptions): () => void {
+  const controller = new AbortController();
+  let lastId = lastEventId !== null && lastEventId !== undefined ? String(lastEventId) : null;
+  let retryMs = 3000;
+
+  const dispatch = (block: string) => {
+    let event = 'message';
+    let data = '';
+    let id: string | undefined;
+    for (const line of block.split('\n')) {
+      if (line.startsWith(':')) continue; // Heartbeat comment
+      const colon = line.indexOf(':');
+      const field = colon === -1 ? line : line.slice(0, colon);
+      let value = colon === -1 ? '' : line.slice(colon + 1);
+      if (value.startsWith(' ')) value = value.slice(1);
+
+      if (field === 'event') event = value;
+      else if (field === 'data') data = data ? `${data}\n${value}` : value;
+      else if (field === 'id') id = value;
+      else if (field === 'retry' && Number(value) > 0) retryMs = Number(value);
+    }
+    if (id) lastId = id;
+    if (data) onMessage({ event, data: JSON.parse(data), id });
+  };
+
+  const run = async () => {
+    while (!controller.signal.aborted) {
+      try {
+        // 1. Same auth as the axios instance
+        const headers: Record<string, string> = { Accept: 'text/event-stream' };
+        const token = useAuthStore.getState().token;
+        if (token) headers.Authorization = `Bearer ${token}`;
+        if (lastId) headers['Last-Event-ID'] = lastId;
+
+        const res = await fetch(`${baseURL}${path}`, { headers, signal: controller.signal });
+        if (res.status === 401 || res.status === 403) {
+          onStatus?.(false);
+          return; // Retrying won't help
+        }
+        if (!res.ok || !res.body) throw new Error(`Stream failed with ${res.status}`);
+        onStatus?.(true);
+
+        // 2. Messages are separated by a blank line
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          let end;
+          while ((end = buffer.indexOf('\n\n')) !== -1) {
+            dispatch(buffer.slice(0, end));
+            buffer = buffer.slice(end + 2);
+          }
+        }
+      } catch (error) {
+        if (controller.signal.aborted) return;
+      }
+      // 3. Dropped (or 503 when the server is at its stream limit): try again later
+      onStatus?.(false);
+      await new Promise(resolve => setTimeout(resolve, retryMs));
+    }
+  };
+
+  run();
+  return () => controller.abort();
+}